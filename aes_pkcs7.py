@@ -1,5 +1,8 @@
 #!/usr/bin/python3
+import hmac
+
 from binascii      import hexlify, unhexlify
+from hashlib       import sha256
 from Crypto.Cipher import AES
 from Crypto        import Random
 
@@ -44,6 +47,7 @@ class AES_Cipher (object) :
 
     def __init__ (self, hexkey) :
         self.key = unhexlify (hexkey)
+        self.rng = Random.new ()
     # end def __init__
 
     def encrypt (self, raw, iv = None) :
@@ -53,7 +57,7 @@ class AES_Cipher (object) :
         """
         raw = pad (raw, AES.block_size)
         if iv is None :
-            iv = Random.new ().read (AES.block_size)
+            iv = self.rng.read (AES.block_size)
         cipher = AES.new (self.key, AES.MODE_CBC, iv)
         return hexlify (iv + cipher.encrypt (raw))
     # end def encrypt
@@ -70,6 +74,81 @@ class AES_Cipher (object) :
 
 # end class AES_Cipher
 
+class Password_Diff (object) :
+    """ Compare plaintext passwords with encrypted passwords by
+        decrypting the stored value, we never need the IV of the stored
+        password. Encryption is only done for changed passwords with a
+        random IV (or the fixed IV given for regression testing). The
+        object is not modified after creation and can be shared by
+        several threads. The digest is a keyed fingerprint of a
+        plaintext password for detecting changes without decryption,
+        its key is derived from the encryption key.
+    >>> pd   = Password_Diff (AES_Cipher (b'01' * 16))
+    >>> ciph = pd.encrypt ('secret')
+    >>> pd.plaintext (ciph)
+    'secret'
+    >>> pd.changed ('secret', ciph), pd.changed ('secret', [ciph])
+    (False, False)
+    >>> pd.changed ('other', ciph), pd.changed ('secret', None)
+    (True, True)
+    >>> pd.changed ('secret', 'not hex'), pd.changed ('secret', '')
+    (True, True)
+    >>> pd = Password_Diff (AES_Cipher (b'01' * 16), iv = '00' * 16)
+    >>> pd.encrypt ('secret') == pd.encrypt ('secret')
+    True
+    >>> pd.digest ('secret') == pd.digest ('secret')
+    True
+    >>> pd.digest ('secret') == pd.digest ('other')
+    False
+    """
+
+    def __init__ (self, cipher, iv = None) :
+        self.cipher = cipher
+        self.iv     = None
+        if iv :
+            self.iv = unhexlify (iv)
+        self.digest_key = hmac.new \
+            (cipher.key, b'password fingerprint', sha256).digest ()
+    # end def __init__
+
+    def changed (self, plain, stored) :
+        """ True if the encrypted stored password is not plain
+        """
+        return self.plaintext (stored) != plain
+    # end def changed
+
+    def digest (self, plain) :
+        """ Return keyed fingerprint of plain as hex string
+        """
+        d = hmac.new (self.digest_key, plain.encode ('utf-8'), sha256)
+        return d.hexdigest ()
+    # end def digest
+
+    def encrypt (self, plain) :
+        """ Return encrypted password as a string
+        """
+        enc = self.cipher.encrypt (plain.encode ('utf-8'), self.iv)
+        return enc.decode ('ascii')
+    # end def encrypt
+
+    def plaintext (self, stored) :
+        """ Return decrypted stored password or None if it is missing
+            or cannot be decrypted. A list must have a single value.
+        """
+        if isinstance (stored, (list, tuple)) :
+            if len (stored) != 1 :
+                return None
+            stored = stored [0]
+        if not stored :
+            return None
+        try :
+            return self.cipher.decrypt (stored).decode ('utf-8')
+        except (ValueError, IndexError) :
+            return None
+    # end def plaintext
+
+# end class Password_Diff
+
 def main () :
     """
     >>> main ()
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import os
+import re
 import sys
 import pyodbc
 import pytz
@@ -9,12 +10,30 @@ import time
 from argparse         import ArgumentParser
 from ldap3            import Server, Connection, SCHEMA, BASE, LEVEL
 from ldap3            import ALL_ATTRIBUTES, DEREF_NEVER, SUBTREE
+from ldap3            import NO_ATTRIBUTES
 from ldap3            import MODIFY_REPLACE, MODIFY_DELETE, MODIFY_ADD
+from ldap3            import ASYNC, ASYNC_STREAM
+from ldap3.core.results import RESULT_SUCCESS, RESULT_NO_SUCH_OBJECT
+from ldap3.utils.ciDict import CaseInsensitiveDict
+from ldap3.utils.conv   import escape_filter_chars
+from ldap3.core.exceptions import LDAPException
+from ldap3.extend.standard.modifyPassword import ModifyPassword
 from datetime         import datetime
 from ldaptimestamp    import LdapTimeStamp
-from aes_pkcs7        import AES_Cipher
-from binascii         import hexlify, unhexlify
+from aes_pkcs7        import AES_Cipher, Password_Diff
+from sync_state       import Sync_State, Load_Checkpoint
+from sync_state       import fingerprint, normalize
+from ldif_writer      import LDIF_Writer, hash_password, password_schemes
+from binascii         import hexlify
 from traceback        import format_exc
+from threading        import Lock, RLock, Event, Thread, local
+from queue            import Queue, Empty
+from copy             import copy
+from collections      import OrderedDict, namedtuple
+from array            import array
+from bisect           import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing  import get_context
 
 def log_debug (msg) :
     print (msg, file = sys.stderr)
@@ -39,32 +58,42 @@ def log_error (msg) :
 class ApplicationError (Exception) :
     pass
 
-class LDAP_Access (object) :
+# Simple paged results control (RFC 2696)
+paged_oid = '1.2.840.113556.1.4.319'
 
-    def __init__ (self, args, parent) :
-        self.args  = args
-        # FIXME: Poor-mans logger for now
-        self.log = Namespace ()
-        self.log ['debug'] = log_debug
-        self.log ['error'] = log_error
-        self.log ['warn']  = log_warn
-        self.log ['info']  = log_info
+class LDAP_Pool (object) :
+    """ Pool of bound LDAP connections shared by several threads. A
+        thread checks out a connection on first use and keeps it until
+        it calls release, so the usual ldap3 pattern of calling an
+        operation and then looking at result and response of the
+        connection works unchanged. If all connections are in use the
+        thread waits for a connection to be released.
+        Connections older than args.ldap_pool_lifetime seconds (0 means
+        forever) are replaced on checkout, with args.ldap_rebind set to
+        'checkout' a connection that is no longer bound is re-bound.
+    """
 
-        self.parent = parent
-        self.srv    = Server (self.args.uri, get_info = SCHEMA)
-        self.ldcon  = Connection \
-            (self.srv, self.args.bind_dn, self.args.password)
-        self.bind_ldap ()
+    def __init__ (self, args, size, log) :
+        self.args    = args
+        self.log     = log
+        self.size    = size
+        self.srv     = Server (self.args.uri, get_info = SCHEMA)
+        self.idle    = Queue ()
+        self.lock    = Lock ()
+        self.local   = local ()
+        self.created = 0
+        self.in_use  = 0
+        self.waits   = 0
     # end def __init__
 
-    def bind_ldap (self) :
-        while not self.ldcon.bound :
-            self.ldcon.bind ()
-            if not self.ldcon.bound :
+    def bind_ldap (self, ldcon) :
+        while not ldcon.bound :
+            ldcon.bind ()
+            if not ldcon.bound :
                 msg = \
                     ( "Error on LDAP bind: %(description)s: %(message)s"
                       " (code: %(result)s)"
-                    % self.ldcon.result
+                    % ldcon.result
                     )
                 self.log.error (msg)
                 if self.args.terminate :
@@ -72,6 +101,798 @@ class LDAP_Access (object) :
                 time.sleep (5)
     # end def bind_ldap
 
+    def checkout (self) :
+        """ Get an idle connection or create a new one if the pool is
+            not yet full, wait for a released connection otherwise.
+        """
+        create = False
+        with self.lock :
+            if self.idle.empty () and self.created < self.size :
+                self.created += 1
+                create = True
+        if create :
+            entry = self.new_connection ()
+        else :
+            try :
+                entry = self.idle.get_nowait ()
+            except Empty :
+                with self.lock :
+                    self.waits += 1
+                entry = self.idle.get ()
+            ldcon, created = entry
+            lifetime = self.args.ldap_pool_lifetime
+            if lifetime and time.time () - created > lifetime :
+                ldcon.unbind ()
+                entry = self.new_connection ()
+            elif self.args.ldap_rebind == 'checkout' and not ldcon.bound :
+                self.log.warn ("Rebinding LDAP connection")
+                self.bind_ldap (ldcon)
+        with self.lock :
+            self.in_use += 1
+        return entry
+    # end def checkout
+
+    def connection (self) :
+        """ The connection of the current thread
+        """
+        entry = getattr (self.local, 'entry', None)
+        if entry is None :
+            entry = self.local.entry = self.checkout ()
+        return entry [0]
+    # end def connection
+
+    def new_connection (self) :
+        ldcon = Connection (self.srv, self.args.bind_dn, self.args.password)
+        self.bind_ldap (ldcon)
+        return (ldcon, time.time ())
+    # end def new_connection
+
+    def release (self) :
+        """ Return the connection of the current thread to the pool
+        """
+        entry = getattr (self.local, 'entry', None)
+        if entry is not None :
+            self.local.entry = None
+            with self.lock :
+                self.in_use -= 1
+            self.idle.put (entry)
+    # end def release
+
+    def stats (self) :
+        """ Pool utilisation
+        """
+        with self.lock :
+            return Namespace \
+                ( size    = self.size
+                , created = self.created
+                , in_use  = self.in_use
+                , waits   = self.waits
+                )
+    # end def stats
+
+# end class LDAP_Pool
+
+class LDAP_Writer (object) :
+    """ Write operations to LDAP. With args.ldap_write_window set to 0
+        operations are synchronous on the connection of the current
+        thread and return an error message on failure (None on success).
+        Otherwise operations are sent on a separate connection with the
+        ldap3 ASYNC strategy with up to ldap_write_window operations in
+        flight. Errors are then collected for the key (usually the
+        pk_uniqueid of the event being processed) that was current
+        when the operation was sent and retrieved with pop_errors after
+        flush. An operation on a DN with outstanding operations waits
+        for them to complete, this keeps dependent operations on one DN
+        (modify_dn, modify, password change) in order.
+        Observers (e.g. the LDAP_Cache) are notified of each successful
+        write with added, modified, renamed or deleted and with
+        invalidate for the DNs of a failed write.
+    """
+
+    def __init__ (self, ldap) :
+        self.ldap    = ldap
+        self.args    = ldap.args
+        self.log     = ldap.log
+        self.window  = self.args.ldap_write_window
+        self.con     = None
+        self.key     = None
+        self.pending = OrderedDict ()
+        self.dns     = {}
+        self.errors  = {}
+        self.observers = []
+    # end def __init__
+
+    def add (self, dn, attributes, suffix = '', collect = True) :
+        return self.send \
+            ( 'add', (dn,), lambda con : con.add (dn, attributes = attributes)
+            , suffix, collect
+            , event = ('added', (dn, attributes))
+            )
+    # end def add
+
+    def connection (self) :
+        if self.con is None :
+            self.con = Connection \
+                ( self.ldap.srv, self.args.bind_dn, self.args.password
+                , client_strategy = ASYNC
+                )
+            self.ldap.pool.bind_ldap (self.con)
+        return self.con
+    # end def connection
+
+    def complete (self) :
+        """ Wait for the result of the oldest outstanding operation
+        """
+        msgid, op = self.pending.popitem (last = False)
+        name, dns, key, suffix, collect, log_extra, event = op
+        for dn in dns :
+            dn = dn.lower ()
+            self.dns [dn] -= 1
+            if not self.dns [dn] :
+                del self.dns [dn]
+        try :
+            response, result = self.con.get_response (msgid)
+        except LDAPException as cause :
+            result = dict \
+                ( description = cause.__class__.__name__
+                , message     = str (cause)
+                , result      = None
+                )
+        if result ['result'] != RESULT_SUCCESS :
+            msg = self.failed (name, result, suffix, log_extra)
+            if collect and key is not None :
+                self.errors.setdefault (key, []).append (msg)
+            self.notify (('invalidate', dns))
+        else :
+            self.notify (event)
+    # end def complete
+
+    def delete (self, dn, suffix = '', collect = True, name = 'delete') :
+        return self.send \
+            ( name, (dn,), lambda con : con.delete (dn), suffix, collect
+            , event = ('deleted', (dn,))
+            )
+    # end def delete
+
+    def failed (self, name, result, suffix = '', log_extra = '') :
+        msg = \
+            ( ( "Error on LDAP %s: "
+                "%%(description)s: %%(message)s"
+                " (code: %%(result)s)"
+              )
+            % name % result
+            + suffix
+            )
+        self.log.error (msg + log_extra)
+        return msg
+    # end def failed
+
+    def flush (self) :
+        """ Wait for all outstanding operations
+        """
+        while self.pending :
+            self.complete ()
+    # end def flush
+
+    def modify \
+        (self, dn, changes, suffix = '', collect = True, name = 'modify') :
+        return self.send \
+            ( name, (dn,), lambda con : con.modify (dn, changes)
+            , suffix, collect, log_extra = str (changes)
+            , event = ('modified', (dn, changes))
+            )
+    # end def modify
+
+    def modify_dn (self, dn, rdn, suffix = '', collect = True) :
+        newdn = rdn + ',' + dn.split (',', 1)[-1]
+        return self.send \
+            ( 'modify_dn', (dn, newdn), lambda con : con.modify_dn (dn, rdn)
+            , suffix, collect
+            , event = ('renamed', (dn, newdn))
+            )
+    # end def modify_dn
+
+    def modify_password (self, dn, password, collect = False) :
+        """ Password change with the extended operation. Note that by
+            default a failure is only logged.
+        """
+        def call (con) :
+            if con.strategy.sync :
+                return con.extend.standard.modify_password \
+                    (dn, new_password = password)
+            op = ModifyPassword (con, dn, new_password = password)
+            return con.extended (op.request_name, op.request_value)
+        return self.send \
+            ('modify_password', (dn,), call, ' DN=%s' % dn, collect)
+    # end def modify_password
+
+    def notify (self, event) :
+        if event :
+            method, args = event
+            for observer in self.observers :
+                getattr (observer, method) (* args)
+    # end def notify
+
+    def pop_errors (self, key) :
+        """ Error messages collected for key, call after flush
+        """
+        errors = self.errors.pop (key, None)
+        if errors :
+            return '\n'.join (errors)
+    # end def pop_errors
+
+    def send \
+        ( self, name, dns, call, suffix, collect
+        , log_extra = '', event = None
+        ) :
+        if not self.window :
+            ldcon = self.ldap.ldcon
+            if call (ldcon) :
+                self.notify (event)
+                return None
+            self.notify (('invalidate', dns))
+            return self.failed (name, ldcon.result, suffix, log_extra)
+        for dn in dns :
+            self.wait_dn (dn)
+        while len (self.pending) >= self.window :
+            self.complete ()
+        msgid = call (self.connection ())
+        self.pending [msgid] = \
+            (name, dns, self.key, suffix, collect, log_extra, event)
+        for dn in dns :
+            dn = dn.lower ()
+            self.dns [dn] = self.dns.get (dn, 0) + 1
+    # end def send
+
+    def wait_dn (self, dn) :
+        """ Wait until no operation on dn is outstanding
+        """
+        while dn.lower () in self.dns :
+            self.complete ()
+    # end def wait_dn
+
+# end class LDAP_Writer
+
+class LDAP_Watch (object) :
+    """ Watch for entries below base that match a filter with a
+        syncrepl (RFC 4533) search in refreshAndPersist mode on its own
+        connection with the ldap3 ASYNC_STREAM strategy: The server
+        first sends all entries matching the filter and then each entry
+        when it starts to match. Entries that no longer match are sent
+        without attributes and are ignored. The dns are retrieved with
+        pop. If the connection is lost the search is started again and
+        reports all matching entries again. If the server refuses the
+        search the watch is disabled.
+    """
+
+    sync_request_oid   = '1.3.6.1.4.1.4203.1.9.1.1'
+    # syncRequestValue ::= SEQUENCE { mode ENUMERATED refreshAndPersist }
+    sync_request_value = b'\x30\x03\x0a\x01\x03'
+
+    def __init__ (self, ldap, base, filter, attributes) :
+        self.ldap       = ldap
+        self.args       = ldap.args
+        self.log        = ldap.log
+        self.base       = base
+        self.filter     = filter
+        self.attributes = attributes
+        self.con        = None
+        self.disabled   = False
+        self.pending    = []
+    # end def __init__
+
+    def pop (self) :
+        """ Return dns reported since the last call
+        """
+        if self.disabled :
+            return []
+        if self.con is None or self.con.closed :
+            self.start ()
+        dns = self.pending
+        self.pending = []
+        while True :
+            try :
+                e = self.con.strategy.events.get (block = False)
+            except Empty :
+                break
+            if e.get ('type') == 'searchResDone' :
+                self.log.error \
+                    ( "Watch of %s ended: %s: %s, falling back to search"
+                    % (self.base, e.get ('description'), e.get ('message'))
+                    )
+                self.disabled = True
+                self.con.unbind ()
+                break
+            if e.get ('type') == 'searchResEntry' and e.get ('attributes') :
+                dns.append (e ['dn'])
+        return dns
+    # end def pop
+
+    def requeue (self, dns) :
+        """ Return dns not processed to be retrieved with next pop
+        """
+        self.pending [:0] = dns
+    # end def requeue
+
+    def start (self) :
+        self.con = Connection \
+            ( self.ldap.srv, self.args.bind_dn, self.args.password
+            , client_strategy = ASYNC_STREAM
+            )
+        self.ldap.pool.bind_ldap (self.con)
+        # Queue the entries as events, see ldap3 PersistentSearch
+        self.con.strategy.streaming = False
+        self.con.strategy.callback  = None
+        msgid = self.con.search \
+            ( self.base, self.filter
+            , search_scope = SUBTREE
+            , attributes   = self.attributes
+            , controls     =
+                [(self.sync_request_oid, True, self.sync_request_value)]
+            )
+        self.con.strategy.persistent_search_message_id = msgid
+        self.log.info ("Watching %s for %s" % (self.base, self.filter))
+    # end def start
+
+# end class LDAP_Watch
+
+class LDAP_Cache (object) :
+    """ Cache of the LDAP entries directly below the managed base dns
+        indexed by dn (and therefore by cn which is the rdn) and by
+        phonlineUniqueId. Lookups of entries that don't exist are
+        cached, too. The cache is bulk-loaded with a paged search and
+        kept current by the write operations of the etl (it observes
+        the LDAP_Writer). It holds at most size entries with LRU
+        eviction. As long as nothing was evicted for a base dn the
+        cache is complete for it and a miss means the entry doesn't
+        exist. Note that changes by other programs are not seen.
+    """
+
+    def __init__ (self, ldap, bases, size) :
+        self.ldap     = ldap
+        self.size     = size
+        self.bases    = set (b.lower () for b in bases)
+        self.lock     = RLock ()
+        # Entries and absent dns indexed by lower-case dn, LRU order
+        self.entries  = OrderedDict ()
+        self.absent   = OrderedDict ()
+        # Lower-case dns of entries by (base, phonlineUniqueId)
+        self.uids     = {}
+        # (base, phonlineUniqueId) for which all entries are cached
+        self.known    = OrderedDict ()
+        # Base dns for which all entries are cached
+        self.complete = set ()
+        self.hits     = 0
+        self.misses   = 0
+    # end def __init__
+
+    def added (self, dn, attributes) :
+        if not self.manages (dn) :
+            return
+        attrs = CaseInsensitiveDict ()
+        for k in attributes :
+            attrs [k] = self.shape (k, self.values (attributes [k]))
+        with self.lock :
+            self.store (dict (dn = dn, attributes = attrs))
+    # end def added
+
+    def base (self, dn) :
+        return dn.split (',', 1) [-1].lower ()
+    # end def base
+
+    def copy (self, entry) :
+        attrs = CaseInsensitiveDict (entry ['attributes'])
+        return dict (dn = entry ['dn'], attributes = attrs)
+    # end def copy
+
+    def deleted (self, dn) :
+        with self.lock :
+            self.remove (dn)
+            if self.manages (dn) :
+                self.absent [dn.lower ()] = True
+                self.evict ()
+    # end def deleted
+
+    def evict (self) :
+        while len (self.entries) > self.size :
+            key, entry = self.entries.popitem (last = False)
+            self.unindex (entry)
+            self.complete.discard (self.base (key))
+        while len (self.absent) > self.size :
+            self.absent.popitem (last = False)
+        while len (self.known) > self.size :
+            self.known.popitem (last = False)
+    # end def evict
+
+    def get_dn (self, dn) :
+        """ Return tuple (hit, entry), entry is None if it doesn't exist
+        """
+        key = dn.lower ()
+        with self.lock :
+            if key in self.entries :
+                self.hits += 1
+                self.entries.move_to_end (key)
+                return True, self.copy (self.entries [key])
+            if key in self.absent or self.base (key) in self.complete :
+                self.hits += 1
+                return True, None
+            self.misses += 1
+        return False, None
+    # end def get_dn
+
+    def get_uid (self, base, uid) :
+        """ Return tuple (hit, entries) for all entries with uid
+        """
+        k = (base.lower (), str (uid))
+        with self.lock :
+            if k [0] in self.complete or k in self.known :
+                self.hits += 1
+                keys = self.uids.get (k, ())
+                for key in keys :
+                    self.entries.move_to_end (key)
+                return True, list (self.copy (self.entries [x]) for x in keys)
+            self.misses += 1
+        return False, None
+    # end def get_uid
+
+    def invalidate (self, dns) :
+        """ Outcome of a write is unknown: Forget about dns
+        """
+        with self.lock :
+            for dn in dns :
+                self.remove (dn)
+                self.absent.pop (dn.lower (), None)
+                self.complete.discard (self.base (dn))
+    # end def invalidate
+
+    def load (self, base) :
+        """ Bulk-load all entries directly below base
+        """
+        count = 0
+        with self.lock :
+            self.complete.add (base.lower ())
+            for e in self.ldap.ldcon.extend.standard.paged_search \
+                ( base, '(objectClass=*)'
+                , search_scope = LEVEL
+                , attributes   = ALL_ATTRIBUTES
+                , paged_size   = self.ldap.args.ldap_page_size
+                , generator    = True
+                ) :
+                if e.get ('type') != 'searchResEntry' :
+                    continue
+                self.store (e)
+                count += 1
+        self.ldap.log.info ("LDAP cache: %s entries below %s" % (count, base))
+    # end def load
+
+    def manages (self, dn) :
+        return self.base (dn) in self.bases
+    # end def manages
+
+    def modified (self, dn, changes) :
+        key = dn.lower ()
+        with self.lock :
+            self.absent.pop (key, None)
+            if key not in self.entries :
+                return
+            entry = self.entries [key]
+            self.unindex (entry)
+            attrs = entry ['attributes']
+            for k in changes :
+                op, vals = changes [k]
+                vals = self.values (vals)
+                old  = self.values (attrs.get (k, []))
+                if op == MODIFY_ADD :
+                    vals = old + [v for v in vals if v not in old]
+                elif op == MODIFY_DELETE and vals :
+                    vals = [v for v in old if v not in vals]
+                elif op == MODIFY_DELETE :
+                    vals = []
+                if vals :
+                    attrs [k] = self.shape (k, vals)
+                elif k in attrs :
+                    del attrs [k]
+            self.index (entry)
+    # end def modified
+
+    def remove (self, dn) :
+        entry = self.entries.pop (dn.lower (), None)
+        if entry :
+            self.unindex (entry)
+    # end def remove
+
+    def renamed (self, dn, newdn) :
+        with self.lock :
+            entry = self.entries.get (dn.lower ())
+            self.remove (dn)
+            if self.manages (dn) :
+                self.absent [dn.lower ()] = True
+            self.absent.pop (newdn.lower (), None)
+            if entry and self.manages (newdn) :
+                k, v = newdn.split (',', 1) [0].split ('=', 1)
+                entry ['dn'] = newdn
+                entry ['attributes'][k] = self.shape (k, [v])
+                self.store (entry)
+            self.evict ()
+    # end def renamed
+
+    def shape (self, name, values) :
+        """ Format values like in an ldap3 response: Single-valued
+            attributes (according to the schema) are not in a list.
+        """
+        schema = self.ldap.srv.schema
+        single = None
+        if schema and name in schema.attribute_types :
+            single = schema.attribute_types [name].single_value
+        if single or (single is None and len (values) == 1) :
+            return values [0]
+        return list (values)
+    # end def shape
+
+    def index (self, entry) :
+        base  = self.base (entry ['dn'])
+        attrs = entry ['attributes']
+        for uid in self.values (attrs.get ('phonlineUniqueId')) :
+            keys = self.uids.setdefault ((base, str (uid)), [])
+            keys.append (entry ['dn'].lower ())
+    # end def index
+
+    def unindex (self, entry) :
+        base  = self.base (entry ['dn'])
+        attrs = entry ['attributes']
+        for uid in self.values (attrs.get ('phonlineUniqueId')) :
+            k    = (base, str (uid))
+            keys = self.uids.get (k, [])
+            if entry ['dn'].lower () in keys :
+                keys.remove (entry ['dn'].lower ())
+            if not keys :
+                self.uids.pop (k, None)
+            # Other entries with this uid may have been evicted
+            self.known.pop (k, None)
+    # end def unindex
+
+    def store (self, entry) :
+        """ Store copy of entry returned by an LDAP search
+        """
+        if not self.manages (entry ['dn']) :
+            return
+        with self.lock :
+            self.remove (entry ['dn'])
+            entry = self.copy (entry)
+            key   = entry ['dn'].lower ()
+            self.absent.pop (key, None)
+            self.entries [key] = entry
+            self.index (entry)
+            self.evict ()
+    # end def store
+
+    def store_absent (self, dn) :
+        if not self.manages (dn) :
+            return
+        with self.lock :
+            self.remove (dn)
+            self.absent [dn.lower ()] = True
+            self.evict ()
+    # end def store_absent
+
+    def store_uid (self, base, uid, entries) :
+        """ Store result of a search for all entries with uid
+        """
+        if base.lower () not in self.bases :
+            return
+        with self.lock :
+            for entry in entries :
+                self.store (entry)
+            self.known [(base.lower (), str (uid))] = True
+            self.evict ()
+    # end def store_uid
+
+    def values (self, v) :
+        if v is None :
+            return []
+        if isinstance (v, (list, tuple)) :
+            return list (v)
+        return [v]
+    # end def values
+
+# end class LDAP_Cache
+
+class CN_Index (object) :
+    """ Index of the entries directly below all managed base dns by
+        cn with the idnDeleted flag and the account status attributes
+        of each entry. It answers in which instances a cn exists without
+        searching the whole directory. The index is built with paged
+        searches and kept current by the write operations of the etl (it
+        observes the LDAP_Writer like the LDAP_Cache). After a failed
+        write the cn is searched again on next lookup.
+    """
+
+    def __init__ (self, ldap, bases, attributes) :
+        self.ldap   = ldap
+        self.bases  = set (b.lower () for b in bases)
+        self.attrs  = ('idnDeleted',) + tuple (attributes)
+        self.names  = set (a.lower () for a in self.attrs)
+        self.lock   = RLock ()
+        # Entries by lower-case cn, for each cn a dict indexed by
+        # lower-case dn of dicts with dn and attributes
+        self.cns    = {}
+        # Lower-case cns to search again
+        self.stale  = set ()
+    # end def __init__
+
+    def added (self, dn, attributes) :
+        self.store (dn, attributes)
+    # end def added
+
+    def cn (self, dn) :
+        """ Lower-case cn from dn (or cn with or without 'cn=')
+        """
+        rdn = dn.split (',', 1) [0]
+        if rdn.lower ().startswith ('cn=') :
+            rdn = rdn [3:]
+        return rdn.strip ().lower ()
+    # end def cn
+
+    def deleted (self, dn) :
+        with self.lock :
+            self.cns.get (self.cn (dn), {}).pop (dn.lower (), None)
+    # end def deleted
+
+    def entries (self, cn) :
+        """ Return dict of entries with cn indexed by lower-case dn
+        """
+        cn = self.cn (cn)
+        with self.lock :
+            if cn in self.stale :
+                self.refresh (cn)
+            return dict (self.cns.get (cn, {}))
+    # end def entries
+
+    def get_dn (self, cn, base) :
+        """ Return dn of entry with cn below base or None
+        """
+        dn = ','.join (('cn=' + self.cn (cn), base)).lower ()
+        entry = self.entries (cn).get (dn)
+        if entry :
+            return entry ['dn']
+    # end def get_dn
+
+    def invalidate (self, dns) :
+        with self.lock :
+            for dn in dns :
+                self.stale.add (self.cn (dn))
+    # end def invalidate
+
+    def load (self) :
+        """ Load the entries of all managed base dns
+        """
+        count = 0
+        with self.lock :
+            for base in sorted (self.bases) :
+                for e in self.ldap.ldcon.extend.standard.paged_search \
+                    ( base, '(cn=*)'
+                    , search_scope = LEVEL
+                    , attributes   = ('cn',) + self.attrs
+                    , paged_size   = self.ldap.args.ldap_page_size
+                    , generator    = True
+                    ) :
+                    if e.get ('type') != 'searchResEntry' :
+                        continue
+                    self.store (e ['dn'], e ['attributes'])
+                    count += 1
+        self.ldap.log.info ("CN index: %s entries" % count)
+    # end def load
+
+    def lookup (self, cn) :
+        """ Entries with cn not marked deleted, like the result of
+            an LDAP search with only the indexed attributes
+        """
+        return \
+            [ dict (dn = e ['dn'], attributes = e ['attributes'])
+              for e in self.entries (cn).values ()
+              if not e ['attributes'].get ('idnDeleted')
+            ]
+    # end def lookup
+
+    def manages (self, dn) :
+        return dn.split (',', 1) [-1].lower () in self.bases
+    # end def manages
+
+    def modified (self, dn, changes) :
+        with self.lock :
+            entry = self.cns.get (self.cn (dn), {}).get (dn.lower ())
+            if not entry :
+                return
+            attrs = entry ['attributes']
+            for k in changes :
+                if k.lower () not in self.names :
+                    continue
+                op, vals = changes [k]
+                if op == MODIFY_DELETE :
+                    attrs.pop (k, None)
+                elif vals :
+                    attrs [k] = vals [0] if len (vals) == 1 else list (vals)
+    # end def modified
+
+    def refresh (self, cn) :
+        """ Search entries with cn in all managed base dns
+        """
+        self.cns.pop (cn, None)
+        self.stale.discard (cn)
+        for base in sorted (self.bases) :
+            r = self.ldap.ldcon.search \
+                ( base, '(cn=%s)' % escape_filter_chars (cn)
+                , search_scope = LEVEL
+                , attributes   = ('cn',) + self.attrs
+                )
+            if r :
+                for e in self.ldap.ldcon.response :
+                    self.store (e ['dn'], e ['attributes'])
+    # end def refresh
+
+    def renamed (self, dn, newdn) :
+        with self.lock :
+            entry = self.cns.get (self.cn (dn), {}).pop (dn.lower (), None)
+            if entry :
+                self.store (newdn, entry ['attributes'])
+    # end def renamed
+
+    def store (self, dn, attributes) :
+        if not self.manages (dn) :
+            return
+        attrs = CaseInsensitiveDict ()
+        for k in self.attrs :
+            v = attributes.get (k)
+            if v is not None and v != [] :
+                attrs [k] = v
+        with self.lock :
+            entries = self.cns.setdefault (self.cn (dn), {})
+            entries [dn.lower ()] = dict (dn = dn, attributes = attrs)
+    # end def store
+
+# end class CN_Index
+
+class LDAP_Access (object) :
+
+    def __init__ \
+        (self, args, parent, pool = None, cache = None, cn_index = None) :
+        self.args  = args
+        # FIXME: Poor-mans logger for now
+        self.log = Namespace ()
+        self.log ['debug'] = log_debug
+        self.log ['error'] = log_error
+        self.log ['warn']  = log_warn
+        self.log ['info']  = log_info
+
+        self.parent = parent
+        self.pool   = pool
+        if self.pool is None :
+            self.pool = LDAP_Pool \
+                (self.args, self.args.ldap_pool_size, self.log)
+        self.srv    = self.pool.srv
+        self.writer = LDAP_Writer (self)
+        self.cache  = cache
+        if self.cache is None and self.args.ldap_cache_size :
+            self.cache = LDAP_Cache \
+                (self, self.args.base_dn, self.args.ldap_cache_size)
+        if self.cache :
+            self.writer.observers.append (self.cache)
+        self.cn_index = cn_index
+        if self.cn_index :
+            self.writer.observers.append (self.cn_index)
+        # Bind now
+        self.pool.connection ()
+    # end def __init__
+
+    @property
+    def ldcon (self) :
+        return self.pool.connection ()
+    # end def ldcon
+
+    def release (self) :
+        self.pool.release ()
+    # end def release
+
     def get_by_cn (self, cn, base_dn = None) :
         """ Get single item by cn for our basedn or the given dn
         """
@@ -85,6 +906,11 @@ class LDAP_Access (object) :
     def get_by_dn (self, dn) :
         """ Get entry by dn
         """
+        self.writer.wait_dn (dn)
+        if self.cache :
+            hit, entry = self.cache.get_dn (dn)
+            if hit :
+                return entry
         r = self.ldcon.search \
             ( dn, '(objectClass=*)'
             , search_scope = BASE
@@ -93,7 +919,12 @@ class LDAP_Access (object) :
         if r :
             if len (self.ldcon.response) != 1 :
                 self.log.error ("Got more than one record with dn %s" % dn)
+            if self.cache :
+                self.cache.store (self.ldcon.response [0])
             return self.ldcon.response [0]
+        if self.cache :
+            if self.ldcon.result ['result'] == RESULT_NO_SUCH_OBJECT :
+                self.cache.store_absent (dn)
     # end def get_by_dn
 
     def get_entries (self, pk_uniqueid, dn = None) :
@@ -101,20 +932,27 @@ class LDAP_Access (object) :
             Yes: despite the name these are not unique, unfortunately
         """
         dn = dn or self.dn
-        r = self.ldcon.search \
-            ( dn, '(phonlineUniqueId=%s)' % pk_uniqueid
-            , search_scope = LEVEL
-            , attributes   = ALL_ATTRIBUTES
-            )
-        if r :
-            if len (self.ldcon.response) != 1 :
-                self.log.warn \
-                    ( "Got more than one record with pk_uniqueid %s in dn %s"
-                    % (pk_uniqueid, dn)
-                    )
-            # return a copy
-            return self.ldcon.response [:]
-        return []
+        entries = None
+        if self.cache :
+            hit, entries = self.cache.get_uid (dn, pk_uniqueid)
+        if entries is None :
+            r = self.ldcon.search \
+                ( dn, '(phonlineUniqueId=%s)' % pk_uniqueid
+                , search_scope = LEVEL
+                , attributes   = ALL_ATTRIBUTES
+                )
+            if not r and self.ldcon.result ['result'] != RESULT_SUCCESS :
+                return []
+            # use a copy
+            entries = self.ldcon.response [:] if r else []
+            if self.cache :
+                self.cache.store_uid (dn, pk_uniqueid, entries)
+        if len (entries) > 1 :
+            self.log.warn \
+                ( "Got more than one record with pk_uniqueid %s in dn %s"
+                % (pk_uniqueid, dn)
+                )
+        return entries
     # end def get_entries
 
     def search_cn_all (self, cn) :
@@ -128,6 +966,23 @@ class LDAP_Access (object) :
         return []
     # end def search_cn_all
 
+    def abandon_paged (self, base, filter, search_scope) :
+        """ Abandon the last paged search if it was not read to the
+            end, otherwise the server keeps its state: A search with
+            the cookie and a page size of 0 ends it.
+        """
+        ctrl   = self.ldcon.result.get ('controls', {}).get (paged_oid)
+        cookie = ctrl and ctrl ['value'].get ('cookie')
+        if cookie :
+            self.ldcon.search \
+                ( base, filter
+                , search_scope = search_scope
+                , attributes   = NO_ATTRIBUTES
+                , paged_size   = 0
+                , paged_cookie = cookie
+                )
+    # end def abandon_paged
+
     def __getattr__ (self, name) :
         """ Delegate to our ldcon, caching variant """
         if name.startswith ('_') :
@@ -153,6 +1008,197 @@ class Namespace (dict) :
     # end def __getattr__
 # end class Namespace
 
+class Row_Converter (object) :
+    """ Converter from database rows of a table to LDAP attributes.
+        The conversion plan is computed once from the field list, the
+        data conversion functions and the LDAP attribute names, fields
+        in skip are not converted. Rows are wrapped in a named tuple
+        for attribute access to the database fields.
+    """
+
+    def __init__ (self, fields, conversion, ldap_field, skip = ()) :
+        self.fields = tuple (fields)
+        self.record = namedtuple ('Row', self.fields)
+        self.plan   = tuple \
+            ( (i, k, ldap_field [k], conversion.get (k))
+              for i, k in enumerate (self.fields)
+              if k not in skip
+            )
+    # end def __init__
+
+    def row (self, row) :
+        return self.record._make (row)
+    # end def row
+
+    def convert (self, row, raw = ()) :
+        """ Return list of (field, ldap attribute, value), fields in
+            raw are returned unconverted.
+        """
+        result = []
+        for i, k, lk, conv in self.plan :
+            v = row [i]
+            if conv is not None and k not in raw :
+                v = conv (v)
+            result.append ((k, lk, v))
+        return result
+    # end def convert
+
+# end class Row_Converter
+
+class UID_Map (object) :
+    """ Map of phonlineUniqueId to the entries directly below a base dn
+        used by initial_load to find entries no longer in the database.
+        To keep memory usage low we store a sorted array of the unique
+        ids together with the rdn of each entry (the dn suffix is
+        always the base dn) and an array of flags for seen entries.
+        The map is built from a paged search. With start or
+        end only entries with start <= phonlineUniqueId < end are
+        stored, the range is also passed to the server in the filter.
+        For a merge join the given attributes of every entry are kept,
+        too: This needs memory for all compared attribute values of
+        the base dn (or partition), much more than uids and rdns alone.
+        Entries can then also be found by their rdn.
+    """
+
+    def __init__ \
+        ( self, ldcon, base, log
+        , paged_size = 500, attributes = (), start = None, end = None
+        ) :
+        self.base  = base
+        self.attrs = tuple (attributes)
+        self.pos   = 0
+        # Without a range all entries of the base dn are in the map
+        self.complete = not start and end is None
+        self.by_rdn   = None
+        uids  = array ('q')
+        rdns  = []
+        vals  = []
+        attrs = set (('phonlineUniqueId',))
+        attrs.update (self.attrs)
+        flt   = ['(phonlineUniqueId=*)']
+        if start :
+            flt.append ('(phonlineUniqueId>=%d)' % start)
+        if end is not None :
+            flt.append ('(!(phonlineUniqueId>=%d))' % end)
+        if len (flt) > 1 :
+            flt = ['(&%s)' % ''.join (flt)]
+        for e in ldcon.extend.standard.paged_search \
+            ( base, flt [0]
+            , search_scope = LEVEL
+            , attributes   = sorted (attrs)
+            , paged_size   = paged_size
+            , generator    = True
+            ) :
+            if e.get ('type') != 'searchResEntry' :
+                continue
+            atr = e ['attributes']
+            uid = atr ['phonlineUniqueId']
+            if isinstance (uid, type ([])) :
+                uid = uid [0]
+            try :
+                uid = int (uid)
+            except ValueError :
+                log.error ("Invalid phonlineUniqueId: %s: %s" % (e ['dn'], uid))
+                continue
+            # The server might not order phonlineUniqueId numerically
+            if (start and uid < start) or (end is not None and uid >= end) :
+                continue
+            rdn, suffix = e ['dn'].split (',', 1)
+            assert suffix.lower () == base.lower ()
+            uids.append (uid)
+            rdns.append (rdn)
+            if self.attrs :
+                # Missing attributes are returned as empty list
+                vals.append (tuple (atr.get (k) or None for k in self.attrs))
+        order = sorted (range (len (uids)), key = uids.__getitem__)
+        self.uids    = array ('q', (uids [i] for i in order))
+        self.rdns    = [rdns [i] for i in order]
+        self.values  = [vals [i] for i in order] if self.attrs else None
+        self.seen    = bytearray (len (order))
+    # end def __init__
+
+    def __len__ (self) :
+        return len (self.uids)
+    # end def __len__
+
+    def dn (self, idx) :
+        return ','.join ((self.rdns [idx], self.base))
+    # end def dn
+
+    def entry (self, idx) :
+        """ Entry at index idx in the format of an ldap3 response,
+            needs the attributes to be given when building the map.
+        """
+        atr = CaseInsensitiveDict ()
+        for k, v in zip (self.attrs, self.values [idx]) :
+            if v is not None :
+                atr [k] = v
+        return dict (dn = self.dn (idx), attributes = atr)
+    # end def entry
+
+    def find_rdn (self, rdn) :
+        """ Return index of entry with given rdn or None. The rdn is
+            compared case-insensitive, the index sorted by rdn is
+            built on first use.
+        """
+        rdns = self.rdns
+        if self.by_rdn is None :
+            order = sorted \
+                (range (len (rdns)), key = lambda i : rdns [i].lower ())
+            self.by_rdn = array ('q', order)
+        rdn = rdn.lower ()
+        lo, hi = 0, len (self.by_rdn)
+        while lo < hi :
+            mid = (lo + hi) // 2
+            if rdns [self.by_rdn [mid]].lower () < rdn :
+                lo = mid + 1
+            else :
+                hi = mid
+        if lo < len (self.by_rdn) :
+            idx = self.by_rdn [lo]
+            if rdns [idx].lower () == rdn :
+                return idx
+        return None
+    # end def find_rdn
+
+    def lookup (self, uid) :
+        """ Return range of indexes of entries with given uid. Lookups
+            with ascending uids (as in a merge join with a database
+            sorted by uid) continue from the position of the last
+            lookup, otherwise we use a binary search.
+        """
+        uid  = int (uid)
+        uids = self.uids
+        pos  = self.pos
+        if pos and uids [pos - 1] >= uid :
+            pos = bisect_left (uids, uid)
+        else :
+            while pos < len (uids) and uids [pos] < uid :
+                pos += 1
+        end = pos
+        while end < len (uids) and uids [end] == uid :
+            end += 1
+        self.pos = end
+        return range (pos, end)
+    # end def lookup
+
+    def mark_seen (self, uid) :
+        """ Mark all entries with given uid as seen
+        """
+        for idx in self.lookup (uid) :
+            self.seen [idx] = 1
+    # end def mark_seen
+
+    def unseen (self) :
+        """ Iterate over (uid, dn) of entries not seen, sorted by uid
+        """
+        for idx, uid in enumerate (self.uids) :
+            if not self.seen [idx] :
+                yield (uid, self.dn (idx))
+    # end def unseen
+
+# end class UID_Map
+
 def from_db_date (item) :
     """ Note that phonline stores the only date attribute
         "phonlineGebDatum" as a string!
@@ -206,6 +1252,351 @@ def from_multi (item) :
     return item.split (';')
 # end def from_multi
 
+class DB_Connection (object) :
+    """ Long-lived ODBC connection to a DSN. Before handing out a cursor
+        the connection is checked with a cheap query, a dead connection
+        is transparently re-established. Reconnects are counted.
+    """
+
+    def __init__ (self, dsn, log) :
+        self.dsn        = dsn
+        self.log        = log
+        self.cnx        = None
+        self.reconnects = 0
+    # end def __init__
+
+    @property
+    def ping_sql (self) :
+        if self.dsn == 'postgres' :
+            return 'select 1'
+        return 'select 1 from dual'
+    # end def ping_sql
+
+    def close (self) :
+        if self.cnx is not None :
+            try :
+                self.cnx.close ()
+            except pyodbc.Error :
+                pass
+        self.cnx = None
+    # end def close
+
+    def connect (self) :
+        if self.cnx is not None :
+            self.close ()
+            self.reconnects += 1
+            self.log.warn \
+                ( "Reconnecting to %s, reconnects so far: %s"
+                % (self.dsn, self.reconnects)
+                )
+        self.cnx = pyodbc.connect (DSN = self.dsn)
+    # end def connect
+
+    def cursor (self) :
+        """ Return a cursor on a live connection
+        """
+        if self.cnx is None :
+            self.connect ()
+        else :
+            try :
+                cursor = self.cnx.cursor ()
+                cursor.execute (self.ping_sql)
+                cursor.fetchall ()
+                cursor.close ()
+                # End transaction opened by the ping
+                self.cnx.rollback ()
+            except pyodbc.Error as cause :
+                self.log.warn ("Connection to %s lost: %s" % (self.dsn, cause))
+                self.connect ()
+        return self.cnx.cursor ()
+    # end def cursor
+
+# end class DB_Connection
+
+class ETL_Scheduler (object) :
+    """ Backlog-adaptive scheduling of etl runs: For each database we
+        track the backlog (count and oldest event_time of unprocessed
+        eventlog records) and the measured throughput. The batch size
+        of a run is computed from the throughput so that a run takes
+        about args.time_budget seconds (bounded by args.max_records).
+        A database with a backlog is polled again after
+        args.min_sleeptime, an idle database is polled with exponential
+        backoff from args.min_sleeptime up to args.sleeptime (without a
+        min_sleeptime an idle database waits args.sleeptime).
+    """
+
+    min_records = 10
+
+    def __init__ (self, args, instances) :
+        self.args  = args
+        self.state = {}
+        now = time.time ()
+        for inst in instances :
+            self.state [inst] = Namespace \
+                ( due      = now
+                , interval = self.args.min_sleeptime
+                , rate     = None
+                , backlog  = 0
+                , errors   = 0
+                , oldest   = None
+                )
+    # end def __init__
+
+    def batch_size (self, inst) :
+        """ Number of eventlog records to fetch for next run of inst
+        """
+        st = self.state [inst]
+        if st.rate is None :
+            size = 100
+        else :
+            size = int (st.rate * self.args.time_budget)
+        return max (self.min_records, min (size, self.args.max_records))
+    # end def batch_size
+
+    def due (self) :
+        """ Return instances due for an etl run, those with the oldest
+            backlog first.
+        """
+        now = time.time ()
+        due = [i for i in self.state if self.state [i].due <= now]
+        return sorted \
+            ( due
+            , key = lambda i :
+                (self.state [i].oldest is None, self.state [i].oldest or 0)
+            )
+    # end def due
+
+    def sleep (self) :
+        """ Sleep until the next instance is due
+        """
+        now = time.time ()
+        due = min (st.due for st in self.state.values ())
+        if due > now :
+            sleeptime = min (due - now, self.args.sleeptime)
+            if self.args.verbose :
+                log_debug ("Sleeping: %.1f" % sleeptime)
+            time.sleep (sleeptime)
+        elif self.args.verbose :
+            log_debug ("Not sleeping")
+    # end def sleep
+
+    def update (self, inst, limit, count, elapsed, backlog) :
+        """ Update state of inst after an etl run that processed count
+            eventlog records (of at most limit requested) in elapsed
+            seconds. The backlog is a dict indexed by eventlog status
+            with the count and the oldest event_time for each status.
+        """
+        st  = self.state [inst]
+        now = time.time ()
+        if count and elapsed > 0 :
+            rate = count / elapsed
+            if st.rate is None :
+                st.rate = rate
+            else :
+                st.rate = 0.7 * st.rate + 0.3 * rate
+        new_count, new_oldest = backlog.get ('N', (0, None))
+        err_count, err_oldest = backlog.get ('E', (0, None))
+        st.backlog = new_count
+        st.errors  = err_count
+        st.oldest  = min \
+            ((x for x in (new_oldest, err_oldest) if x), default = None)
+        # With a backlog we still wait min_sleeptime: Records stuck in
+        # error state are fetched again with each run and would keep
+        # count >= limit, we must not poll the database without pause.
+        if count >= limit or new_count :
+            st.interval = self.args.min_sleeptime
+        else :
+            st.interval = min \
+                ( self.args.sleeptime
+                , max
+                    ( self.args.min_sleeptime
+                    , st.interval * 2 or self.args.sleeptime
+                    )
+                )
+        st.due = now + st.interval
+        if self.args.verbose :
+            log_debug \
+                ( "Schedule %s: backlog %s, errors %s, oldest %s, "
+                  "rate %.1f/s, next poll in %ss"
+                % ( inst [-1], st.backlog, st.errors, st.oldest
+                  , st.rate or 0, st.interval
+                  )
+                )
+    # end def update
+
+# end class ETL_Scheduler
+
+class PH15_Change (object) :
+    """ Queued change of the PH15_Writethrough: The values (indexed by
+        field name) for cn, the number of failed attempts and the time
+        when it is due for the next attempt.
+    """
+
+    def __init__ (self, cn, values) :
+        self.cn       = cn
+        self.values   = dict (values)
+        self.attempts = 0
+        self.due      = 0
+    # end def __init__
+
+# end class PH15_Change
+
+class PH15_Writethrough (object) :
+    """ Queue of attribute changes written through to ph15. A consumer
+        thread applies them in batches with its own connector (for
+        the ph15 base dn), so the sync of the other instances does not
+        wait for ph15. Changes for the same cn are coalesced, the
+        latest value of a field wins. Failed changes are retried with
+        exponential backoff up to max_attempts times; a newer change
+        for the same cn is merged into a failed one and starts over.
+        The queue is kept in the sync state of the connector: A change
+        is committed with the sync state before the eventlog status of
+        its record is written and removed when it is written to ph15.
+        Changes that failed max_attempts times stay in the sync state
+        marked as failed, they are queued again on the next start.
+        Passwords are stored encrypted.
+    """
+
+    batch_size   = 100
+    max_attempts = 5
+    poll         = 1
+
+    def __init__ (self, connector, start = True) :
+        self.connector = connector
+        self.log       = connector.log
+        self.state     = connector.state
+        self.lock      = Lock ()
+        self.wakeup    = Event ()
+        # Pending changes by lower-case cn in order of arrival
+        self.pending   = OrderedDict ()
+        self.restore ()
+        self.thread    = Thread (target = self.run, daemon = True)
+        if start :
+            self.thread.start ()
+    # end def __init__
+
+    def failed (self, entry, msg) :
+        """ Schedule retry of entry or give up
+        """
+        key = entry.cn.lower ()
+        with self.lock :
+            newer = self.pending.get (key)
+            if newer :
+                values = dict (entry.values)
+                values.update (newer.values)
+                newer.values = values
+                self.persist (newer)
+                return
+            entry.attempts += 1
+            if entry.attempts >= self.max_attempts :
+                self.log.error \
+                    ( "Giving up write-through to ph15 for %s, kept for"
+                      " the next start: %s" % (entry.cn, msg)
+                    )
+                self.persist (entry, failed = True)
+                return
+            entry.due = time.time () + 2 ** entry.attempts
+            self.pending [key] = entry
+    # end def failed
+
+    def persist (self, entry, failed = False) :
+        """ Store entry in the sync state, the caller commits
+        """
+        if not self.state :
+            return
+        values = dict (entry.values)
+        if values.get ('passwort') :
+            values ['passwort'] = self.connector.pwdiff.encrypt \
+                (values ['passwort'])
+        self.state.set_ph15_queue (entry.cn, values, failed)
+    # end def persist
+
+    def process (self, batch) :
+        """ Write batch to ph15, schedule retries of failed entries and
+            remove the others from the sync state.
+        """
+        try :
+            errors = self.connector.write_ph15_batch (batch)
+        except Exception :
+            self.log.error (format_exc ())
+            errors = dict ((e.cn, 'exception') for e in batch)
+        done = []
+        for e in batch :
+            if e.cn in errors :
+                self.failed (e, errors [e.cn])
+            else :
+                done.append (e)
+        with self.lock :
+            # A newer change for the cn must stay in the sync state
+            done = [e.cn for e in done if e.cn.lower () not in self.pending]
+            if self.state :
+                self.state.delete_ph15_queue (done)
+        if self.state :
+            self.state.commit ()
+    # end def process
+
+    def put (self, cn, values) :
+        """ Queue changed values (indexed by field name) for cn
+        """
+        key = cn.lower ()
+        with self.lock :
+            if key in self.pending :
+                entry = self.pending [key]
+                entry.values.update (values)
+                entry.attempts = 0
+                entry.due      = 0
+            else :
+                entry = self.pending [key] = PH15_Change (cn, values)
+            self.persist (entry)
+        self.wakeup.set ()
+    # end def put
+
+    def restore (self) :
+        """ Queue the changes kept in the sync state by an earlier run
+        """
+        if not self.state :
+            return
+        for cn, values, failed in self.state.ph15_queue () :
+            if values.get ('passwort') :
+                values ['passwort'] = self.connector.pwdiff.plaintext \
+                    (values ['passwort'])
+            if failed :
+                self.log.warn ("Retrying write-through to ph15 for %s" % cn)
+            self.pending [cn.lower ()] = PH15_Change (cn, values)
+        if self.pending :
+            self.log.info \
+                ( "Write-through to ph15: %d queued changes"
+                % len (self.pending)
+                )
+    # end def restore
+
+    def run (self) :
+        while True :
+            self.wakeup.wait (self.poll)
+            self.wakeup.clear ()
+            while True :
+                batch = self.take ()
+                if not batch :
+                    break
+                self.process (batch)
+    # end def run
+
+    def take (self) :
+        """ Remove and return up to batch_size entries that are due
+        """
+        now   = time.time ()
+        batch = []
+        with self.lock :
+            for key in list (self.pending) :
+                if len (batch) >= self.batch_size :
+                    break
+                if self.pending [key].due <= now :
+                    batch.append (self.pending.pop (key))
+        return batch
+    # end def take
+
+# end class PH15_Writethrough
+
 class ODBC_Connector (object) :
 
     fields = dict \
@@ -337,6 +1728,15 @@ class ODBC_Connector (object) :
 
     ph15_writethrough = ('vorname', 'nachname', 'emailadresse_st')
 
+    # Deleted entries already synced to the ph by etd
+    gc_filter = '(&(idnSyncDiff=0)(idnDeleted=*))'
+
+    # Oracle allows at most 1000 expressions in an in-list
+    max_in_list = 1000
+
+    # Characters that are escaped in a dn (RFC 4514)
+    dn_special = re.compile (r'[,+"\\<>;=#\x00]|^ | $')
+
     def __init__ (self, args) :
         self.args      = args
         # FIXME: Poor-mans logger for now
@@ -345,23 +1745,41 @@ class ODBC_Connector (object) :
         self.log ['error'] = log_error
         self.log ['warn']  = log_warn
         self.log ['info']  = log_info
-        self.ldap      = LDAP_Access (self.args, self)
-        self.verbose ("Bound to ldap")
+        # Creating an LDIF file needs no LDAP server
+        self.ldap      = None
+        if self.args.action != 'ldif' :
+            self.ldap  = LDAP_Access (self.args, self)
+            self.verbose ("Bound to ldap")
+        if self.ldap and self.ldap.cache :
+            for dn in self.args.base_dn :
+                self.ldap.cache.load (dn)
+        if self.args.action == 'etl' and self.args.cn_index :
+            self.ldap.cn_index = CN_Index \
+                (self.ldap, self.args.base_dn, self.acc_status)
+            self.ldap.writer.observers.append (self.ldap.cn_index)
+            self.ldap.cn_index.load ()
         self.table     = 'benutzer_alle_dirxml_v'
-        self.crypto_iv = None
-        if self.args.crypto_iv :
-            self.crypto_iv = self.args.crypto_iv
         self.aes = AES_Cipher \
             (hexlify (self.args.encryption_password.encode ('utf-8')))
+        self.pwdiff = Password_Diff (self.aes, self.args.crypto_iv)
         self.get_passwords ()
         # copy class dict to local dict
         self.data_conversion = dict (self.data_conversion)
         # and add a bound method
         self.data_conversion ['passwort'] = self.from_password
+        self.make_converters ()
         self.read_only = \
             dict ((r, datetime (2017, 1, 1)) for r in self.args.read_only)
         self.ph15dn = None
         self.ph15db = None
+        self.state  = None
+        if self.args.state_file :
+            self.state = Sync_State (self.args.state_file)
+        self.checkpoint = None
+        if self.args.action == 'initial_load' and self.args.checkpoint_file :
+            self.checkpoint = Load_Checkpoint (self.args.checkpoint_file)
+        # Fingerprints to record after LDAP writes are complete
+        self.state_pending = []
         if self.args.action == 'etl' :
             for n, dn in enumerate (self.args.base_dn) :
                 if 'ph15' in dn :
@@ -373,13 +1791,37 @@ class ODBC_Connector (object) :
                          ) :
                         self.ph15db = self.args.databases [0]
                     break
-        self.do_sleep = True
         # We do not get events when cn changes for ph15, so we put the
         # into this dict and use it to sync ph15 with it (only the event
         # is used, not the actual change)
         self.ph15_change_dn = {}
+        if self.state and self.args.action == 'etl' :
+            # Pending CN changes of an earlier run
+            self.ph15_change_dn = self.state.renames ()
+        # Serializes changes to ph15 from different workers
+        self.ph15_lock = RLock ()
+        self.workers   = {}
+        self.executor  = None
+        # Time of next garbage collection and LDAP_Watch indexed by
+        # base dn, shared with the workers
+        self.gc_due    = {}
+        self.gc_watch  = {}
+        # Persistent database connections indexed by DSN
+        self.db_connections = {}
+        if self.args.action == 'etl' and self.args.workers > 1 :
+            self.executor = ThreadPoolExecutor \
+                (max_workers = self.args.workers)
+        self.ph15_queue = None
+        if self.ph15dn and self.args.ph15_queue :
+            self.ph15_queue = PH15_Writethrough \
+                (self.clone (self.ph15dn, self.ph15db))
     # end def __init__
 
+    @property
+    def is_postgres (self) :
+        return self.db == 'postgres'
+    # end def is_postgres
+
     @property
     def is_ph15 (self) :
         if 'ph15' in self.dn :
@@ -390,77 +1832,228 @@ class ODBC_Connector (object) :
     def action (self) :
         if self.args.action == 'initial_load' :
             self.initial_load ()
+        elif self.args.action == 'ldif' :
+            self.ldif ()
+        elif self.args.action == 'verify_state' :
+            self.verify_state ()
         elif self.args.action == 'etl' :
+            instances = list (zip (self.args.base_dn, self.args.databases))
+            scheduler = ETL_Scheduler (self.args, instances)
             while True :
                 open ('/tmp/liveness', 'w').close ()
-                for dn, db in zip (self.args.base_dn, self.args.databases) :
-                    self.db = db
-                    self.dn = dn
-                    try :
-                        self.verbose ("DB-Connect: %s %s" % (db, dn))
-                        self.cnx    = pyodbc.connect (DSN = db)
-                        self.cursor = self.cnx.cursor ()
-                        self.verbose ("connected.")
-                    except Exception as cause :
-                        raise (ApplicationError (cause))
-                    if not self.is_ph15 :
-                        self.garbage_collect ()
-                    self.etl ()
-                    self.cursor.close ()
-                    self.cnx.close ()
-                if self.ph15db :
+                jobs = []
+                for inst in scheduler.due () :
+                    limit = scheduler.batch_size (inst)
+                    if self.executor :
+                        w   = self.worker (* inst)
+                        job = self.executor.submit (w.run_instance, limit)
+                        jobs.append ((inst, limit, w, job))
+                    else :
+                        self.dn, self.db = inst
+                        result = self.run_instance (limit)
+                        scheduler.update (inst, limit, * result)
+                # Merge results of concurrent workers, the CN changes for
+                # ph15 are processed below after all workers are done.
+                for inst, limit, w, job in jobs :
+                    scheduler.update (inst, limit, * job.result ())
+                    self.ph15_change_dn.update (w.ph15_change_dn)
+                    w.ph15_change_dn = {}
+                if self.executor and self.args.verbose :
+                    st = self.ldap.pool.stats ()
+                    self.log.debug \
+                        ( "LDAP pool: size %(size)s, created %(created)s,"
+                          " in use %(in_use)s, waits %(waits)s" % st
+                        )
+                if self.ldap.cache :
+                    c = self.ldap.cache
+                    self.verbose \
+                        ( "LDAP cache: %s entries, %s hits, %s misses"
+                        % (len (c.entries), c.hits, c.misses)
+                        )
+                if self.ph15db and self.ph15_change_dn :
                     self.db     = self.ph15db
                     self.dn     = self.ph15dn
-                    self.cnx    = pyodbc.connect (DSN = self.db)
-                    self.cursor = self.cnx.cursor ()
-                    self.update_ph15_cn ()
-                    self.cursor.close ()
-                    self.cnx.close ()
-                if self.do_sleep :
-                    self.verbose ("Sleeping: %s" % self.args.sleeptime)
-                    time.sleep (self.args.sleeptime)
-                else :
-                    self.verbose ("Not sleeping")
+                    self.db_connect (self.db)
+                    # The ph15 queue consumer writes concurrently
+                    with self.ph15_lock :
+                        self.update_ph15_cn ()
+                    self.db_release ()
+                scheduler.sleep ()
         else :
             raise ValueError ('Invalid action: %s' % self.args.action)
     # end def action
 
-    def db_iter_part (self, count, start = 0, end = None) :
+    def run_instance (self, limit) :
+        """ Run etl for our current database and base dn with at most
+            limit eventlog records. Returns count of eventlog records
+            processed, the elapsed time and the remaining backlog.
+        """
+        self.verbose ("DB-Connect: %s %s" % (self.db, self.dn))
+        self.db_connect (self.db)
+        self.verbose ("connected.")
+        if self.is_ph15 :
+            self.ph15_lock.acquire ()
+        try :
+            if not self.is_ph15 :
+                self.garbage_collect ()
+            start   = time.time ()
+            count   = self.etl (limit)
+            elapsed = time.time () - start
+            backlog = self.eventlog_backlog ()
+        finally :
+            if self.is_ph15 :
+                self.ph15_lock.release ()
+            self.db_release ()
+            if self.executor :
+                self.ldap.release ()
+        return count, elapsed, backlog
+    # end def run_instance
+
+    def db_connect (self, db) :
+        """ Set cnx and cursor for db. Connections are kept open over
+            several runs and checked before use.
+        """
+        if db not in self.db_connections :
+            self.db_connections [db] = DB_Connection (db, self.log)
+        dbc = self.db_connections [db]
+        try :
+            self.cursor = dbc.cursor ()
+        except Exception as cause :
+            raise (ApplicationError (cause))
+        self.cnx = dbc.cnx
+        if dbc.reconnects :
+            self.verbose ("Reconnects for %s: %s" % (db, dbc.reconnects))
+    # end def db_connect
+
+    def db_release (self) :
+        """ Close cursor and end the transaction, the connection itself
+            is kept. Note that all our updates are committed explicitly.
+            This is called in finally clauses: Errors of a dead
+            connection are only logged, they must not mask the original
+            exception, the connection is checked on next use.
+        """
+        try :
+            self.cursor.close ()
+            self.cnx.rollback ()
+        except pyodbc.Error as cause :
+            self.log.warn ("Release of %s failed: %s" % (self.db, cause))
+    # end def db_release
+
+    def make_converters (self) :
+        """ Converters for our table, the one for ph15 leaves out the
+            fields not synced to ph15. Needs to be called when
+            data_conversion changes.
+        """
+        args = \
+            ( self.fields [self.table]
+            , self.data_conversion
+            , self.odbc_to_ldap_field
+            )
+        self.converter      = Row_Converter (* args)
+        self.converter_ph15 = Row_Converter \
+            (* args, skip = self.not_synced_ph15)
+    # end def make_converters
+
+    @property
+    def sync_converter (self) :
+        """ Converter for comparing with existing LDAP entries
+        """
+        if self.is_ph15 :
+            return self.converter_ph15
+        return self.converter
+    # end def sync_converter
+
+    def clone (self, dn, db) :
+        """ Return connector for processing dn and db concurrently to
+            other instances: It has its own LDAP connection and collects
+            its own CN changes for ph15.
+        """
+        w = copy (self)
+        w.dn = dn
+        w.db = db
+        w.ldap = LDAP_Access \
+            ( self.args, w
+            , pool     = self.ldap.pool
+            , cache    = self.ldap.cache
+            , cn_index = self.ldap.cn_index
+            )
+        w.db_connections = {}
+        w.ph15_change_dn = {}
+        w.state_pending  = []
+        w.data_conversion = dict (self.data_conversion)
+        w.data_conversion ['passwort'] = w.from_password
+        w.make_converters ()
+        return w
+    # end def clone
+
+    def worker (self, dn, db) :
+        """ Return clone for dn and db, workers are kept for the next
+            runs.
+        """
+        if (dn, db) not in self.workers :
+            self.workers [(dn, db)] = self.clone (dn, db)
+        return self.workers [(dn, db)]
+    # end def worker
+
+    def db_select (self, where, params, limit = None) :
+        """ Select rows of our table, with a limit the rows are sorted
+            by pk_uniqueid and at most limit rows are returned.
+        """
         fields = self.fields [self.table]
-        sql    = 'select %s from %s where pk_uniqueid >= ?'
-        params = [start]
-        if end :
-            sql += ' and pk_uniqueid < ?'
-            params.append (end)
-        self.cursor.execute \
-            (sql  % (','.join (fields), self.table), *params)
-        for n, row in enumerate (self.cursor) :
-            yield ((n + count, row))
-    # end def db_iter_part
-
-    def db_iter (self, db) :
-        self.cnx    = pyodbc.connect (DSN = db)
-        self.cursor = self.cnx.cursor ()
-        tbl         = self.table
-        fields      = self.fields [tbl]
-        if db.endswith ('15') :
-            count = 0
-            self.cursor.execute ('select pk_uniqueid from %s' % (tbl))
-            uids = self.cursor.fetchall ()
-            uids = tuple (u [0] for u in sorted (uids, key = lambda x : x [0]))
-            last = 0
-            for i in range (1000, len (uids), 1000) :
-                for x, row in self.db_iter_part (count, last, uids [i]) :
-                    yield ((x, row))
-                count = x
-                last  = uids [i]
-            for x, row in self.db_iter_part (count, last) :
-                yield ((x, row))
-        else :
-            self.cursor.execute ('select %s from %s' % (','.join (fields), tbl))
-            # fetchall is *much* faster
-            for n, row in enumerate (self.cursor.fetchall ()) :
-                yield ((n, row))
+        sql    = 'select %s from %s where %s' \
+            % (','.join (fields), self.table, ' and '.join (where))
+        if limit :
+            sql += ' order by pk_uniqueid'
+            if self.is_postgres :
+                sql += ' limit %d' % limit
+            else :
+                sql = 'select * from (%s) where rownum <= %d' % (sql, limit)
+        self.cursor.execute (sql, *params)
+        return self.cursor.fetchall ()
+    # end def db_select
+
+    def db_iter (self, db, start = 0, end = None) :
+        """ Iterate over the rows of our table sorted by pk_uniqueid,
+            only rows with start <= pk_uniqueid < end if end is given.
+            We page through the table with the last pk_uniqueid seen so
+            memory usage does not depend on the size of the table.
+            Rows with the same pk_uniqueid must not be split across
+            pages: We fetch one row more than the page size, only if
+            it has the same pk_uniqueid as the last row of the page
+            this group is fetched again with the next page.
+        """
+        self.db_connect (db)
+        idx   = self.fields [self.table].index ('pk_uniqueid')
+        size  = self.args.page_size
+        op    = '>='
+        last  = start
+        count = 0
+        while True :
+            where  = ['pk_uniqueid %s ?' % op]
+            params = [last]
+            if end is not None :
+                where.append ('pk_uniqueid < ?')
+                params.append (end)
+            rows = page = self.db_select (where, params, size + 1)
+            if len (page) > size :
+                last = page [size - 1][idx]
+                if page [size][idx] != last :
+                    rows = page [:size]
+                    op   = '>'
+                else :
+                    # The group of the last uid continues, next page
+                    # starts with it
+                    rows = [r for r in page if r [idx] != last]
+                    op   = '>='
+                    if not rows :
+                        # A single uid fills the whole page
+                        rows = self.db_select (['pk_uniqueid = ?'], [last])
+                        op   = '>'
+            for row in rows :
+                yield ((count, row))
+                count += 1
+            if len (page) <= size :
+                break
     # end def db_iter
 
     def delete_in_ldap (self, pk_uniqueid) :
@@ -473,20 +2066,15 @@ class ODBC_Connector (object) :
         """
         uid = self.to_ldap (pk_uniqueid, 'pk_uniqueid')
         m   = []
+        if self.state :
+            self.state.delete (self.dn, pk_uniqueid)
         entries = self.ldap.get_entries (uid) [:]
         for ldrec in entries :
             dn = ldrec ['dn']
             if self.is_ph15 or self.db in self.args.no_etd :
-                r = self.ldap.delete (dn)
+                msg = self.ldap.writer.delete (dn)
                 self.verbose ("Deleting record: %s" % dn)
-                if not r :
-                    msg = \
-                        ( "Error on LDAP delete: "
-                          "%(description)s: %(message)s"
-                          " (code: %(result)s)"
-                        % self.ldap.result
-                        )
-                    self.log.error (msg)
+                if msg :
                     m.append (msg)
             else :
                 changes = {}
@@ -504,16 +2092,9 @@ class ODBC_Connector (object) :
                     timestamp = LdapTimeStamp (datetime.now (pytz.utc))
                     etl_ts = timestamp.as_generalized_time ()
                     changes ['etlTimestamp'] = (MODIFY_REPLACE, [etl_ts])
-                    r = self.ldap.modify (dn, changes)
-                    if not r :
-                        msg = \
-                            ( "Error on LDAP modify: "
-                              "%(description)s: %(message)s"
-                              " (code: %(result)s)"
-                            % self.ldap.result
-                            + "trying to mark deleted: %s" % dn
-                            )
-                        self.log.error (msg)
+                    msg = self.ldap.writer.modify \
+                        (dn, changes, "trying to mark deleted: %s" % dn)
+                    if msg :
                         return msg
         msg = self.delete_in_ldap_ph15 (entries)
         if msg :
@@ -524,7 +2105,8 @@ class ODBC_Connector (object) :
 
     def delete_in_ldap_ph15 (self, entries) :
         """ We check if any of the entries doesn't have an account anymore
-            If so we must delete it in ph15.
+            If so we must delete it in ph15. With the cn index the
+            instances holding the cn are looked up there.
         """
         m   = []
         if not self.is_ph15 :
@@ -533,7 +2115,13 @@ class ODBC_Connector (object) :
                 if isinstance (cn, type ([])) :
                     assert len (cn) == 1
                     cn = cn [0]
-                matches = self.ldap.search_cn_all (cn)
+                # Marking as deleted must be complete, otherwise the
+                # entry would still be found
+                self.ldap.writer.wait_dn (ldrec ['dn'])
+                if self.ldap.cn_index :
+                    matches = self.ldap.cn_index.lookup (cn)
+                else :
+                    matches = self.ldap.search_cn_all (cn)
                 # If we get no result or more than one we have nothing to do
                 nm = len (matches)
                 if not matches or nm > 2 or not nm :
@@ -558,52 +2146,71 @@ class ODBC_Connector (object) :
                 if acc_status_found :
                     self.verbose ("Not deleting %s: has account" % dn)
                     continue
-                r = self.ldap.delete (dn)
-                if not r :
-                    msg = \
-                        ( "Error on LDAP delete ph15: "
-                          "%(description)s: %(message)s"
-                          " (code: %(result)s)"
-                        % self.ldap.result
-                        + "DN=%s" % dn
-                        )
-                    self.log.error (msg)
+                msg = self.ldap.writer.delete \
+                    (dn, "DN=%s" % dn, name = 'delete ph15')
+                if msg :
                     m.append (msg)
         if m :
             return '\n'.join (m)
     # end def delete_in_ldap_ph15
 
-    def etl (self) :
-        tbl    = 'eventlog_ph'
-        fields = self.fields [tbl]
+    def eventlog_condition (self) :
+        """ Where-clause for selecting unprocessed eventlog records
+        """
         if self.db in self.read_only :
-            # Note: The limit below (max_records) interacts badly with
+            # Note: The limit in etl (max_records) interacts badly with
             # limiting the records by date: We don't see all records for
             # a certain date/time in a single run. So we would have to
             # keep the date and use different ranges of records (and
             # hope that nothing changes until the next run).
             max_evdate = self.read_only [self.db]
-            sql  = "select %s from %s where event_time > "
+            sql  = "event_time > "
             if self.db == 'postgres' :
                 dtfun = 'to_timestamp'
             else :
                 dtfun = 'to_date'
             sql += "%s('%s', 'YYYY-MM-DD.HH24:MI:SS')" \
                  % (dtfun, max_evdate.strftime ('%Y-%m-%d.%H:%M:%S'))
+            return sql
+        return "status in ('N', 'E')"
+    # end def eventlog_condition
+
+    def eventlog_backlog (self) :
+        """ Return count and oldest event_time of unprocessed eventlog
+            records indexed by status. For read-only databases all
+            records not yet seen count as new ('N').
+        """
+        cond = self.eventlog_condition ()
+        if self.db in self.read_only :
+            sql = "select 'N', count(*), min(event_time) from eventlog_ph"
+            sql = ' where '.join ((sql, cond))
         else :
-            sql = "select %s from %s where status in ('N', 'E')"
+            sql = "select status, count(*), min(event_time) from eventlog_ph"
+            sql = ' where '.join ((sql, cond)) + ' group by status'
+        self.cursor.execute (sql)
+        rows = self.cursor.fetchall ()
+        return dict ((st.strip (), (int (c), t)) for st, c, t in rows)
+    # end def eventlog_backlog
+
+    def etl (self, max_records) :
+        """ Process at most max_records eventlog records, return the
+            number of eventlog records fetched.
+        """
+        tbl    = 'eventlog_ph'
+        fields = self.fields [tbl]
+        if self.db in self.read_only :
+            max_evdate = self.read_only [self.db]
+        sql = "select %s from %s where " + self.eventlog_condition ()
         if self.db == 'postgres' :
-            sql += ' limit %s' % self.args.max_records
+            sql += ' limit %s' % max_records
         else :
-            sql += ' and rownum <= %s' % self.args.max_records
+            sql += ' and rownum <= %s' % max_records
         sql = sql % (', '.join (fields), tbl)
         self.cursor.execute (sql)
         updates = {}
         rows = self.cursor.fetchall ()
         self.verbose ("Eventlog query done, %s rows" % len (rows))
-        self.do_sleep = True
-        if len (rows) >= self.args.max_records :
-            self.do_sleep = False
+        events = {}
         for row in rows :
             rw = Namespace ((k, row [i]) for i, k in enumerate (fields))
             self.verbose \
@@ -620,7 +2227,6 @@ class ODBC_Connector (object) :
                     )
                 self.error (msg)
                 continue
-            event_type = self.event_types [rw.event_type]
             if not rw.table_key.startswith ('pk_uniqueid=') :
                 msg = 'Invalid table_key in %s, expect pk_uniqueid=' % self.db
                 updates [rw.record_id] = dict \
@@ -650,42 +2256,97 @@ class ODBC_Connector (object) :
                     )
                 self.error (msg)
                 continue
-            self.warning_message = None
-            sql = 'select %s from %s where pk_uniqueid = ?'
-            sql = sql % (','.join (self.fields [self.table]), self.table)
-            self.cursor.execute (sql, uid)
-            usr = self.cursor.fetchall ()
-            if len (usr) > 1 :
-                msg = "Duplicate pk_uniqueid: %s in %s" % (uid, self.db)
-                updates [rw.record_id] = dict \
+            # Coalesce all events of the batch for the same user: A
+            # single sync per pk_uniqueid is enough.
+            events.setdefault (uid, []).append (rw)
+        users = self.fetch_users (events)
+        # Same read_time for the whole batch: Allows to collapse the
+        # status updates of successful records
+        read_time = datetime.utcnow ()
+        results   = []
+        for uid in events :
+            self.ldap.writer.key = uid
+            r = self.etl_user (uid, events [uid], users [uid])
+            results.append ((uid, r))
+        self.ldap.writer.key = None
+        # Wait for outstanding LDAP writes and get their errors
+        self.ldap.writer.flush ()
+        self.state_commit ()
+        for uid, (result, msg, warning) in results :
+            errors = self.ldap.writer.pop_errors (uid)
+            if errors :
+                msg = '\n'.join (m for m in (msg, errors) if m)
+            self.etl_status \
+                (events [uid], result, msg, warning, updates, read_time)
+        if self.db in self.read_only :
+            self.read_only [self.db] = max_evdate
+            self.verbose ("Not updating eventlog")
+        else :
+            self.update_eventlog (updates)
+        return len (rows)
+    # end def etl
+
+    def etl_user (self, uid, events, usr) :
+        """ Sync the user with the given pk_uniqueid once for all its
+            events in the current batch. The latest event determines the
+            event_type. The usr are the database rows for this
+            pk_uniqueid (usually exactly one). Returns the eventlog
+            update for warnings found here, the error message and the
+            warning message of the sync.
+        """
+        latest = max \
+            ( events
+            , key = lambda rw : (rw.event_time or datetime.min, rw.record_id)
+            )
+        event_type = self.event_types [latest.event_type]
+        if len (events) > 1 :
+            self.verbose \
+                ( "Coalesced %s events for pk_uniqueid %s in %s: %s"
+                % (len (events), uid, self.db, event_type)
+                )
+        result = {}
+        self.warning_message = None
+        if len (usr) > 1 :
+            msg = "Duplicate pk_uniqueid: %s in %s" % (uid, self.db)
+            result = dict \
+                ( error_message = msg
+                , status        = 'W'
+                )
+            self.log.warn (msg)
+        if len (usr) :
+            if event_type == 'delete' :
+                msg = 'Record %s existing in DB %s' % (uid, self.db)
+                result = dict \
                     ( error_message = msg
                     , status        = 'W'
                     )
                 self.log.warn (msg)
-            if len (usr) :
-                if event_type == 'delete' :
-                    msg = 'Record %s existing in DB %s' % (uid, self.db)
-                    updates [rw.record_id] = dict \
-                        ( error_message = msg
-                        , status        = 'W'
-                        )
-                    self.log.warn (msg)
-                is_new = event_type == 'insert'
-                msg = []
-                for usr_row in usr :
-                    m = self.sync_to_ldap (usr_row, is_new = is_new)
-                    if m :
-                        msg.append (m)
-                msg = '\n'.join (msg)
-            else :
-                if event_type != 'delete' :
-                    msg = 'Record %s not existing in DB' % uid
-                    updates [rw.record_id] = dict \
-                        ( error_message = msg
-                        , status        = 'W'
-                        )
-                    self.log.warn (msg)
-                msg = self.delete_in_ldap (uid)
+            is_new = event_type == 'insert'
+            msg = []
+            for usr_row in usr :
+                m = self.sync_to_ldap (usr_row, is_new = is_new)
+                if m :
+                    msg.append (m)
+            msg = '\n'.join (msg)
+        else :
+            if event_type != 'delete' :
+                msg = 'Record %s not existing in DB' % uid
+                result = dict \
+                    ( error_message = msg
+                    , status        = 'W'
+                    )
+                self.log.warn (msg)
+            msg = self.delete_in_ldap (uid)
+        return result, msg, self.warning_message
+    # end def etl_user
+
+    def etl_status (self, events, result, msg, warning, updates, read_time) :
+        """ Fan out the result of a sync to all eventlog records of the
+            group: Errors overwrite warnings, otherwise the status is
+            'W' with all warnings or 'S'.
+        """
+        for rw in events :
+            upd = dict (result)
             if msg :
                 # Error message, overwrite possible earlier warnings for
                 # this record
@@ -694,91 +2355,227 @@ class ODBC_Connector (object) :
                 if attempt > 10 :
                     status = 'F'
                 attempt += 1
-                updates [rw.record_id] = dict \
+                upd = dict \
                     ( error_message = msg
                     , status        = status
                     , attempt       = attempt
                     )
-            elif self.warning_message :
-                if rw.record_id in updates :
-                    assert updates [rw.record_id][status] == 'W'
-                    updates [rw.record_id]['error_message'] = '\n'.join \
-                        (( updates [rw.record_id]['error_message']
-                         , self.warning_message
-                        ))
+            elif warning :
+                if upd :
+                    assert upd ['status'] == 'W'
+                    upd ['error_message'] = '\n'.join \
+                        ((upd ['error_message'], warning))
                 else :
-                    updates [rw.record_id] = dict \
-                        ( error_message = self.warning_message
+                    upd = dict \
+                        ( error_message = warning
                         , status        = 'W'
                         )
-            elif rw.record_id in updates :
+            elif not upd :
+                upd = dict (status = 'S')
+            upd ['read_time'] = read_time
+            updates [rw.record_id] = upd
+    # end def etl_status
+
+    def update_eventlog (self, updates) :
+        """ Write the status of the processed events back to the
+            eventlog. Records only updated to status 'S' are collapsed
+            into one update with an in-list per chunk, all other updates
+            are grouped by the columns they update and sent with
+            executemany.
+        """
+        success = {}
+        by_cols = {}
+        for key in updates :
+            upd = updates [key]
+            fn  = tuple (sorted (upd))
+            if fn == ('read_time', 'status') and upd ['status'] == 'S' :
+                success.setdefault (upd ['read_time'], []).append (float (key))
+                continue
+            p = list (upd [k] for k in fn)
+            p.append (float (key))
+            by_cols.setdefault (fn, []).append (p)
+        for read_time in success :
+            rids = success [read_time]
+            for n in range (0, len (rids), self.max_in_list) :
+                chunk = rids [n:n + self.max_in_list]
+                sql = \
+                    ( "update eventlog_ph set status = ?, read_time = ?"
+                      " where record_id in (%s)"
+                    % ','.join ('?' * len (chunk))
+                    )
+                self.cursor.execute (sql, 'S', read_time, *chunk)
+        if by_cols and not self.is_postgres :
+            # Send parameter arrays in one round trip, not supported by
+            # older pyodbc versions.
+            try :
+                self.cursor.fast_executemany = True
+            except AttributeError :
                 pass
-            else :
-                updates [rw.record_id] = dict (status = 'S')
-            updates [rw.record_id]['read_time'] = datetime.utcnow ()
-        if self.db in self.read_only :
-            self.read_only [self.db] = max_evdate
-            self.verbose ("Not updating eventlog")
-        else :
-            for key in updates :
-                fn  = list (sorted (updates [key].keys ()))
-                sql = "update eventlog_ph set %s where record_id = ?"
-                sql = sql % ', '.join ('%s = ?' % k for k in fn)
-                #print (sql)
-                p   = list (updates [key][k] for k in fn)
-                p.append (float (key))
-                #print (p)
-                self.cursor.execute (sql, * p)
-            self.cursor.commit ()
-    # end def etl
+        for fn in by_cols :
+            sql = "update eventlog_ph set %s where record_id = ?"
+            sql = sql % ', '.join ('%s = ?' % k for k in fn)
+            self.cursor.executemany (sql, by_cols [fn])
+        self.cursor.commit ()
+        self.verbose \
+            ( "Eventlog updated: %s successful, %s in %s statements"
+            % ( sum (len (v) for v in success.values ())
+              , sum (len (v) for v in by_cols.values ())
+              , len (by_cols)
+              )
+            )
+    # end def update_eventlog
+
+    def fetch_users (self, uids) :
+        """ Fetch the database rows for all given pk_uniqueids with
+            chunked in-queries. Returns a dict indexed by pk_uniqueid,
+            each entry is the list of rows found for this pk_uniqueid.
+        """
+        fields = self.fields [self.table]
+        idx    = fields.index ('pk_uniqueid')
+        users  = dict ((uid, []) for uid in uids)
+        uids   = sorted (users)
+        for n in range (0, len (uids), self.max_in_list) :
+            chunk = uids [n:n + self.max_in_list]
+            sql = 'select %s from %s where pk_uniqueid in (%s)'
+            sql = sql % \
+                (','.join (fields), self.table, ','.join ('?' * len (chunk)))
+            self.cursor.execute (sql, *chunk)
+            for row in self.cursor.fetchall () :
+                users.setdefault (int (row [idx]), []).append (row)
+        self.verbose ("Fetched rows for %s users" % len (uids))
+        return users
+    # end def fetch_users
 
     def garbage_collect (self) :
         """ Search for all records in ldap where idnDeleted=True and the
             idnSyncDiff is 0. These are already synced to the ph and
             therefore are deleted now.
+            We search for a page of DNs (no attributes) at a time and
+            delete them with the (possibly pipelined) writer. The next
+            search again returns the first page: The entries found
+            before are deleted by then. A base dn is collected at most
+            every args.gc_interval seconds and a run stops after
+            args.gc_time_budget seconds, the rest is left for the next
+            run. Entries that failed to delete end the run when a page
+            contains nothing else.
+            With args.gc_watch the entries are deleted as soon as they
+            are reported by an LDAP_Watch and the search is only a
+            safety net.
         """
-        r = self.ldap.search \
-            ( self.dn, '(&(idnSyncDiff=0)(idnDeleted=*))'
-            , search_scope = SUBTREE
-            , attributes   = ALL_ATTRIBUTES
-            )
-        if not r :
+        start = time.time ()
+        if self.args.gc_watch :
+            self.garbage_collect_watched (start)
+        if start < self.gc_due.get (self.dn, 0) :
             return
-        for ldrec in self.ldap.response [:] :
-            dn = ldrec ['dn']
-            self.verbose ("Garbage-collect: %s" % dn)
-            r = self.ldap.delete (dn)
+        self.gc_due [self.dn] = start + self.args.gc_interval
+        budget = self.args.gc_time_budget
+        seen   = set ()
+        while True :
+            size = self.args.ldap_page_size
+            r = self.ldap.search \
+                ( self.dn, self.gc_filter
+                , search_scope = SUBTREE
+                , attributes   = NO_ATTRIBUTES
+                , paged_size   = size
+                )
             if not r :
-                msg = \
-                    ( "Error on LDAP delete: "
-                      "%(description)s: %(message)s"
-                      " (code: %(result)s)"
-                    % self.ldap.result
-                    + 'Garbage collect for %s failed' % dn
+                break
+            dns = [e ['dn'] for e in self.ldap.response if e.get ('dn')]
+            # We do not read further pages, the next search starts over
+            self.ldap.abandon_paged (self.dn, self.gc_filter, SUBTREE)
+            new = [dn for dn in dns if dn.lower () not in seen]
+            for dn in new :
+                seen.add (dn.lower ())
+                self.verbose ("Garbage-collect: %s" % dn)
+                self.ldap.writer.delete \
+                    (dn, 'Garbage collect for %s failed' % dn, collect = False)
+            self.ldap.writer.flush ()
+            if not new or len (dns) < size :
+                break
+            if budget and time.time () - start > budget :
+                self.log.info \
+                    ( "Garbage-collect %s: time budget exceeded after %d"
+                      " entries" % (self.dn, len (seen))
                     )
-                self.log.error (msg)
+                break
     # end def garbage_collect
 
+    def garbage_collect_watched (self, start) :
+        """ Delete the entries reported by the watch of our base dn
+            within the time budget, the rest is left for the next run.
+        """
+        w = self.gc_watch.get (self.dn)
+        if w is None :
+            w = self.gc_watch [self.dn] = LDAP_Watch \
+                (self.ldap, self.dn, self.gc_filter, ['idnDeleted'])
+        dns    = w.pop ()
+        budget = self.args.gc_time_budget
+        for n, dn in enumerate (dns) :
+            if budget and time.time () - start > budget :
+                w.requeue (dns [n:])
+                break
+            self.verbose ("Garbage-collect: %s" % dn)
+            self.ldap.writer.delete \
+                (dn, 'Garbage collect for %s failed' % dn, collect = False)
+        self.ldap.writer.flush ()
+    # end def garbage_collect_watched
+
     def update_ph15_cn (self) :
         """ Special case for ph15: We process the triggers of changed CNs
-            for other databases
-        """
-        if self.is_ph15 and self.ph15_change_dn :
-            sql = 'select %s from %s where benutzername in (?, ?)'
-            sql = sql % (','.join (self.fields [self.table]), self.table)
-            for oldcn in self.ph15_change_dn :
-                newcn = self.ph15_change_dn [oldcn]
-                self.cursor.execute (sql, oldcn, newcn)
-                rows = self.cursor.fetchall ()
-                if len (rows) > 1 :
+            for other databases. The rows with the old or new cn are
+            fetched with chunked in-queries, each row is synced once.
+            With a sync state the CN changes are removed from it when
+            done.
+        """
+        changes = self.ph15_change_dn
+        if self.is_ph15 and changes :
+            rows = self.fetch_by_cn \
+                (set (changes) | set (changes.values ()))
+            idx  = self.fields [self.table].index ('pk_uniqueid')
+            sync = {}
+            for oldcn in changes :
+                newcn = changes [oldcn]
+                found = rows.get (oldcn, []) + rows.get (newcn, [])
+                if len (found) > 1 :
                     self.log.warn \
                         ( 'Duplicate CN on cn change ph15: "%s/%s": %s'
-                        % (oldcn, newcn, len (rows))
+                        % (oldcn, newcn, len (found))
                         )
-                for row in rows :
-                    self.sync_to_ldap (row, is_new = False)
+                for row in found :
+                    sync [tuple (row)] = row
+            for row in sorted (sync.values (), key = lambda r : r [idx]) :
+                self.ldap.writer.key = int (row [idx])
+                self.sync_to_ldap (row, is_new = False)
+            self.ldap.writer.key = None
+            self.ldap.writer.flush ()
+            self.ph15_change_dn = {}
+            self.state_commit ()
+            if self.state :
+                self.state.delete_renames (changes)
+            # Errors are only logged here
+            self.ldap.writer.errors.clear ()
         self.ph15_change_dn = {}
     # end def update_ph15_cn
+
+    def fetch_by_cn (self, cns) :
+        """ Fetch the database rows with benutzername in cns with
+            chunked in-queries. Returns a dict of lists of rows indexed
+            by benutzername.
+        """
+        fields = self.fields [self.table]
+        idx    = fields.index ('benutzername')
+        cns    = sorted (cns)
+        result = {}
+        for n in range (0, len (cns), self.max_in_list) :
+            chunk = cns [n:n + self.max_in_list]
+            sql = 'select %s from %s where benutzername in (%s)'
+            sql = sql % \
+                (','.join (fields), self.table, ','.join ('?' * len (chunk)))
+            self.cursor.execute (sql, *chunk)
+            for row in self.cursor.fetchall () :
+                result.setdefault (row [idx].strip (), []).append (row)
+        return result
+    # end def fetch_by_cn
 #                    if len (rows) :
 #                        if cn == oldcn :
 #                            self.log.warn \
@@ -806,15 +2603,33 @@ class ODBC_Connector (object) :
     def generate_initial_tree (self) :
         """ Check if initial tree exists, generate if non-existing
         """
+        for rdns in self.initial_tree () :
+            self.generate_rdns (rdns)
+    # end def generate_initial_tree
+
+    def initial_tree (self) :
+        """ Lists of RDNs of the initial tree
+        """
+        rdn_lists = []
         for dn in self.args.base_dn :
-            rdn_lists = []
             spdn = dn.split (',')
             rdn_lists.append (spdn)
             if spdn [0] == 'ou=user' :
                 rdn_lists.append (['ou=ETD', 'ou=idnSync'] + spdn [1:])
-            for rdns in rdn_lists :
-                self.generate_rdns (rdns)
-    # end def generate_initial_tree
+        return rdn_lists
+    # end def initial_tree
+
+    def rdn_attributes (self, rdn) :
+        """ Attributes of an entry of the initial tree
+        """
+        k, v = rdn.split ('=', 1)
+        d = {k : v}
+        if k == 'o' :
+            d ['objectClass'] = 'Organization'
+        else :
+            d ['objectClass'] = 'organizationalUnit'
+        return d
+    # end def rdn_attributes
 
     def generate_rdns (self, rdns) :
         """ Generate a top-down list of RDNs
@@ -833,11 +2648,7 @@ class ODBC_Connector (object) :
             if entry :
                 assert entry ['attributes'][k] in (v, [v])
                 continue
-            d = {k : v}
-            if k == 'o' :
-                d ['objectClass'] = 'Organization'
-            else :
-                d ['objectClass'] = 'organizationalUnit'
+            d = self.rdn_attributes (dn)
             r = self.ldap.add (bdn, attributes = d)
             if not r :
                 msg = \
@@ -866,52 +2677,53 @@ class ODBC_Connector (object) :
     # end def get_passwords
 
     def initial_load (self) :
+        """ Sync all database rows to LDAP and delete entries not in
+            the database. With --checkpoint-file the progress is saved
+            regularly and a restarted initial_load resumes from there,
+            base dns already complete are skipped. The checkpoints are
+            removed when everything is done.
+        """
         self.generate_initial_tree ()
-        tbl     = self.table
-        fields  = self.fields [tbl]
+        cp = self.checkpoint
         for bdn, db in zip (self.args.base_dn, self.args.databases) :
             self.db = db
             self.dn = bdn
+            if cp and cp.is_done (bdn) :
+                self.log.info ("%s: %s: already loaded" % (db, self.dn))
+                continue
             self.log.debug ("%s: %s" % (db, self.dn))
             # Get all unique ids currently in ldap under our tree
-            # Note that we store dn and idnDeleted attribute in the
-            # uidmap.
-            self.uidmap = {}
-            r = self.ldap.search \
-                ( self.dn, '(phonlineUniqueId=*)'
-                , search_scope = LEVEL
-                , attributes   = ['phonlineUniqueId']
-                )
-            if r :
-                for entry in self.ldap.response :
-                    uid = entry ['attributes']['phonlineUniqueId']
-                    dlt = entry ['attributes'].get ('idnDeleted')
-                    self.uidmap [uid] = (entry ['dn'], dlt)
-                    assert entry ['dn'].endswith (self.dn)
-            for n, row in self.db_iter (db) :
-                if (n % 1000) == 0 or self.args.verbose :
-                    self.log.debug (n)
-                idx = fields.index ('pk_uniqueid')
-                uid = "%d" % row [idx]
-                if uid in self.uidmap :
-                    del self.uidmap [uid]
-                self.sync_to_ldap \
-                    (row, is_new = True, force = self.args.force_create)
-            for u in sorted (self.uidmap) :
-                udn, dlt = self.uidmap [u]
-                if dlt :
-                    self.log.warn ("Not deleting: %s: %s" % (u, udn))
-                else :
-                    self.log.warn ("Deleting: %s: %s" % (u, udn))
-                    r = self.ldap.delete (udn)
-                    if not r :
-                        msg = \
-                            ( "Error on LDAP delete: "
-                              "%(description)s: %(message)s"
-                              " (code: %(result)s)"
-                            % self.ldap.result
-                            )
-                        self.log.error (msg)
+            # Note that we store the rdn in the uidmap.
+            if self.args.parallel > 1 :
+                self.uidmap = UID_Map \
+                    ( self.ldap.ldcon, self.dn, self.log
+                    , paged_size = self.args.ldap_page_size
+                    )
+                self.load_parallel ()
+            else :
+                self.uidmap = self.make_uidmap ()
+                resume = None
+                if cp :
+                    cp.begin (bdn, [0])
+                    resume = cp.partitions (bdn) [0][1]
+                if resume is not None :
+                    # Rows before resume were synced by an earlier run
+                    self.log.info ("%s: resuming at %s" % (db, resume))
+                    for u in self.db_uids (end = resume) :
+                        self.uidmap.mark_seen (u)
+                self.load_range (resume = resume)
+            for u, udn in self.uidmap.unseen () :
+                self.log.warn ("Deleting: %s: %s" % (u, udn))
+                self.ldap.writer.delete (udn, collect = False)
+                if self.state :
+                    self.state.delete (self.dn, u)
+            self.ldap.writer.flush ()
+            if self.state :
+                self.state.commit ()
+            if cp :
+                cp.finish (bdn)
+        if cp :
+            cp.clear ()
         self.log.info ("SUCCESS")
         sys.stdout.flush ()
         # Default is to wait forever after initial load
@@ -920,31 +2732,377 @@ class ODBC_Connector (object) :
                 time.sleep (self.args.sleeptime)
     # end def initial_load
 
-    def sync_to_ldap (self, row, is_new = False, force = False) :
+    def ldif (self) :
+        """ Write LDIF of the initial tree and all users for loading
+            with slapadd. The entries are the same as the ones created
+            by initial_load, the password is also written pre-hashed
+            to userPassword. The etl can take over after loading.
+        """
+        timestamp = LdapTimeStamp (datetime.now (pytz.utc))
+        etl_ts    = timestamp.as_generalized_time ()
+        # Write to a temporary file so that an error does not leave
+        # a truncated LDIF under the output name
+        if self.args.output_file :
+            tmp = self.args.output_file + '.tmp'
+            f   = open (tmp, 'w')
+        else :
+            f   = sys.stdout
+        ok = False
+        try :
+            w    = LDIF_Writer (f)
+            seen = set ()
+            for rdns in self.initial_tree () :
+                bdn = ''
+                for rdn in reversed (rdns) :
+                    if bdn :
+                        bdn = ','.join ((rdn, bdn))
+                    else :
+                        bdn = rdn
+                    if bdn.lower () in seen :
+                        continue
+                    seen.add (bdn.lower ())
+                    w.write (bdn, self.rdn_attributes (rdn))
+            for bdn, db in zip (self.args.base_dn, self.args.databases) :
+                self.db = db
+                self.dn = bdn
+                self.log.debug ("%s: %s" % (db, self.dn))
+                for n, row in self.db_iter (db) :
+                    if (n % 1000) == 0 or self.args.verbose :
+                        self.log.debug (n)
+                    rw = self.converter.row (row)
+                    if not rw.benutzername or not rw.pk_uniqueid :
+                        self.log.error \
+                            ( "Got User without benutzername"
+                              " or pk_uniqueid: %s, %s"
+                            % (rw.benutzername, rw.pk_uniqueid)
+                            )
+                        continue
+                    ld_update = self.new_attributes (rw, etl_ts)
+                    dn = ('cn=%s,' % ld_update ['cn']) + self.dn
+                    if dn.lower () in seen :
+                        self.log.error ("Duplicate dn: %s" % dn)
+                        continue
+                    seen.add (dn.lower ())
+                    if rw.passwort :
+                        ld_update ['userPassword'] = hash_password \
+                            (rw.passwort, self.args.password_scheme or 'SSHA')
+                    w.write (dn, ld_update)
+                self.db_release ()
+            ok = True
+        finally :
+            if f is not sys.stdout :
+                f.close ()
+                if ok :
+                    os.rename (tmp, self.args.output_file)
+                else :
+                    os.unlink (tmp)
+            else :
+                f.flush ()
+        self.log.info ("SUCCESS: %d entries" % w.count)
+    # end def ldif
+
+    def make_uidmap (self, start = None, end = None) :
+        """ For a merge join we also store the attributes compared by
+            the sync in the uidmap. With start or end the uidmap only
+            contains entries with start <= phonlineUniqueId < end.
+        """
+        attrs = ()
+        if self.args.merge_join :
+            attrs = [lk for i, k, lk, c in self.converter.plan]
+            attrs.append ('idnDeleted')
+        return UID_Map \
+            ( self.ldap.ldcon, self.dn, self.log
+            , paged_size = self.args.ldap_page_size
+            , attributes = attrs, start = start, end = end
+            )
+    # end def make_uidmap
+
+    def load_range (self, start = 0, end = None, resume = None) :
+        """ Sync database rows with start <= pk_uniqueid < end to LDAP,
+            all rows by default. Return the number of rows. An earlier
+            run stopped at resume, we continue there. With a checkpoint
+            the last pk_uniqueid is saved with every commit: Not all
+            rows with this pk_uniqueid may be synced yet, so a resumed
+            run starts with it.
+        """
+        idx    = self.fields [self.table].index ('pk_uniqueid')
+        uidmap = None
+        if self.args.merge_join :
+            uidmap = self.uidmap
+        count  = 0
+        last   = None
+        if resume is None :
+            resume = start
+        it = self.db_iter (self.db, start = resume, end = end)
+        for n, row in it :
+            if (n % 1000) == 0 or self.args.verbose :
+                self.log.debug (n)
+            self.ldap.writer.key = row [idx]
+            self.sync_to_ldap \
+                ( row
+                , is_new = True
+                , force  = self.args.force_create
+                , uidmap = uidmap
+                )
+            if self.uidmap is not None :
+                self.uidmap.mark_seen (row [idx])
+            last = row [idx]
+            if (n % 1000) == 0 :
+                self.initial_load_commit ()
+                self.checkpoint_save (start, last)
+            count += 1
+        self.ldap.writer.key = None
+        self.initial_load_commit ()
+        if last is not None :
+            self.checkpoint_save (start, last)
+        self.db_release ()
+        return count
+    # end def load_range
+
+    def checkpoint_save (self, start, last) :
+        if self.checkpoint :
+            self.checkpoint.save (self.dn, start, last)
+    # end def checkpoint_save
+
+    def db_uids (self, end = None) :
+        """ Sorted pk_uniqueids of our table, only the ones < end if
+            end is given.
+        """
+        self.db_connect (self.db)
+        sql    = 'select pk_uniqueid from %s' % self.table
+        params = []
+        if end is not None :
+            sql += ' where pk_uniqueid < ?'
+            params.append (end)
+        self.cursor.execute (sql, *params)
+        uids = sorted (int (u [0]) for u in self.cursor.fetchall ())
+        self.db_release ()
+        return uids
+    # end def db_uids
+
+    def load_parallel (self) :
+        """ Split the pk_uniqueid range of the database into partitions
+            with the same number of rows and sync each partition in its
+            own process with its own database and LDAP connection.
+            Entries of all database uids are marked seen in the
+            uidmap, deletion is done by the caller after all partitions
+            are finished. When resuming from a checkpoint the partitions
+            of the earlier run are used.
+        """
+        n    = self.args.parallel
+        cp   = self.checkpoint
+        uids = self.db_uids ()
+        for u in uids :
+            self.uidmap.mark_seen (u)
+        done = []
+        if cp :
+            done = cp.partitions (self.dn)
+        if done :
+            starts = [s for s, last in done]
+            resume = [last for s, last in done]
+            self.log.info ("%s: resuming at %s" % (self.db, resume))
+        else :
+            # An empty table is a single (empty) partition
+            starts = set ([0])
+            if uids :
+                starts.update \
+                    (uids [len (uids) * i // n] for i in range (1, n))
+            starts = sorted (starts)
+            resume = [None] * len (starts)
+            if cp :
+                cp.begin (self.dn, starts)
+        bounds = starts [1:]
+        ends   = bounds + [None]
+        parts  = \
+            [ (self.args, self.dn, self.db, s, e, r)
+              for s, e, r in zip (starts, ends, resume)
+            ]
+        self.log.info \
+            ( "%s: %d rows in %d partitions: %s"
+            % (self.db, len (uids), len (parts), bounds)
+            )
+        with get_context ('spawn').Pool (len (parts)) as pool :
+            counts = pool.starmap (load_partition, parts)
+        self.log.info ("%s: %d rows synced" % (self.db, sum (counts)))
+    # end def load_parallel
+
+    def initial_load_commit (self) :
+        """ Wait for LDAP writes and record the sync state, errors of
+            initial load are only logged.
+        """
+        self.ldap.writer.flush ()
+        self.state_commit ()
+        self.ldap.writer.errors.clear ()
+    # end def initial_load_commit
+
+    def fingerprint (self, rw) :
+        """ Fingerprint of a database row in LDAP attribute names. The
+            encrypted password can't be used (it has a random IV) and an
+            unkeyed hash of the plaintext in the state file would allow
+            dictionary attacks: We take the keyed digest of the password.
+        """
+        d = {}
+        for k, lk, v in self.sync_converter.convert (rw, raw = ('passwort',)) :
+            if k == 'passwort' and v :
+                v = self.pwdiff.digest (v)
+            d [lk] = v
+        return fingerprint (d)
+    # end def fingerprint
+
+    def ldap_fingerprint (self, attributes) :
+        """ Fingerprint of an LDAP entry comparable to fingerprint
+            above, the password is decrypted and digested. The values
+            formatted by ldap3 (e.g. integers, multiple values in any
+            order) are normalized by fingerprint.
+        """
+        d = {}
+        for i, k, lk, conv in self.sync_converter.plan :
+            v = attributes.get (lk)
+            if k == 'passwort' and v :
+                plain = self.pwdiff.plaintext (v)
+                if plain is not None :
+                    v = self.pwdiff.digest (plain)
+            d [lk] = v
+        return fingerprint (d)
+    # end def ldap_fingerprint
+
+    def state_commit (self) :
+        """ Record fingerprints of synced rows after LDAP writes have
+            completed. Rows with an LDAP error are not recorded.
+        """
+        if not self.state :
+            self.state_pending = []
+            return
+        # Keep CN changes for ph15 until they are processed
+        self.state.set_renames (self.ph15_change_dn)
+        errors = self.ldap.writer.errors
+        for bdn, key, uid, fp, dn, pw in self.state_pending :
+            if key is not None and key in errors :
+                self.state.delete (bdn, uid)
+            else :
+                self.state.set (bdn, uid, fp, dn)
+                if pw :
+                    self.state.set_password (bdn, uid, * pw)
+        self.state.commit ()
+        self.state_pending = []
+    # end def state_commit
+
+    def state_record (self, uid, fp, dn, pw = None) :
+        if self.state :
+            self.state_pending.append \
+                ((self.dn, self.ldap.writer.key, uid, fp, dn, pw))
+    # end def state_record
+
+    def password_diff (self, uid, plain, stored) :
+        """ Compare plain with the encrypted stored password. Return
+            the new encrypted password or None if unchanged and the
+            (digest, encrypted password) to record in the sync state.
+            With --password-fingerprint a stored password that is still
+            the one recorded with the digest of plain is unchanged
+            without decryption. Entries not yet recorded are recorded
+            here.
+        """
+        if isinstance (stored, type ([])) and len (stored) == 1 :
+            stored = stored [0]
+        digest = None
+        if self.args.password_fingerprint :
+            digest = self.pwdiff.digest (plain)
+            st = self.state.get_password (self.dn, uid)
+            if stored and st and tuple (st) == (digest, stored) :
+                return None, None
+        if self.pwdiff.changed (plain, stored) :
+            enc = self.to_ldap (plain, 'passwort')
+        else :
+            enc = None
+        if digest is None :
+            return enc, None
+        return enc, (digest, enc or stored)
+    # end def password_diff
+
+    def verify_state (self) :
+        """ Compare the sync state with the LDAP directory, entries
+            that differ are removed from the state and will be synced
+            again with the next change of the database row.
+        """
+        if not self.state :
+            raise ApplicationError ("verify_state needs a --state-file")
+        drift = 0
+        for bdn in self.args.base_dn :
+            self.dn = bdn
+            n = 0
+            for uid, fp, dn in self.state.iter (bdn) :
+                n += 1
+                entry = self.ldap.get_by_dn (dn)
+                msg   = None
+                if not entry :
+                    msg = "not found"
+                else :
+                    atr  = entry ['attributes']
+                    luid = atr.get ('phonlineUniqueId')
+                    if isinstance (luid, list) and len (luid) == 1 :
+                        luid = luid [0]
+                    if normalize (luid) != str (uid) :
+                        msg = "phonlineUniqueId differs"
+                    elif atr.get ('idnDeleted') :
+                        msg = "deleted"
+                    elif self.ldap_fingerprint (atr) != fp :
+                        msg = "attributes differ"
+                if msg :
+                    drift += 1
+                    self.log.warn \
+                        ("State drift: %s: %s: %s" % (uid, dn, msg))
+                    self.state.delete (bdn, uid)
+            self.state.commit ()
+            self.log.info ("%s: %d entries verified" % (bdn, n))
+        self.log.info ("State drift: %d entries" % drift)
+    # end def verify_state
+
+    def sync_to_ldap \
+        (self, row, is_new = False, force = False, uidmap = None) :
         """ Sync a single record to LDAP. We return an error message if
             something goes wrong (and log the error). The caller might
             want to put the error message into some table in the
-            database.
+            database. During initial_load with --merge-join the entry
+            is taken from the uidmap if possible.
         """
-        timestamp = LdapTimeStamp (datetime.now (pytz.utc))
-        etl_ts = timestamp.as_generalized_time ()
-        tbl = self.table
-        rw  = Namespace ((k, row [i]) for i, k in enumerate (self.fields [tbl]))
-        if not rw.get ('benutzername') :
+        rw  = self.converter.row (row)
+        if not rw.benutzername :
             self.log.error \
                 ( "Got User without benutzername, pk_uniqueid=%s"
-                % rw.get ('pk_uniqueid')
+                % rw.pk_uniqueid
                 )
             return
-        if not rw.get ('pk_uniqueid') :
+        if not rw.pk_uniqueid :
             self.log.error \
                 ( "Got User without pk_uniqueid, benutzername=%s"
-                % rw.get ('benutzername')
+                % rw.benutzername
                 )
             return
         uid   = self.to_ldap (rw.pk_uniqueid, 'pk_uniqueid')
+        fp    = None
+        if self.state :
+            # Skip the LDAP lookup if row is unchanged since last sync
+            fp = self.fingerprint (rw)
+            st = self.state.get (self.dn, rw.pk_uniqueid)
+            if st and st [0] == fp :
+                self.verbose ("Unchanged: pk_uniqueid %s" % uid)
+                return
+        ldrec, msg = self.lookup_record (rw, uid, is_new, force, uidmap)
+        if msg :
+            return msg
+        return self.sync_record (rw, ldrec, uid, fp, is_new)
+    # end def sync_to_ldap
+
+    def lookup_record (self, rw, uid, is_new, force, uidmap = None) :
+        """ Find LDAP entry for rw, return tuple (entry, error message)
+            With the uidmap of a merge join the entries are taken from
+            the uidmap without searching LDAP, see merge_by_cn.
+        """
         # Find cn in LDAP phonlineUniqueId
-        ldrec = self.ldap.get_by_cn (rw.benutzername)
+        if uidmap is None :
+            ldrec = self.ldap.get_by_cn (rw.benutzername)
+        else :
+            ldrec = self.merge_by_cn (uidmap, rw)
         if ldrec :
             atr = ldrec ['attributes']
             if atr.get ('idnDeleted') and atr.get ('phonlineUniqueId') != uid :
@@ -954,10 +3112,14 @@ class ODBC_Connector (object) :
                     % (rw.benutzername, uid)
                     )
                 self.log.error (msg)
-                return msg
+                return None, msg
         elif not is_new or not force :
             # Try matching by pk_uniqueid
-            ldr = self.ldap.get_entries (uid)
+            if uidmap is None :
+                ldr = self.ldap.get_entries (uid)
+            else :
+                # All entries with this uid are in the uidmap
+                ldr = [uidmap.entry (i) for i in uidmap.lookup (uid)]
             if ldr and len (ldr) > 1 :
                 msg = \
                     ( "Non-matching cn: %s and more than one record"
@@ -965,9 +3127,49 @@ class ODBC_Connector (object) :
                     % (rw.benutzername, uid)
                     )
                 self.log.error (msg)
-                return msg
+                return None, msg
             elif ldr and len (ldr) == 1 :
                 ldrec = ldr [0]
+        return ldrec, None
+    # end def lookup_record
+
+    def merge_by_cn (self, uidmap, rw) :
+        """ Entry with the cn of rw from the uidmap of a merge join.
+            The uidmap of a partition of a parallel initial_load
+            contains only the entries with uids of the partition, an
+            entry with this cn may have another uid: If the cn isn't
+            found we have to search LDAP. We also search for cns that
+            may be escaped differently in the dn.
+        """
+        cn = rw.benutzername
+        if not self.dn_special.search (cn) :
+            idx = uidmap.find_rdn ('cn=' + cn)
+            if idx is not None :
+                return uidmap.entry (idx)
+            if uidmap.complete :
+                return None
+        return self.ldap.get_by_cn (cn)
+    # end def merge_by_cn
+
+    def new_attributes (self, rw, etl_ts) :
+        """ LDAP attributes of a new entry for rw
+        """
+        ld_update = {}
+        for k, lk, v in self.converter.convert (rw) :
+            if v is not None :
+                ld_update [lk] = v
+        ld_update ['objectClass'] = \
+            ['inetOrgPerson', 'phonlinePerson','idnSyncstat']
+        ld_update ['etlTimestamp'] = etl_ts
+        return ld_update
+    # end def new_attributes
+
+    def sync_record (self, rw, ldrec, uid, fp, is_new) :
+        """ Sync rw to the LDAP entry ldrec, create a new entry if
+            ldrec is None.
+        """
+        timestamp = LdapTimeStamp (datetime.now (pytz.utc))
+        etl_ts = timestamp.as_generalized_time ()
         if ldrec :
             if is_new :
                 # Log a warning but continue like a normal sync
@@ -986,35 +3188,31 @@ class ODBC_Connector (object) :
                     )
                 self.log.warn (msg)
                 self.warning_message = msg
-            # Ensure we use the same IV for comparison
-            pw = ldrec ['attributes'].get ('idnDistributionPassword', '')
-            if len (pw) > 32 :
-                self.crypto_iv = pw [:32]
             ld_update = {}
             ld_delete = {}
             if ldrec ['attributes'].get ('idnDeleted') :
                 self.log.warn ("Resurrecting: %s" % ldrec ['dn'])
                 ld_delete ['idnDeleted'] = None
-            for k in rw :
-                if self.is_ph15 and k in self.not_synced_ph15 :
-                    continue
-                v  = self.to_ldap (rw [k], k)
-                lk = self.odbc_to_ldap_field [k]
+            # The password is compared in plaintext, it is only
+            # encrypted if it changed
+            pw    = None
+            items = self.sync_converter.convert (rw, raw = ('passwort',))
+            for k, lk, v in items :
                 lv = ldrec ['attributes'].get (lk, None)
+                if k == 'passwort' and v is not None :
+                    enc, pw = self.password_diff (rw.pk_uniqueid, v, lv)
+                    if enc :
+                        ld_update [lk] = enc
+                    continue
                 if v == lv or [v] == lv :
                     continue
                 if v is None :
                     ld_delete [lk] = None
                 else :
-                    # Ensure we use new random IV if pw changes
-                    # We've used the IV of the old password for
-                    # comparison previously
-                    if k == 'passwort' :
-                        self.crypto_iv = self.args.crypto_iv
-                        v = self.to_ldap (rw [k], k)
                     ld_update [lk] = v
             assert 'phonlineUniqueId' not in ld_delete
             if not ld_delete and not ld_update :
+                self.state_record (rw.pk_uniqueid, fp, ldrec ['dn'], pw)
                 return
             ld_update ['etlTimestamp'] = etl_ts
             # dn modified, the cn is the rdn!
@@ -1025,16 +3223,9 @@ class ODBC_Connector (object) :
                     assert len (oldcn) == 1
                     oldcn = oldcn [0]
                 self.ph15_change_dn [oldcn] = ld_update ['cn']
-                cn = 'cn=' + ld_update ['cn']
-                r  = self.ldap.modify_dn (ldrec ['dn'], cn)
-                if not r :
-                    msg = \
-                        ( "Error on LDAP modify_dn: "
-                          "%(description)s: %(message)s"
-                          " (code: %(result)s)"
-                        % self.ldap.result
-                        )
-                    self.log.error (msg)
+                cn  = 'cn=' + ld_update ['cn']
+                msg = self.ldap.writer.modify_dn (ldrec ['dn'], cn)
+                if msg :
                     return msg
                 del ld_update ['cn']
                 ndn = cn + ',' + dn.split (',', 1)[-1]
@@ -1044,8 +3235,12 @@ class ODBC_Connector (object) :
             if 'idnDistributionPassword' in ld_update :
                 ph15changes ['passwort'] = True
                 self.verbose ("Change password for dn: %s" % dn)
-                self.ldap.extend.standard.modify_password \
-                    (dn, new_password = rw ['passwort'].encode ('utf-8'))
+                hashed = self.hashed_password (rw.passwort)
+                if hashed :
+                    ld_update ['userPassword'] = hashed
+                else :
+                    self.ldap.writer.modify_password \
+                        (dn, rw.passwort.encode ('utf-8'))
             for ph15k in self.ph15_writethrough :
                 if self.odbc_to_ldap_field [ph15k] in ld_update :
                     ph15changes [ph15k] = True
@@ -1063,57 +3258,48 @@ class ODBC_Connector (object) :
                 for k in ld_delete :
                     changes [k] = (MODIFY_DELETE, [])
                     self.verbose ("Delete %s in dn: %s" % (k, dn))
-                r = self.ldap.modify (dn, changes)
-                if not r :
-                    msg = \
-                        ( "Error on LDAP modify: "
-                          "%(description)s: %(message)s"
-                          " (code: %(result)s)"
-                        % self.ldap.result
-                        )
-                    self.log.error (msg + str (changes))
+                msg = self.ldap.writer.modify (dn, changes)
+                if msg :
                     return msg
+            self.state_record (rw.pk_uniqueid, fp, dn, pw)
         else :
-            # Ensure we use new random IV if pw changes
-            # We've used the IV of the old password for
-            # comparison previously
-            self.crypto_iv = self.args.crypto_iv
             if not is_new :
                 # Log a warning but continue like a normal sync
                 msg = 'pk_uniqueid "%s" not found, sync says it exists' % uid
                 self.log.warn (msg)
                 self.warning_message = msg
-            ld_update = {}
-            for k in rw :
-                lk = self.odbc_to_ldap_field [k]
-                v  = self.to_ldap (rw [k], k)
-                if v is not None :
-                    ld_update [lk] = v
-            ld_update ['objectClass'] = \
-                ['inetOrgPerson', 'phonlinePerson','idnSyncstat']
-            ld_update ['etlTimestamp'] = etl_ts
-            dn = ('cn=%s,' % ld_update ['cn']) + self.dn
-            r  = self.ldap.add (dn, attributes = ld_update)
+            ld_update = self.new_attributes (rw, etl_ts)
+            hashed    = None
+            if 'idnDistributionPassword' in ld_update :
+                hashed = self.hashed_password (rw.passwort)
+                if hashed :
+                    ld_update ['userPassword'] = hashed
+            dn  = ('cn=%s,' % ld_update ['cn']) + self.dn
+            msg = self.ldap.writer.add \
+                ( dn, ld_update
+                , ' DN: %s, uid: %s, attributes: %s' % (dn, uid, ld_update)
+                )
             self.verbose ("Adding dn: %s" % dn)
-            if not r :
-                msg = \
-                    ( "Error on LDAP add: %(description)s: %(message)s"
-                      " (code: %(result)s) "
-                    % self.ldap.result
-                    ) + 'DN: %s, uid: %s, attributes: %s' % (dn, uid, ld_update)
-                self.log.error (msg)
+            if msg :
                 return msg
-            if 'idnDistributionPassword' in ld_update :
-                self.ldap.extend.standard.modify_password \
-                    (dn, new_password = rw ['passwort'].encode ('utf-8'))
+            if 'idnDistributionPassword' in ld_update and not hashed :
+                self.ldap.writer.modify_password \
+                    (dn, rw.passwort.encode ('utf-8'))
             self.create_record_ph15 (uid, rw, ld_update)
-    # end def sync_to_ldap
+            pw  = None
+            enc = ld_update.get ('idnDistributionPassword')
+            if self.args.password_fingerprint and enc :
+                pw = (self.pwdiff.digest (rw.passwort), enc)
+            self.state_record (rw.pk_uniqueid, fp, dn, pw)
+    # end def sync_record
 
     def update_attributes_ph15 (self, cn, uid, rw, chkeys) :
         """ Write attributes through to ph15 if attribute changes on
             another instance: Sync of the database may take too long so
             we optimize this for some attribute changes. Note that for
             many changes in ph15 we will never get an explicit event.
+            With args.ph15_queue the changes are only queued here and
+            written by the PH15_Writethrough consumer.
         """
         # For initial load we don't write to other instances:
         if self.args.action != 'etl' :
@@ -1121,23 +3307,56 @@ class ODBC_Connector (object) :
         # If we're working on ph15 now or no ph15: nothing to do
         if not self.ph15dn or self.is_ph15 :
             return
-        ldrec = self.ldap.get_by_cn (cn, self.dn15)
+        values = dict ((k, getattr (rw, k)) for k in chkeys)
+        if self.ph15_queue :
+            self.ph15_queue.put (cn, values)
+            return
+        # Serialize with processing of the ph15 instance itself
+        with self.ph15_lock :
+            dn, msg = self.write_ph15 (cn, values)
+            if dn :
+                # Complete while holding the lock
+                self.ldap.writer.wait_dn (dn)
+                self.verbose ("Changed password for %s" % dn)
+    # end def update_attributes_ph15
+
+    def write_ph15 (self, cn, values, collect = False) :
+        """ Write the changed database values (indexed by field name)
+            to the entry with cn in ph15. Return the dn if a change was
+            sent and the error message of a synchronous write.
+        """
+        m = []
+        if self.ldap.cn_index :
+            ldrec = None
+            dn15  = self.ldap.cn_index.get_dn (cn, self.dn15)
+            if dn15 :
+                ldrec = self.ldap.get_by_dn (dn15)
+        else :
+            ldrec = self.ldap.get_by_cn (cn, self.dn15)
         # If record doesn't exist in ph15 we do nothing
         if not ldrec :
             self.log.warn ("CN %s not in ph15" % cn)
-            return
+            return None, None
         dn = ldrec ['dn']
         changes = {}
-        for k in chkeys :
+        for k in values :
             if k == 'passwort' :
-                password = rw [k]
-                self.ldap.extend.standard.modify_password \
-                    (dn, new_password = password.encode ('utf-8'))
-                self.crypto_iv = self.args.crypto_iv
+                password = values [k]
+                lv = ldrec ['attributes'].get ('idnDistributionPassword')
+                if not self.pwdiff.changed (password, lv) :
+                    continue
+                hashed = self.hashed_password (password)
+                if hashed :
+                    changes ['userPassword'] = (MODIFY_REPLACE, [hashed])
+                else :
+                    msg = self.ldap.writer.modify_password \
+                        (dn, password.encode ('utf-8'), collect = collect)
+                    if msg :
+                        m.append (msg)
                 v = self.to_ldap (password, 'passwort')
                 changes ['idnDistributionPassword'] = (MODIFY_REPLACE, v)
             else :
-                v  = self.to_ldap (rw [k], k)
+                v  = self.to_ldap (values [k], k)
                 # Don't delete attribute in ph15
                 if v is None :
                     continue
@@ -1151,18 +3370,40 @@ class ODBC_Connector (object) :
                 else :
                     changes [lk] = (MODIFY_REPLACE, [v])
         if not changes :
-            return
-        r = self.ldap.modify (dn, changes)
-        if not r :
-            msg = \
-                ( "Error on LDAP modify (password ph15): "
-                  "%(description)s: %(message)s"
-                  " (code: %(result)s)"
-                % self.ldap.result
-                )
-            self.log.error (msg + str (change))
-        self.verbose ("Changed password for %s" % dn)
-    # end def update_attributes_ph15
+            return None, '\n'.join (m)
+        msg = self.ldap.writer.modify \
+            ( dn, changes
+            , collect = collect
+            , name    = 'modify (password ph15)'
+            )
+        if msg :
+            m.append (msg)
+        return dn, '\n'.join (m)
+    # end def write_ph15
+
+    def write_ph15_batch (self, batch) :
+        """ Write a batch of queued changes (see PH15_Writethrough) to
+            ph15, return the error messages indexed by cn.
+        """
+        errors = {}
+        with self.ph15_lock :
+            try :
+                for e in batch :
+                    self.ldap.writer.key = e.cn
+                    dn, msg = self.write_ph15 (e.cn, e.values, collect = True)
+                    if msg :
+                        errors [e.cn] = msg
+                self.ldap.writer.key = None
+                self.ldap.writer.flush ()
+            finally :
+                self.ldap.release ()
+        for e in batch :
+            msg = self.ldap.writer.pop_errors (e.cn)
+            if msg :
+                errors [e.cn] = '\n'.join \
+                    (x for x in (errors.get (e.cn), msg) if x)
+        return errors
+    # end def write_ph15_batch
 
     def create_record_ph15 (self, uid, rw, ld_update) :
         # For now disabled: The uid is different in both instances so
@@ -1180,22 +3421,32 @@ class ODBC_Connector (object) :
         if ldrec :
             self.log.warn ("Uid %s already in ph15" % uid)
             return
-        dn = ('cn=%s,' % ld_update ['cn']) + self.dn15
-        r  = self.ldap.add (dn, attributes = ld_update)
+        dn  = ('cn=%s,' % ld_update ['cn']) + self.dn15
+        msg = self.ldap.writer.add \
+            ( dn, ld_update
+            , ' DN: %s, uid: %s, attributes: %s' % (dn, uid, ld_update)
+            )
         self.verbose ("Adding dn: %s" % dn)
-        if not r :
-            msg = \
-                ( "Error on LDAP add: %(description)s: %(message)s"
-                  " (code: %(result)s) "
-                % self.ldap.result
-                ) + 'DN: %s, uid: %s, attributes: %s' % (dn, uid, ld_update)
-            self.log.error (msg)
+        if msg :
             return msg
         if 'idnDistributionPassword' in ld_update :
-            self.ldap.extend.standard.modify_password \
-                (dn, new_password = rw ['passwort'].encode ('utf-8'))
+            if 'userPassword' not in ld_update :
+                self.ldap.writer.modify_password \
+                    (dn, rw.passwort.encode ('utf-8'))
     # end def create_record_ph15
 
+    def hashed_password (self, password) :
+        """ Return password hashed for userPassword with the scheme
+            given by --password-scheme. It is sent with the add or
+            modify of the entry. Without a scheme we return None, the
+            password is then set with the password modify extended
+            operation and hashed by the server.
+        """
+        if not self.args.password_scheme :
+            return None
+        return hash_password (password, self.args.password_scheme)
+    # end def hashed_password
+
     def to_ldap (self, item, dbkey) :
         conv = self.data_conversion.get (dbkey)
         if conv :
@@ -1206,10 +3457,7 @@ class ODBC_Connector (object) :
     def from_password (self, item) :
         """ Return encrypted password
         """
-        iv = None
-        if self.crypto_iv :
-            iv = unhexlify (self.crypto_iv)
-        return self.aes.encrypt (item.encode ('utf-8'), iv).decode ('ascii')
+        return self.pwdiff.encrypt (item)
     # end def from_password
 
     def verbose (self, msg) :
@@ -1228,11 +3476,33 @@ class ODBC_Connector (object) :
 
 # end class ODBC_Connector
 
+def load_partition (args, dn, db, start, end, resume = None) :
+    """ Process of a parallel initial_load: Sync the database rows with
+        start <= pk_uniqueid < end, continue at resume if given.
+        The LDAP cache would be loaded by every process for all base
+        dns, so we do without it.
+    """
+    args                 = copy (args)
+    args.base_dn         = [dn]
+    args.databases       = [db]
+    args.ldap_cache_size = 0
+    odbc = ODBC_Connector (args)
+    odbc.dn = dn
+    odbc.db = db
+    # The parent process keeps track of uids seen
+    odbc.uidmap = None
+    if args.merge_join :
+        # Only the entries of our partition are needed
+        odbc.uidmap = odbc.make_uidmap (start, end)
+    return odbc.load_range (start, end, resume)
+# end def load_partition
+
 def main () :
     cmd = ArgumentParser ()
     cmd.add_argument \
         ( 'action'
-        , help    = 'Action to perform, one of "initial_load", "etl"'
+        , help    = 'Action to perform, one of "initial_load", "etl",'
+                    ' "ldif", "verify_state"'
         )
     default_bind_dn = os.environ.get ('LDAP_BIND_DN', 'cn=admin,o=BMUKK')
     cmd.add_argument \
@@ -1255,6 +3525,14 @@ def main () :
         , action  = 'append'
         , default = []
         )
+    cmd.add_argument \
+        ( '--checkpoint-file'
+        , help    = "SQLite file for saving the progress of initial_load,"
+                    " a restarted initial_load resumes from there, the"
+                    " checkpoints are removed after a complete run,"
+                    " default is to start over"
+        , default = os.environ.get ('ETL_CHECKPOINT_FILE')
+        )
     cmd.add_argument \
         ( "-f", "--force-create"
         , help    = "Force creation of a record if not found by CN. "
@@ -1271,13 +3549,28 @@ def main () :
         )
     cmd.add_argument \
         ( '-m', '--max-records'
-        , help    = "Maximum number of records per etl run"
+        , help    = "Maximum number of records per etl run, the number of"
+                    " records is adapted to the time budget up to this"
+                    " limit, raise it (e.g. to 5000) for databases with a"
+                    " large backlog, default=%(default)s"
         , type    = int
         , default = 100
         )
+    cmd.add_argument \
+        ( '--min-sleeptime'
+        , help    = "Minimum seconds to sleep before polling a database"
+                    " again, an idle database is polled with exponential"
+                    " backoff from this up to --sleeptime. With the"
+                    " default of 0 a database with a backlog is polled"
+                    " again immediately and an idle one after --sleeptime"
+                    " (as before the adaptive scheduler), default=%(default)s"
+        , type    = float
+        , default = 0
+        )
     cmd.add_argument \
         ( '-o', '--output-file'
-        , help    = 'Output file for writing CSV, default is table name'
+        , help    = 'Output file for writing CSV, default is table name,'
+                    ' for the ldif action the default is standard output'
         )
     # Get default_pw from /etc/conf/passwords LDAP_PASSWORD entry.
     # Also get password-encryption password when we're at it
@@ -1292,6 +3585,132 @@ def main () :
                     pw_encr = line.split ('=', 1) [-1].strip ()
     except FileNotFoundError :
         pass
+    cmd.add_argument \
+        ( '--gc-interval'
+        , help    = "Minimum seconds between garbage collections of"
+                    " deleted entries of a database, 0 collects with"
+                    " every etl run, default=%(default)s; with"
+                    " --gc-watch the default is 3600"
+        , type    = float
+        , default = 0
+        )
+    cmd.add_argument \
+        ( '--gc-time-budget'
+        , help    = "Seconds after which a garbage collection stops, the"
+                    " remaining entries are collected by the next run,"
+                    " 0 for no limit, default=%(default)s"
+        , type    = float
+        , default = 10
+        )
+    cmd.add_argument \
+        ( '--gc-watch'
+        , help    = "Watch for entries synced by etd with a syncrepl"
+                    " search (needs the syncprov overlay) and delete"
+                    " them immediately, the search for these entries"
+                    " runs only every --gc-interval seconds"
+        , action  = "store_true"
+        , default = False
+        )
+    cmd.add_argument \
+        ( '--cn-index'
+        , help    = "Keep an index of the cn of all entries of all"
+                    " databases for finding the entries in ph15 without"
+                    " searching the whole directory, it is loaded at"
+                    " startup and updated by our own writes"
+        , action  = "store_true"
+        , default = False
+        )
+    cmd.add_argument \
+        ( '--ldap-cache-size'
+        , help    = "Maximum number of LDAP entries cached, the cache is"
+                    " loaded at startup and updated by our own writes,"
+                    " do not use if other programs modify the synced"
+                    " attributes; 0 disables the cache, default=%(default)s"
+        , type    = int
+        , default = 0
+        )
+    cmd.add_argument \
+        ( '--ldap-page-size'
+        , help    = "Number of entries per page of LDAP paged searches,"
+                    " e.g. by garbage collection or for loading the"
+                    " LDAP cache, default=%(default)s"
+        , type    = int
+        , default = 500
+        )
+    cmd.add_argument \
+        ( '--ldap-pool-size'
+        , help    = "Number of LDAP connections in the pool, default is"
+                    " one more than the number of workers (two more"
+                    " with --ph15-queue)"
+        , type    = int
+        )
+    cmd.add_argument \
+        ( '--ldap-pool-lifetime'
+        , help    = "Seconds after which a pooled LDAP connection is"
+                    " replaced, 0 keeps connections forever,"
+                    " default=%(default)s"
+        , type    = int
+        , default = 0
+        )
+    cmd.add_argument \
+        ( '--ldap-rebind'
+        , help    = "When to re-bind a pooled LDAP connection that is no"
+                    " longer bound, default=%(default)s"
+        , choices = ('checkout', 'never')
+        , default = 'checkout'
+        )
+    cmd.add_argument \
+        ( '--merge-join'
+        , help    = "For initial_load read all entries from LDAP once and"
+                    " merge them with the database rows sorted by"
+                    " pk_uniqueid instead of searching LDAP for each row."
+                    " All attributes compared by the sync are kept in"
+                    " memory for every entry of a base dn (or partition"
+                    " with --parallel)"
+        , action  = "store_true"
+        , default = False
+        )
+    cmd.add_argument \
+        ( '--page-size'
+        , help    = "Number of rows read from the database at once during"
+                    " initial_load, default=%(default)s"
+        , type    = int
+        , default = 1000
+        )
+    cmd.add_argument \
+        ( '--parallel'
+        , help    = "Number of processes for initial_load, each database"
+                    " is split into this many pk_uniqueid ranges,"
+                    " default=%(default)s"
+        , type    = int
+        , default = 1
+        )
+    cmd.add_argument \
+        ( '--password-fingerprint'
+        , help    = "Keep a keyed fingerprint of each password in the"
+                    " sync state, unchanged passwords are detected"
+                    " without decryption, needs --state-file"
+        , action  = "store_true"
+        , default = False
+        )
+    cmd.add_argument \
+        ( '--password-scheme'
+        , help    = "Hash passwords for userPassword with this scheme and"
+                    " send them with the add or modify of the entry, use"
+                    " the scheme OpenLDAP is configured for; default is"
+                    " to use the password modify extended operation,"
+                    " for the ldif action the default is SSHA"
+        , choices = sorted (password_schemes)
+        )
+    cmd.add_argument \
+        ( '--ph15-queue'
+        , help    = "Queue changes written through to ph15 and write them"
+                    " in batches in the background, the sync of other"
+                    " databases does not wait for ph15. The queue is kept"
+                    " in the --state-file"
+        , action  = "store_true"
+        , default = False
+        )
     cmd.add_argument \
         ( "-P", "--password"
         , help    = "Password(s) for binding to LDAP"
@@ -1318,11 +3737,27 @@ def main () :
     sleeptime = int (os.environ.get ('ETL_SLEEPTIME', '20'))
     cmd.add_argument \
         ( '-s', '--sleeptime'
-        , help    = "Seconds to sleep between etl invocations, "
-                    " default=%(default)s"
+        , help    = "Seconds to sleep between etl invocations, for the etl"
+                    " action this is the maximum poll interval of an idle"
+                    " database, default=%(default)s"
         , type    = int
         , default = sleeptime
         )
+    cmd.add_argument \
+        ( '--state-file'
+        , help    = "SQLite file with fingerprints of synced records,"
+                    " unchanged records are not looked up in LDAP,"
+                    " default is to not keep sync state"
+        , default = os.environ.get ('ETL_STATE_FILE')
+        )
+    cmd.add_argument \
+        ( '--time-budget'
+        , help    = "Target duration of a single etl run in seconds, the"
+                    " number of records per run is adapted to meet it,"
+                    " default=%(default)s"
+        , type    = float
+        , default = 10
+        )
     cmd.add_argument \
         ( '-t', '--terminate'
         , help    = "Terminate container after initial_load"
@@ -1336,6 +3771,22 @@ def main () :
         , default = False
         )
     default_ldap = os.environ.get ('LDAP_URI', 'ldap://06openldap:8389')
+    cmd.add_argument \
+        ( '--ldap-write-window'
+        , help    = "Maximum number of asynchronous LDAP write operations"
+                    " in flight, 0 for synchronous writes,"
+                    " default=%(default)s"
+        , type    = int
+        , default = 0
+        )
+    cmd.add_argument \
+        ( '-w', '--workers'
+        , help    = "Number of databases processed concurrently by etl,"
+                    " each worker uses its own database and LDAP"
+                    " connection, default=%(default)s"
+        , type    = int
+        , default = 1
+        )
     cmd.add_argument \
         ( '-u', '--uri'
         , help    = "LDAP uri, default=%(default)s"
@@ -1354,9 +3805,27 @@ def main () :
                 ))
             args.base_dn.append   (dn)
             args.databases.append (db)
+    # The main thread keeps its connection, each worker and the ph15
+    # queue consumer need one of their own
+    min_pool_size = 1
+    if args.workers > 1 :
+        min_pool_size += args.workers
+    if args.ph15_queue :
+        min_pool_size += 1
+    if args.ldap_pool_size is None :
+        args.ldap_pool_size = min_pool_size
+    if args.ldap_pool_size < min_pool_size :
+        raise ApplicationError \
+            ("--ldap-pool-size must be at least %d" % min_pool_size)
+    if args.gc_watch and not args.gc_interval :
+        args.gc_interval = 3600
     for db in args.read_only :
         if db not in args.databases :
             raise ApplicationError ("Invalid Database in read-only: %s" % db)
+    if args.password_fingerprint and not args.state_file :
+        raise ApplicationError ("--password-fingerprint needs --state-file")
+    if args.ph15_queue and not args.state_file :
+        raise ApplicationError ("--ph15-queue needs --state-file")
 
     odbc = ODBC_Connector (args)
     try :
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+
+import os
+
+from base64  import b64encode
+from hashlib import sha1, sha256, sha512
+
+password_schemes = dict \
+    ( SHA     = (sha1,   0)
+    , SSHA    = (sha1,   8)
+    , SSHA256 = (sha256, 8)
+    , SSHA512 = (sha512, 8)
+    )
+
+def hash_password (password, scheme = 'SSHA', salt = None) :
+    """ Return password hashed for the userPassword attribute in the
+        format understood by OpenLDAP. The salt is only passed in
+        for regression testing.
+    >>> hash_password ('secret', salt = b'12345678')
+    '{SSHA}tCNGqyJLk/uvKpCa4vga5GB2gWoxMjM0NTY3OA=='
+    >>> hash_password ('secret', 'SHA')
+    '{SHA}5en6G6MezRroT3XKqkdPOmY/BfQ='
+    """
+    hash, saltlen = password_schemes [scheme]
+    if isinstance (password, str) :
+        password = password.encode ('utf-8')
+    if salt is None :
+        salt = os.urandom (saltlen)
+    digest = hash (password + salt).digest () + salt
+    return '{%s}%s' % (scheme, b64encode (digest).decode ('ascii'))
+# end def hash_password
+
+def is_safe (value) :
+    """ Check if value may be written to LDIF without base64 encoding
+        according to the SAFE-STRING rule of RFC 2849. We also encode
+        values with a trailing space.
+    >>> is_safe ('abc'), is_safe (' abc'), is_safe (':abc'), is_safe ('ä')
+    (True, False, False, False)
+    >>> is_safe ('')
+    True
+    """
+    if not value :
+        return True
+    if value [0] in ' :<' or value [-1] == ' ' :
+        return False
+    for c in value :
+        if c in '\0\n\r' or ord (c) > 127 :
+            return False
+    return True
+# end def is_safe
+
+class LDIF_Writer (object) :
+    """ Write entries in LDIF format suitable for slapadd
+    >>> import io
+    >>> f = io.StringIO ()
+    >>> w = LDIF_Writer (f)
+    >>> w.write ('cn=x,o=y', dict (cn = 'x', sn = ['ä', 'b'], n = None))
+    >>> print (f.getvalue ().strip ())
+    version: 1
+    <BLANKLINE>
+    dn: cn=x,o=y
+    cn: x
+    sn:: w6Q=
+    sn: b
+    >>> [len (l) for l in w.line ('description', 'x' * 80).split ('\\n')]
+    [76, 18, 0]
+    """
+
+    width = 76
+
+    def __init__ (self, file) :
+        self.file  = file
+        self.count = 0
+        self.file.write ('version: 1\n\n')
+    # end def __init__
+
+    def line (self, name, value) :
+        if isinstance (value, bytes) :
+            try :
+                value = value.decode ('ascii')
+            except UnicodeDecodeError :
+                pass
+        if not isinstance (value, (str, bytes)) :
+            value = str (value)
+        if isinstance (value, str) and is_safe (value) :
+            line = '%s: %s' % (name, value)
+        else :
+            if isinstance (value, str) :
+                value = value.encode ('utf-8')
+            line = '%s:: %s' % (name, b64encode (value).decode ('ascii'))
+        # Fold long lines, continuation lines start with a space
+        w     = self.width
+        parts = [line [:w]]
+        for i in range (w, len (line), w - 1) :
+            parts.append (' ' + line [i:i + w - 1])
+        return '\n'.join (parts) + '\n'
+    # end def line
+
+    def write (self, dn, attributes) :
+        """ Write one entry, attributes with value None are skipped
+        """
+        lines = [self.line ('dn', dn)]
+        for k in attributes :
+            v = attributes [k]
+            if v is None :
+                continue
+            if not isinstance (v, (list, tuple)) :
+                v = [v]
+            for x in v :
+                lines.append (self.line (k, x))
+        lines.append ('\n')
+        self.file.write (''.join (lines))
+        self.count += 1
+    # end def write
+
+# end class LDIF_Writer
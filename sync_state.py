@@ -0,0 +1,343 @@
+#!/usr/bin/python3
+
+import json
+import sqlite3
+
+from decimal   import Decimal
+from hashlib   import sha256
+from threading import Lock
+
+def normalize (value) :
+    """ String form of a single attribute value: Values converted
+        from the database and values formatted by ldap3 according to
+        the schema have the same form. Numbers without fraction (e.g.
+        float from the database, int from LDAP) become integers.
+    >>> [normalize (x) for x in (4711.0, Decimal ('3'), 3, '3', 2.5)]
+    ['4711', '3', '3', '3', '2.5']
+    >>> normalize (True), normalize (b'x'), normalize (' x ')
+    ('TRUE', 'x', ' x ')
+    """
+    if isinstance (value, bool) :
+        return 'TRUE' if value else 'FALSE'
+    if isinstance (value, (int, float, Decimal)) :
+        try :
+            if value == int (value) :
+                return str (int (value))
+        except (ValueError, OverflowError) :
+            pass
+    if isinstance (value, bytes) :
+        try :
+            return value.decode ('utf-8')
+        except UnicodeDecodeError :
+            pass
+    return str (value)
+# end def normalize
+
+def fingerprint (attributes) :
+    """ Fingerprint of a dict of LDAP attributes. A single value is
+        the same as a list containing only this value, a missing
+        attribute is the same as None or an empty list. The order of
+        values is not significant (the server may return them in any
+        order) and the values are normalized. The hash is not keyed
+        and it is stored: Never pass secrets like plaintext
+        passwords, use a keyed digest instead.
+    >>> a = fingerprint (dict (cn = 'x', sn = None))
+    >>> a == fingerprint (dict (CN = ['x']))
+    True
+    >>> fingerprint (dict (cn = 'x')) == fingerprint (dict (cn = 'y'))
+    False
+    >>> a = fingerprint (dict (o = ['b', 'a'], n = 4711.0))
+    >>> a == fingerprint (dict (o = ['a', 'b'], n = [4711]))
+    True
+    """
+    items = []
+    for k in sorted (attributes, key = lambda x : x.lower ()) :
+        v = attributes [k]
+        if v is None or v == [] :
+            continue
+        if not isinstance (v, (list, tuple)) :
+            v = [v]
+        items.append ((k.lower (), sorted (normalize (x) for x in v)))
+    return sha256 (repr (items).encode ('utf-8')).hexdigest ()
+# end def fingerprint
+
+class Sync_State (object) :
+    """ Persistent local state of the sync kept in an SQLite database:
+        For each (base_dn, pk_uniqueid) we store the fingerprint of the
+        last database row successfully synced and the dn of the LDAP
+        entry. Optionally we store a keyed digest of the plaintext
+        password together with the encrypted password written to LDAP.
+        CN changes not yet propagated to ph15 are kept, too, and so are
+        the changes queued for writing through to ph15 (the values are
+        stored as JSON, never pass a plaintext password). Changes that
+        failed permanently stay with a failed flag.
+        The connection may be used from several threads.
+    """
+
+    def __init__ (self, filename) :
+        self.lock = Lock ()
+        # Several processes of a parallel initial_load use the file
+        self.db   = sqlite3.connect \
+            (filename, check_same_thread = False, timeout = 60)
+        self.db.execute \
+            ( 'create table if not exists sync_state'
+              ' ( base_dn     text    not null'
+              ' , pk_uniqueid integer not null'
+              ' , fingerprint text    not null'
+              ' , dn          text    not null'
+              ' , primary key (base_dn, pk_uniqueid)'
+              ' )'
+            )
+        self.db.execute \
+            ( 'create table if not exists password_state'
+              ' ( base_dn     text    not null'
+              ' , pk_uniqueid integer not null'
+              ' , digest      text    not null'
+              ' , encrypted   text    not null'
+              ' , primary key (base_dn, pk_uniqueid)'
+              ' )'
+            )
+        self.db.execute \
+            ( 'create table if not exists ph15_rename'
+              ' ( oldcn       text    not null primary key'
+              ' , newcn       text    not null'
+              ' )'
+            )
+        self.db.execute \
+            ( 'create table if not exists ph15_queue'
+              ' ( key         text    not null primary key'
+              ' , cn          text    not null'
+              ' , vals        text    not null'
+              ' , failed      integer not null'
+              ' )'
+            )
+        self.db.commit ()
+    # end def __init__
+
+    def commit (self) :
+        with self.lock :
+            self.db.commit ()
+    # end def commit
+
+    def delete (self, base_dn, pk_uniqueid) :
+        with self.lock :
+            for table in ('sync_state', 'password_state') :
+                self.db.execute \
+                    ( 'delete from %s'
+                      ' where base_dn = ? and pk_uniqueid = ?' % table
+                    , (base_dn.lower (), int (pk_uniqueid))
+                    )
+    # end def delete
+
+    def delete_ph15_queue (self, cns) :
+        with self.lock :
+            self.db.executemany \
+                ( 'delete from ph15_queue where key = ?'
+                , [(cn.lower (),) for cn in cns]
+                )
+    # end def delete_ph15_queue
+
+    def delete_renames (self, oldcns) :
+        with self.lock :
+            self.db.executemany \
+                ( 'delete from ph15_rename where oldcn = ?'
+                , [(cn,) for cn in oldcns]
+                )
+            self.db.commit ()
+    # end def delete_renames
+
+    def get (self, base_dn, pk_uniqueid) :
+        """ Return tuple (fingerprint, dn) or None
+        """
+        with self.lock :
+            c = self.db.execute \
+                ( 'select fingerprint, dn from sync_state'
+                  ' where base_dn = ? and pk_uniqueid = ?'
+                , (base_dn.lower (), int (pk_uniqueid))
+                )
+            return c.fetchone ()
+    # end def get
+
+    def get_password (self, base_dn, pk_uniqueid) :
+        """ Return tuple (digest, encrypted) or None
+        """
+        with self.lock :
+            c = self.db.execute \
+                ( 'select digest, encrypted from password_state'
+                  ' where base_dn = ? and pk_uniqueid = ?'
+                , (base_dn.lower (), int (pk_uniqueid))
+                )
+            return c.fetchone ()
+    # end def get_password
+
+    def iter (self, base_dn) :
+        """ Return list of (pk_uniqueid, fingerprint, dn) for base_dn
+        """
+        with self.lock :
+            c = self.db.execute \
+                ( 'select pk_uniqueid, fingerprint, dn from sync_state'
+                  ' where base_dn = ? order by pk_uniqueid'
+                , (base_dn.lower (),)
+                )
+            return c.fetchall ()
+    # end def iter
+
+    def ph15_queue (self) :
+        """ Return list of (cn, values, failed) of queued changes
+        """
+        with self.lock :
+            c = self.db.execute \
+                ('select cn, vals, failed from ph15_queue order by rowid')
+            return [(cn, json.loads (v), bool (f)) for cn, v, f in c]
+    # end def ph15_queue
+
+    def renames (self) :
+        """ Return dict of pending CN changes indexed by old cn
+        """
+        with self.lock :
+            c = self.db.execute ('select oldcn, newcn from ph15_rename')
+            return dict (c.fetchall ())
+    # end def renames
+
+    def set (self, base_dn, pk_uniqueid, fingerprint, dn) :
+        with self.lock :
+            self.db.execute \
+                ( 'insert or replace into sync_state'
+                  ' (base_dn, pk_uniqueid, fingerprint, dn)'
+                  ' values (?, ?, ?, ?)'
+                , (base_dn.lower (), int (pk_uniqueid), fingerprint, dn)
+                )
+    # end def set
+
+    def set_password (self, base_dn, pk_uniqueid, digest, encrypted) :
+        with self.lock :
+            self.db.execute \
+                ( 'insert or replace into password_state'
+                  ' (base_dn, pk_uniqueid, digest, encrypted)'
+                  ' values (?, ?, ?, ?)'
+                , (base_dn.lower (), int (pk_uniqueid), digest, encrypted)
+                )
+    # end def set_password
+
+    def set_ph15_queue (self, cn, values, failed = False) :
+        """ Queue (or replace) the changed values for cn
+        """
+        with self.lock :
+            self.db.execute \
+                ( 'insert or replace into ph15_queue (key, cn, vals, failed)'
+                  ' values (?, ?, ?, ?)'
+                , (cn.lower (), cn, json.dumps (values), int (failed))
+                )
+    # end def set_ph15_queue
+
+    def set_renames (self, renames) :
+        """ Add dict of CN changes indexed by old cn
+        """
+        with self.lock :
+            self.db.executemany \
+                ( 'insert or replace into ph15_rename (oldcn, newcn)'
+                  ' values (?, ?)'
+                , list (renames.items ())
+                )
+    # end def set_renames
+
+# end class Sync_State
+
+class Load_Checkpoint (object) :
+    """ Progress of initial_load kept in an SQLite database so that a
+        restarted initial_load resumes where it stopped: For each
+        base_dn we store the partitions of the pk_uniqueid range with
+        the last pk_uniqueid processed in each partition and whether the
+        base_dn is complete. Several processes may use the same file.
+    >>> import os, tempfile
+    >>> fn = os.path.join (tempfile.mkdtemp (), 'cp.db')
+    >>> cp = Load_Checkpoint (fn)
+    >>> cp.begin ('ou=A', [0, 100])
+    >>> cp.save ('ou=a', 100, 142)
+    >>> Load_Checkpoint (fn).partitions ('ou=A')
+    [(0, None), (100, 142)]
+    >>> cp.finish ('ou=A')
+    >>> cp.is_done ('ou=a')
+    True
+    >>> cp.clear ()
+    >>> cp.partitions ('ou=A'), cp.is_done ('ou=A')
+    ([], False)
+    """
+
+    def __init__ (self, filename) :
+        self.db = sqlite3.connect (filename, timeout = 60)
+        self.db.execute \
+            ( 'create table if not exists load_checkpoint'
+              ' ( base_dn     text    not null'
+              ' , start       integer not null'
+              ' , last        integer'
+              ' , primary key (base_dn, start)'
+              ' )'
+            )
+        self.db.execute \
+            ( 'create table if not exists load_done'
+              ' ( base_dn     text    not null primary key'
+              ' )'
+            )
+        self.db.commit ()
+    # end def __init__
+
+    def begin (self, base_dn, starts) :
+        """ Record the partitions of base_dn given by their start
+        """
+        self.db.executemany \
+            ( 'insert or ignore into load_checkpoint (base_dn, start)'
+              ' values (?, ?)'
+            , [(base_dn.lower (), int (s)) for s in starts]
+            )
+        self.db.commit ()
+    # end def begin
+
+    def clear (self) :
+        """ Remove all checkpoints, the next initial_load starts over
+        """
+        self.db.execute ('delete from load_checkpoint')
+        self.db.execute ('delete from load_done')
+        self.db.commit ()
+    # end def clear
+
+    def finish (self, base_dn) :
+        self.db.execute \
+            ( 'insert or ignore into load_done (base_dn) values (?)'
+            , (base_dn.lower (),)
+            )
+        self.db.commit ()
+    # end def finish
+
+    def is_done (self, base_dn) :
+        c = self.db.execute \
+            ( 'select base_dn from load_done where base_dn = ?'
+            , (base_dn.lower (),)
+            )
+        return c.fetchone () is not None
+    # end def is_done
+
+    def partitions (self, base_dn) :
+        """ Return list of (start, last) sorted by start, last is None
+            if nothing of the partition was processed yet.
+        """
+        c = self.db.execute \
+            ( 'select start, last from load_checkpoint'
+              ' where base_dn = ? order by start'
+            , (base_dn.lower (),)
+            )
+        return c.fetchall ()
+    # end def partitions
+
+    def save (self, base_dn, start, last) :
+        """ All rows of the partition with pk_uniqueid < last are synced
+        """
+        self.db.execute \
+            ( 'insert or replace into load_checkpoint (base_dn, start, last)'
+              ' values (?, ?, ?)'
+            , (base_dn.lower (), int (start), int (last))
+            )
+        self.db.commit ()
+    # end def save
+
+# end class Load_Checkpoint
@@ -0,0 +1,24 @@
+""" Tests of the etl. The unit tests use fake database connections, so
+    they do not need an ODBC driver: If pyodbc cannot be imported (e.g.
+    because libodbc is not installed) a stand-in module is registered
+    that has no connections.
+"""
+
+import sys
+import types
+
+try :
+    import pyodbc
+except ImportError :
+    class Error (Exception) :
+        pass
+    # end class Error
+
+    def connect (*args, **kw) :
+        raise Error ("No ODBC driver available in the tests")
+    # end def connect
+
+    pyodbc = types.ModuleType ('pyodbc')
+    pyodbc.Error   = Error
+    pyodbc.connect = connect
+    sys.modules ['pyodbc'] = pyodbc
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+""" Fakes of LDAP and database connections for the tests
+"""
+
+from argparse import Namespace
+
+class Fake_Connection (object) :
+    """ Just enough of an ldap3 connection for building a UID_Map or
+        loading the LDAP_Cache
+    """
+
+    def __init__ (self, entries) :
+        self.entries  = entries
+        self.searches = []
+        self.extend   = Namespace (standard = Namespace ())
+        self.extend.standard.paged_search = self.paged_search
+    # end def __init__
+
+    def paged_search (self, base, filter, **kw) :
+        self.searches.append ((base, filter, kw))
+        wanted = set (a.lower () for a in kw ['attributes'])
+        yield dict (type = 'searchResRef', uri = ['ldap://elsewhere'])
+        for e in self.entries :
+            atr = dict \
+                ( (k, v) for k, v in e ['attributes'].items ()
+                  if k.lower () in wanted or '*' in wanted
+                )
+            yield dict \
+                (dn = e ['dn'], attributes = atr, type = 'searchResEntry')
+    # end def paged_search
+
+# end class Fake_Connection
+
+class Fake_Log (object) :
+    """ Collects the messages of the poor-mans logger of etl.py
+    """
+
+    def __init__ (self) :
+        self.errors   = []
+        self.warnings = []
+        self.infos    = []
+    # end def __init__
+
+    def debug (self, msg) :
+        pass
+    # end def debug
+
+    def error (self, msg) :
+        self.errors.append (msg)
+    # end def error
+
+    def info (self, msg) :
+        self.infos.append (msg)
+    # end def info
+
+    def warn (self, msg) :
+        self.warnings.append (msg)
+    # end def warn
+
+# end class Fake_Log
+
+class Fake_Cursor (object) :
+    """ Database cursor recording the statements, a select returns the
+        rows of the table in its from-clause. The rows of the user
+        table are restricted to the pk_uniqueids of the in-list.
+    """
+
+    def __init__ (self, tables = None) :
+        self.tables   = tables or {}
+        self.executed = []
+        self.many     = []
+        self.commits  = 0
+        self.result   = []
+    # end def __init__
+
+    def commit (self) :
+        self.commits += 1
+    # end def commit
+
+    def execute (self, sql, *params) :
+        self.executed.append ((sql, params))
+        self.result = []
+        words = sql.split ()
+        if words [0] != 'select' :
+            return
+        rows = self.tables.get (words [words.index ('from') + 1], [])
+        if 'pk_uniqueid in' in sql :
+            rows = [r for r in rows if r ['pk_uniqueid'] in params]
+        fields = ' '.join (words [1:words.index ('from')]).split (',')
+        self.result = [tuple (r [f.strip ()] for f in fields) for r in rows]
+    # end def execute
+
+    def executemany (self, sql, params) :
+        self.many.append ((sql, list (params)))
+    # end def executemany
+
+    def fetchall (self) :
+        return self.result
+    # end def fetchall
+
+# end class Fake_Cursor
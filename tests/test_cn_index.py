@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+import unittest
+
+from argparse import Namespace
+
+from tests.fakes import Fake_Connection, Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+ph08 = 'ou=ph08,o=BMUKK'
+ph15 = 'ou=ph15,o=BMUKK'
+
+class Fake_Directory (Fake_Connection) :
+    """ Searches return the entries directly below base, a search
+        for a cn only the entries with that cn.
+    """
+
+    def below (self, dn, base) :
+        return dn.split (',', 1) [-1].lower () == base.lower ()
+    # end def below
+
+    def paged_search (self, base, filter, **kw) :
+        for e in Fake_Connection.paged_search (self, base, filter, **kw) :
+            if 'dn' not in e or self.below (e ['dn'], base) :
+                yield e
+    # end def paged_search
+
+    def search (self, base, filter, **kw) :
+        self.searches.append ((base, filter, kw))
+        self.response = \
+            [ dict (dn = e ['dn'], attributes = dict (e ['attributes']))
+              for e in self.entries
+              if  self.below (e ['dn'], base)
+              and '(cn=%s)' % e ['attributes']['cn'].lower () == filter
+            ]
+        return bool (self.response)
+    # end def search
+
+# end class Fake_Directory
+
+def entry (cn, base, **attrs) :
+    attrs.update (cn = cn)
+    return dict (dn = 'cn=%s,%s' % (cn, base), attributes = attrs)
+# end def entry
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_CN_Index (unittest.TestCase) :
+
+    def index (self, entries) :
+        ldap = Namespace \
+            ( args  = Namespace (ldap_page_size = 500)
+            , ldcon = Fake_Directory (entries)
+            , log   = Fake_Log ()
+            )
+        index = etl.CN_Index (ldap, [ph08, ph15], ['phonlineStudentAktiv'])
+        index.load ()
+        return index
+    # end def index
+
+    def dns (self, result) :
+        return sorted (e ['dn'] for e in result)
+    # end def dns
+
+    def test_load (self) :
+        i = self.index \
+            ( [ entry ('Jdoe',  ph08, phonlineStudentAktiv = 'TRUE', sn = 'x')
+              , entry ('jdoe',  ph15, idnDeleted = 'TRUE')
+              , entry ('jdoe',  'o=BMUKK')
+              , entry ('other', ph15)
+              ]
+            )
+        # One paged search per base, only the indexed attributes
+        searches = i.ldap.ldcon.searches
+        self.assertEqual \
+            ( [(b.upper (), kw ['attributes']) for b, f, kw in searches]
+            , [ (ph08.upper (), ('cn', 'idnDeleted', 'phonlineStudentAktiv'))
+              , (ph15.upper (), ('cn', 'idnDeleted', 'phonlineStudentAktiv'))
+              ]
+            )
+        self.assertEqual (i.ldap.log.infos, ['CN index: 3 entries'])
+        for cn in ('JDOE', 'cn=JDOE') :
+            self.assertEqual \
+                ( self.dns (i.entries (cn).values ())
+                , ['cn=Jdoe,' + ph08, 'cn=jdoe,' + ph15]
+                )
+        # Entries marked deleted are not found
+        result = i.lookup ('jdoe')
+        self.assertEqual (self.dns (result), ['cn=Jdoe,' + ph08])
+        self.assertEqual \
+            ( dict (result [0]['attributes'])
+            , dict (phonlineStudentAktiv = 'TRUE')
+            )
+        self.assertEqual (i.get_dn ('JDOE', ph15), 'cn=jdoe,' + ph15)
+        self.assertIsNone (i.get_dn ('other', ph08))
+    # end def test_load
+
+    def test_writes (self) :
+        i = self.index ([entry ('a', ph08), entry ('b', ph15)])
+        i.added ('cn=c,' + ph08, dict (cn = 'c', idnDeleted = []))
+        i.added ('cn=c,o=BMUKK', dict (cn = 'c'))
+        self.assertEqual (self.dns (i.lookup ('c')), ['cn=c,' + ph08])
+        i.deleted ('cn=A,' + ph08)
+        self.assertEqual (i.lookup ('a'), [])
+        i.renamed ('cn=b,' + ph15, 'cn=d,' + ph15)
+        self.assertEqual (i.lookup ('b'), [])
+        self.assertEqual (i.get_dn ('d', ph15), 'cn=d,' + ph15)
+        i.modified \
+            ( 'cn=c,' + ph08
+            , dict
+                ( idnDeleted = (etl.MODIFY_REPLACE, ['TRUE'])
+                , sn         = (etl.MODIFY_REPLACE, ['Doe'])
+                )
+            )
+        self.assertEqual (i.lookup ('c'), [])
+        e = i.entries ('c') ['cn=c,' + ph08.lower ()]
+        self.assertNotIn ('sn', e ['attributes'])
+        i.modified \
+            ('cn=c,' + ph08, dict (idnDeleted = (etl.MODIFY_DELETE, [])))
+        self.assertEqual (self.dns (i.lookup ('c')), ['cn=c,' + ph08])
+    # end def test_writes
+
+    def test_invalidate (self) :
+        i = self.index ([entry ('a', ph08)])
+        con = i.ldap.ldcon
+        # The write of the rename failed: The outcome is unknown
+        i.invalidate (['cn=a,' + ph08, 'cn=b,' + ph08])
+        con.entries.append (entry ('b', ph15))
+        del con.searches [:]
+        self.assertEqual (self.dns (i.lookup ('B')), ['cn=b,' + ph15])
+        self.assertEqual \
+            ( [(b, f) for b, f, kw in con.searches]
+            , [(ph08.lower (), '(cn=b)'), (ph15.lower (), '(cn=b)')]
+            )
+        # Searched only once
+        self.assertEqual (self.dns (i.lookup ('b')), ['cn=b,' + ph15])
+        self.assertEqual (len (con.searches), 2)
+        del con.entries [0]
+        self.assertEqual (i.lookup ('a'), [])
+    # end def test_invalidate
+
+# end class Test_CN_Index
+
+if __name__ == '__main__' :
+    unittest.main ()
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+import operator
+import unittest
+
+from argparse import Namespace
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_DB_Iter (unittest.TestCase) :
+    """ Keyset paging of db_iter against a fake db_select
+    """
+
+    ops = \
+        { '>=' : operator.ge
+        , '>'  : operator.gt
+        , '<'  : operator.lt
+        , '='  : operator.eq
+        }
+
+    def connector (self, uids, page_size) :
+        odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        odbc.args    = Namespace (page_size = page_size)
+        odbc.table   = 'benutzer_alle_dirxml_v'
+        odbc.fields  = {odbc.table : ('benutzername', 'pk_uniqueid')}
+        odbc.selects = []
+        # Row order within the same pk_uniqueid is arbitrary
+        rows = [('u%s' % n, uid) for n, uid in enumerate (uids)]
+        def db_select (where, params, limit = None) :
+            odbc.selects.append ((where, params, limit))
+            result = list (rows)
+            for w, p in zip (where, params) :
+                field, op, dummy = w.split ()
+                assert field == 'pk_uniqueid'
+                result = [r for r in result if self.ops [op] (r [1], p)]
+            if limit :
+                result = sorted (result, key = lambda r : r [1]) [:limit]
+            return result
+        odbc.db_connect = lambda db : None
+        odbc.db_select  = db_select
+        return odbc, rows
+    # end def connector
+
+    def check (self, uids, page_size, start = 0, end = None) :
+        odbc, rows = self.connector (uids, page_size)
+        result = list (odbc.db_iter ('ph08', start, end))
+        self.assertEqual \
+            ([n for n, r in result], list (range (len (result))))
+        got    = [r for n, r in result]
+        expect = [r for r in rows if r [1] >= start]
+        if end is not None :
+            expect = [r for r in expect if r [1] < end]
+        self.assertEqual (sorted (got), sorted (expect))
+        self.assertEqual \
+            ([r [1] for r in got], sorted (r [1] for r in expect))
+        return odbc
+    # end def check
+
+    def test_duplicates_across_pages (self) :
+        for size in range (1, 8) :
+            self.check ([1, 2, 3, 3, 3, 4, 5, 5, 6, 7, 7], size)
+    # end def test_duplicates_across_pages
+
+    def test_page_of_duplicates (self) :
+        for size in range (1, 6) :
+            self.check ([1] + [2] * 7 + [3], size)
+            self.check ([2] * 7, size)
+    # end def test_page_of_duplicates
+
+    def test_unsorted_table (self) :
+        self.check ([9, 3, 7, 3, 1, 9, 9, 2], 2)
+    # end def test_unsorted_table
+
+    def test_range (self) :
+        uids = [1, 2, 3, 3, 3, 4, 5, 5, 6, 7, 7]
+        for size in range (1, 5) :
+            self.check (uids, size, start = 3, end = 6)
+            self.check (uids, size, start = 5)
+            self.check (uids, size, start = 0, end = 3)
+    # end def test_range
+
+    def test_exact_pages (self) :
+        odbc = self.check ([1, 2, 3, 4, 5, 6], 3)
+        self.assertEqual ([s [2] for s in odbc.selects], [4, 4])
+        odbc = self.check ([1, 2, 3, 4, 5, 6, 7], 3)
+        self.assertEqual ([s [2] for s in odbc.selects], [4, 4, 4])
+    # end def test_exact_pages
+
+    def test_query_count (self) :
+        # Only a page filled by a single uid needs an extra query
+        odbc = self.check ([1, 2, 3, 3, 4, 5, 6], 3)
+        self.assertEqual ([s [2] for s in odbc.selects], [4, 4, 4])
+        odbc = self.check ([1, 2, 2, 2, 2, 3], 3)
+        self.assertEqual ([s [2] for s in odbc.selects], [4, 4, None, 4])
+    # end def test_query_count
+
+    def test_empty (self) :
+        odbc = self.check ([], 3)
+        self.assertEqual (len (odbc.selects), 1)
+    # end def test_empty
+
+# end class Test_DB_Iter
+
+if __name__ == '__main__' :
+    unittest.main ()
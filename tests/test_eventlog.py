@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+import unittest
+
+from argparse import Namespace
+from datetime import datetime
+
+from tests.fakes import Fake_Cursor, Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+class Fake_Writer (object) :
+    """ LDAP writer returning the given errors per key after flush
+    """
+
+    def __init__ (self, errors = None) :
+        self.key     = None
+        self.errors  = dict (errors or {})
+        self.flushed = 0
+    # end def __init__
+
+    def flush (self) :
+        self.flushed += 1
+    # end def flush
+
+    def pop_errors (self, key) :
+        return self.errors.pop (key, None)
+    # end def pop_errors
+
+# end class Fake_Writer
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_ETL (unittest.TestCase) :
+    """ Coalescing of eventlog records per pk_uniqueid and fan-out of
+        the result to all records of the group.
+    """
+
+    table = 'benutzer_alle_dirxml_v'
+    types = dict (delete = 4.0, insert = 5.0, update = 6.0)
+
+    def connector (self, events, uids, errors = None, messages = None) :
+        odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        odbc.args      = Namespace (verbose = False, action = 'etl')
+        odbc.log       = Fake_Log ()
+        odbc.db        = 'ph08'
+        odbc.table     = self.table
+        odbc.fields    = dict \
+            ( etl.ODBC_Connector.fields
+            , benutzer_alle_dirxml_v = ('pk_uniqueid', 'benutzername')
+            )
+        odbc.read_only = {}
+        odbc.state     = None
+        odbc.ldap      = Namespace (writer = Fake_Writer (errors))
+        users = \
+            [dict (pk_uniqueid = u, benutzername = 'u%s' % u) for u in uids]
+        odbc.cursor    = Fake_Cursor \
+            ({'eventlog_ph' : events, self.table : users})
+        odbc.synced    = []
+        odbc.deleted   = []
+        messages       = messages or {}
+        def sync_to_ldap (row, is_new = False) :
+            odbc.synced.append ((row [0], is_new))
+            odbc.warning_message = messages.get (('warn', row [0]))
+            return messages.get (row [0])
+        def delete_in_ldap (uid) :
+            odbc.deleted.append (uid)
+            return messages.get (uid)
+        odbc.sync_to_ldap   = sync_to_ldap
+        odbc.delete_in_ldap = delete_in_ldap
+        return odbc
+    # end def connector
+
+    def event (self, rid, uid, event_type, minute = 0, attempt = 0) :
+        ev = dict.fromkeys (etl.ODBC_Connector.fields ['eventlog_ph'])
+        ev.update \
+            ( record_id  = float (rid)
+            , table_key  = 'pk_uniqueid=%s' % uid
+            , table_name = self.table.upper ()
+            , status     = 'N'
+            , event_type = self.types [event_type]
+            , event_time = datetime (2026, 1, 1, 0, minute)
+            , attempt    = attempt
+            )
+        return ev
+    # end def event
+
+    def status (self, odbc) :
+        """ Eventlog updates other than success by record_id (without
+            the read_time) and the record_ids updated to success.
+        """
+        updates = {}
+        for sql, params in odbc.cursor.many :
+            cols = sql.split (' set ') [1].split (' where ') [0]
+            cols = [c.split (' = ') [0] for c in cols.split (', ')]
+            for p in params :
+                upd = dict (zip (cols, p))
+                del upd ['read_time']
+                updates [p [-1]] = upd
+        success = []
+        for sql, params in odbc.cursor.executed :
+            if sql.startswith ('update') :
+                self.assertEqual (params [0], 'S')
+                success.extend (params [2:])
+        return updates, sorted (success)
+    # end def status
+
+    def test_coalesce (self) :
+        events = \
+            [ self.event (1, 7, 'insert', 0)
+            , self.event (2, 8, 'update', 0)
+            , self.event (3, 7, 'update', 1)
+            , self.event (4, 7, 'update', 1)
+            ]
+        odbc = self.connector (events, [7, 8])
+        self.assertEqual (odbc.etl (100), 4)
+        # Each user is synced once, the latest event is an update
+        self.assertEqual (odbc.synced, [(7, False), (8, False)])
+        # The users are fetched with a single query
+        selects = [s for s, p in odbc.cursor.executed if self.table in s]
+        self.assertEqual (len (selects), 1)
+        # All records are collapsed into one update to success
+        self.assertEqual (self.status (odbc), ({}, [1.0, 2.0, 3.0, 4.0]))
+        self.assertEqual (odbc.cursor.commits, 1)
+    # end def test_coalesce
+
+    def test_latest_event (self) :
+        # Same event_time: The record_id decides
+        events = [self.event (2, 7, 'insert'), self.event (1, 7, 'update')]
+        odbc = self.connector (events, [7])
+        odbc.etl (100)
+        self.assertEqual (odbc.synced, [(7, True)])
+    # end def test_latest_event
+
+    def test_error_fan_out (self) :
+        events = \
+            [ self.event (1, 7, 'update', 0, attempt = 0)
+            , self.event (2, 7, 'update', 1, attempt = 11)
+            , self.event (3, 8, 'update', 0)
+            ]
+        odbc = self.connector \
+            (events, [7, 8], errors = {7 : 'busy'}, messages = {7 : 'bad'})
+        odbc.etl (100)
+        updates, success = self.status (odbc)
+        self.assertEqual (success, [3.0])
+        self.assertEqual \
+            ( updates
+            , { 1.0 : dict
+                  ( attempt       = 1
+                  , error_message = 'bad\nbusy'
+                  , status        = 'E'
+                  )
+              , 2.0 : dict
+                  ( attempt       = 12
+                  , error_message = 'bad\nbusy'
+                  , status        = 'F'
+                  )
+              }
+            )
+        # All errors of the writer are consumed
+        self.assertEqual (odbc.ldap.writer.errors, {})
+    # end def test_error_fan_out
+
+    def test_warning_fan_out (self) :
+        # A delete event for an existing user and a warning of the sync
+        events = \
+            [self.event (1, 7, 'update', 0), self.event (2, 7, 'delete', 1)]
+        odbc = self.connector (events, [7], messages = {('warn', 7) : 'Hmm'})
+        odbc.etl (100)
+        self.assertEqual (odbc.synced, [(7, False)])
+        msg = 'Record 7 existing in DB ph08\nHmm'
+        warn = dict (error_message = msg, status = 'W')
+        self.assertEqual (self.status (odbc), ({1.0 : warn, 2.0 : warn}, []))
+    # end def test_warning_fan_out
+
+    def test_missing_user (self) :
+        events = [self.event (1, 7, 'delete'), self.event (2, 8, 'update')]
+        odbc = self.connector (events, [])
+        odbc.etl (100)
+        self.assertEqual (odbc.synced, [])
+        self.assertEqual (odbc.deleted, [7, 8])
+        warn = dict \
+            ( error_message = 'Record 8 not existing in DB'
+            , status        = 'W'
+            )
+        self.assertEqual (self.status (odbc), ({2.0 : warn}, [1.0]))
+    # end def test_missing_user
+
+    def test_read_only (self) :
+        events = [self.event (1, 7, 'update', 3), self.event (2, 8, 'update')]
+        odbc = self.connector (events, [7, 8])
+        odbc.read_only ['ph08'] = datetime (2017, 1, 1)
+        odbc.etl (100)
+        self.assertEqual (odbc.synced, [(7, False), (8, False)])
+        self.assertEqual (self.status (odbc), ({}, []))
+        self.assertEqual (odbc.cursor.commits, 0)
+        self.assertEqual (odbc.read_only ['ph08'], datetime (2026, 1, 1, 0, 3))
+    # end def test_read_only
+
+# end class Test_ETL
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_Update_Eventlog (unittest.TestCase) :
+    """ Grouping of the eventlog status updates
+    """
+
+    def connector (self, db = 'ph08') :
+        odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        odbc.args   = Namespace (verbose = False, action = 'etl')
+        odbc.log    = Fake_Log ()
+        odbc.db     = db
+        odbc.cursor = Fake_Cursor ()
+        return odbc
+    # end def connector
+
+    def test_success_in_list (self) :
+        odbc = self.connector ()
+        odbc.max_in_list = 2
+        t1 = datetime (2026, 1, 1)
+        t2 = datetime (2026, 1, 2)
+        updates = dict \
+            ( (rid, dict (status = 'S', read_time = t))
+              for rid, t in ((1, t1), (2, t1), (3, t1), (4, t2))
+            )
+        odbc.update_eventlog (updates)
+        self.assertEqual (odbc.cursor.many, [])
+        self.assertEqual \
+            ( [p for sql, p in odbc.cursor.executed]
+            , [('S', t1, 1.0, 2.0), ('S', t1, 3.0), ('S', t2, 4.0)]
+            )
+        sql = odbc.cursor.executed [0][0]
+        self.assertTrue (sql.endswith ('where record_id in (?,?)'))
+        self.assertEqual (odbc.cursor.commits, 1)
+    # end def test_success_in_list
+
+    def test_grouped_by_columns (self) :
+        odbc = self.connector ()
+        t = datetime (2026, 1, 1)
+        updates = \
+            { 1 : dict (status = 'W', error_message = 'a', read_time = t)
+            , 2 : dict (status = 'S', read_time = t)
+            , 3 : dict (status = 'F', error_message = 'b', read_time = t)
+            , 4 : dict
+                (status = 'E', error_message = 'c', attempt = 2, read_time = t)
+            }
+        odbc.update_eventlog (updates)
+        self.assertEqual \
+            ([p for sql, p in odbc.cursor.executed], [('S', t, 2.0)])
+        self.assertEqual \
+            ( odbc.cursor.many
+            , [ ( 'update eventlog_ph set error_message = ?, read_time = ?,'
+                  ' status = ? where record_id = ?'
+                , [['a', t, 'W', 1.0], ['b', t, 'F', 3.0]]
+                )
+              , ( 'update eventlog_ph set attempt = ?, error_message = ?,'
+                  ' read_time = ?, status = ? where record_id = ?'
+                , [[2, 'c', t, 'E', 4.0]]
+                )
+              ]
+            )
+        self.assertTrue (odbc.cursor.fast_executemany)
+        self.assertEqual (odbc.cursor.commits, 1)
+    # end def test_grouped_by_columns
+
+    def test_postgres (self) :
+        odbc = self.connector ('postgres')
+        t = datetime (2026, 1, 1)
+        odbc.update_eventlog \
+            ({1 : dict (status = 'W', error_message = 'a', read_time = t)})
+        self.assertEqual (len (odbc.cursor.many), 1)
+        self.assertFalse (hasattr (odbc.cursor, 'fast_executemany'))
+    # end def test_postgres
+
+# end class Test_Update_Eventlog
+
+if __name__ == '__main__' :
+    unittest.main ()
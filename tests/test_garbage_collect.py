@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+import unittest
+
+from argparse import Namespace
+
+from tests.fakes import Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+class Fake_Directory (object) :
+    """ Connection doing paged searches over a list of dns, writer
+        deleting from that list.
+    """
+
+    def __init__ (self, dns, failing = ()) :
+        self.dns      = list (dns)
+        self.failing  = set (failing)
+        self.searches = []
+        self.abandons = []
+        self.response = []
+        self.result   = {}
+    # end def __init__
+
+    def search (self, base, filter, **kw) :
+        size = kw ['paged_size']
+        if size == 0 :
+            self.abandons.append (kw ['paged_cookie'])
+            self.result = {}
+            return True
+        self.searches.append (size)
+        self.response = [dict (dn = dn) for dn in self.dns [:size]]
+        cookie = b'more' if len (self.dns) > size else b''
+        ctrl   = dict (value = dict (cookie = cookie))
+        self.result = dict (controls = {etl.paged_oid : ctrl})
+        return bool (self.response)
+    # end def search
+
+    def delete (self, dn, msg = None, collect = True) :
+        if dn not in self.failing :
+            self.dns.remove (dn)
+    # end def delete
+
+    def flush (self) :
+        pass
+    # end def flush
+
+# end class Fake_Directory
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_Garbage_Collect (unittest.TestCase) :
+
+    def connector (self, directory, budget = 0) :
+        ldap = etl.LDAP_Access.__new__ (etl.LDAP_Access)
+        ldap.pool   = Namespace (connection = lambda : directory)
+        ldap.writer = directory
+        odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        odbc.args   = Namespace \
+            ( gc_watch       = False
+            , gc_interval    = 0
+            , gc_time_budget = budget
+            , ldap_page_size = 3
+            , page_size      = 1000
+            , verbose        = False
+            )
+        odbc.log    = Fake_Log ()
+        odbc.ldap   = ldap
+        odbc.dn     = 'ou=ph08,o=BMUKK'
+        odbc.gc_due = {}
+        return odbc
+    # end def connector
+
+    def test_all_pages (self) :
+        d = Fake_Directory ('cn=%d' % i for i in range (7))
+        self.connector (d).garbage_collect ()
+        self.assertEqual (d.dns, [])
+        # LDAP page size, not the database one
+        self.assertEqual (d.searches, [3, 3, 3])
+        # The searches are not continued, each is abandoned
+        self.assertEqual (d.abandons, [b'more', b'more'])
+    # end def test_all_pages
+
+    def test_time_budget (self) :
+        d = Fake_Directory ('cn=%d' % i for i in range (7))
+        odbc = self.connector (d, budget = 1e-9)
+        odbc.garbage_collect ()
+        self.assertEqual (len (d.dns), 4)
+        self.assertEqual (d.abandons, [b'more'])
+        self.assertEqual (len (odbc.log.infos), 1)
+    # end def test_time_budget
+
+    def test_failing_deletes (self) :
+        d = Fake_Directory (('cn=%d' % i for i in range (7)), ['cn=1'])
+        self.connector (d).garbage_collect ()
+        self.assertEqual (d.dns, ['cn=1'])
+        self.assertEqual (d.searches, [3, 3, 3, 3])
+        self.assertEqual (d.abandons, [b'more', b'more'])
+    # end def test_failing_deletes
+
+    def test_interval (self) :
+        d = Fake_Directory (['cn=0'])
+        odbc = self.connector (d)
+        odbc.args.gc_interval = 3600
+        odbc.garbage_collect ()
+        d.dns.append ('cn=1')
+        odbc.garbage_collect ()
+        self.assertEqual (d.dns, ['cn=1'])
+        self.assertEqual (d.searches, [3])
+    # end def test_interval
+
+# end class Test_Garbage_Collect
+
+if __name__ == '__main__' :
+    unittest.main ()
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+import unittest
+
+from argparse      import Namespace
+from unittest.mock import patch
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+class Fake_Pool (object) :
+    """ Runs the partitions of load_parallel in our process
+    """
+
+    def __init__ (self, size) :
+        self.size  = size
+        self.parts = None
+    # end def __init__
+
+    def __enter__ (self) :
+        return self
+    # end def __enter__
+
+    def __exit__ (self, *args) :
+        pass
+    # end def __exit__
+
+    def starmap (self, fun, parts) :
+        self.parts = list (parts)
+        return [0 for p in self.parts]
+    # end def starmap
+
+# end class Fake_Pool
+
+class Fake_Context (object) :
+
+    def __init__ (self) :
+        self.pools = []
+    # end def __init__
+
+    def Pool (self, size) :
+        self.pools.append (Fake_Pool (size))
+        return self.pools [-1]
+    # end def Pool
+
+# end class Fake_Context
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_Load_Parallel (unittest.TestCase) :
+
+    def connector (self, uids, parallel) :
+        odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        odbc.args       = Namespace (parallel = parallel)
+        odbc.log        = Namespace (info = lambda msg : None)
+        odbc.db         = 'ph08'
+        odbc.dn         = 'ou=ph08,o=BMUKK'
+        odbc.checkpoint = None
+        odbc.uidmap     = Namespace (mark_seen = lambda uid : None)
+        odbc.db_uids    = lambda end = None : uids
+        return odbc
+    # end def connector
+
+    def partitions (self, uids, parallel) :
+        ctx = Fake_Context ()
+        with patch.object (etl, 'get_context', lambda method : ctx) :
+            self.connector (uids, parallel).load_parallel ()
+        return [(s, e) for a, dn, db, s, e, r in ctx.pools [0].parts]
+    # end def partitions
+
+    def test_empty_table (self) :
+        self.assertEqual (self.partitions ([], 4), [(0, None)])
+    # end def test_empty_table
+
+    def test_partitions (self) :
+        self.assertEqual \
+            ( self.partitions (list (range (1, 9)), 4)
+            , [(0, 3), (3, 5), (5, 7), (7, None)]
+            )
+        # Fewer rows than processes and a uid 0
+        self.assertEqual \
+            (self.partitions ([0, 5], 4), [(0, 5), (5, None)])
+    # end def test_partitions
+
+    def test_load_partition (self) :
+        created = []
+        class Fake_Connector (object) :
+            def __init__ (self, args) :
+                created.append (args)
+            def load_range (self, start, end, resume) :
+                return (start, end, resume)
+        args = Namespace \
+            ( base_dn         = ['ou=ph08,o=BMUKK', 'ou=ph10,o=BMUKK']
+            , databases       = ['ph08', 'ph10']
+            , ldap_cache_size = 10000
+            , merge_join      = False
+            )
+        with patch.object (etl, 'ODBC_Connector', Fake_Connector) :
+            r = etl.load_partition \
+                (args, 'ou=ph10,o=BMUKK', 'ph10', 5, 9, 7)
+        self.assertEqual (r, (5, 9, 7))
+        # Only the partition's base dn, no LDAP cache
+        self.assertEqual (created [0].base_dn,   ['ou=ph10,o=BMUKK'])
+        self.assertEqual (created [0].databases, ['ph10'])
+        self.assertEqual (created [0].ldap_cache_size, 0)
+        self.assertEqual (args.ldap_cache_size, 10000)
+    # end def test_load_partition
+
+# end class Test_Load_Parallel
+
+if __name__ == '__main__' :
+    unittest.main ()
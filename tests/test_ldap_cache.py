@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+import unittest
+
+from argparse import Namespace
+
+from tests.fakes import Fake_Connection, Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+base  = 'ou=ph08,o=BMUKK'
+other = 'ou=ph15,o=BMUKK'
+
+def entry (cn, uid, b = base, **attrs) :
+    attrs.update (cn = cn, phonlineUniqueId = str (uid))
+    return dict (dn = 'cn=%s,%s' % (cn, b), attributes = attrs)
+# end def entry
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_LDAP_Cache (unittest.TestCase) :
+
+    def cache (self, size, entries = ()) :
+        ldap = Namespace \
+            ( args  = Namespace (ldap_page_size = 500)
+            , ldcon = Fake_Connection (list (entries))
+            , log   = Fake_Log ()
+            , srv   = Namespace (schema = None)
+            )
+        return etl.LDAP_Cache (ldap, [base, other], size)
+    # end def cache
+
+    def dn (self, cn, b = base) :
+        return 'cn=%s,%s' % (cn, b)
+    # end def dn
+
+    def test_complete (self) :
+        c = self.cache (10, [entry ('a', 1), entry ('b', 2)])
+        c.load (base)
+        hit, e = c.get_dn ('CN=A,' + base)
+        self.assertTrue (hit)
+        self.assertEqual (e ['attributes']['phonlineuniqueid'], '1')
+        # Missing entries of a complete base don't exist
+        self.assertEqual (c.get_dn (self.dn ('x')), (True, None))
+        self.assertEqual (c.get_uid (base, 3), (True, []))
+        hit, es = c.get_uid (base.upper (), 2)
+        self.assertEqual ([e ['dn'] for e in es], [self.dn ('b')])
+        # Not loaded
+        self.assertEqual (c.get_dn (self.dn ('a', other)), (False, None))
+        self.assertEqual (c.get_uid (other, 1), (False, None))
+        self.assertEqual ((c.hits, c.misses), (4, 2))
+    # end def test_complete
+
+    def test_copies (self) :
+        c = self.cache (10, [entry ('a', 1)])
+        c.load (base)
+        hit, e = c.get_dn (self.dn ('a'))
+        e ['attributes']['cn'] = 'changed'
+        hit, e = c.get_dn (self.dn ('a'))
+        self.assertEqual (e ['attributes']['cn'], 'a')
+    # end def test_copies
+
+    def test_lru (self) :
+        c = self.cache (2, [entry ('a', 1), entry ('b', 2)])
+        c.load (base)
+        # Use a, b is now the least recently used
+        c.get_dn (self.dn ('a'))
+        c.added (self.dn ('c'), dict (cn = 'c', phonlineUniqueId = '3'))
+        self.assertEqual \
+            (list (c.entries), [self.dn (x).lower () for x in 'ac'])
+        # Evicted: The cache is no longer complete for base
+        self.assertEqual (c.get_dn (self.dn ('b')), (False, None))
+        self.assertEqual (c.get_dn (self.dn ('x')), (False, None))
+        self.assertEqual (c.get_uid (base, 2), (False, None))
+        self.assertTrue (c.get_dn (self.dn ('c')) [0])
+    # end def test_lru
+
+    def test_absent (self) :
+        c = self.cache (2)
+        c.store_absent (self.dn ('a'))
+        # Not managed
+        c.store_absent ('cn=a,o=BMUKK')
+        self.assertEqual (c.get_dn (self.dn ('a')), (True, None))
+        self.assertEqual (c.get_dn ('cn=a,o=BMUKK'), (False, None))
+        c.added (self.dn ('a'), dict (cn = 'a'))
+        hit, e = c.get_dn (self.dn ('a'))
+        self.assertEqual (e ['attributes']['cn'], 'a')
+        c.deleted (self.dn ('a'))
+        self.assertEqual (c.get_dn (self.dn ('a')), (True, None))
+        # At most size absent dns
+        c.store_absent (self.dn ('b'))
+        c.store_absent (self.dn ('c'))
+        self.assertEqual (c.get_dn (self.dn ('a')), (False, None))
+        self.assertEqual (c.get_dn (self.dn ('c')), (True, None))
+    # end def test_absent
+
+    def test_uid (self) :
+        c = self.cache (3)
+        c.store_uid (base, 1, [entry ('a', 1), entry ('a2', 1)])
+        c.store_uid (base, 2, [])
+        hit, es = c.get_uid (base, 1)
+        self.assertEqual \
+            ([e ['dn'] for e in es], [self.dn ('a'), self.dn ('a2')])
+        self.assertEqual (c.get_uid (base, 2), (True, []))
+        self.assertEqual (c.get_uid (base, 3), (False, None))
+        # Evicting one of the entries forgets that all are known
+        c.added (self.dn ('b'), dict (cn = 'b', phonlineUniqueId = '4'))
+        c.added (self.dn ('c'), dict (cn = 'c', phonlineUniqueId = '5'))
+        self.assertEqual (c.get_uid (base, 1), (False, None))
+    # end def test_uid
+
+    def test_modified (self) :
+        c = self.cache (10, [entry ('a', 1, mail = ['x@a', 'y@a'])])
+        c.load (base)
+        c.modified \
+            ( self.dn ('a')
+            , dict
+                ( mail             = (etl.MODIFY_DELETE, ['x@a'])
+                , phonlineUniqueId = (etl.MODIFY_REPLACE, ['7'])
+                , sn               = (etl.MODIFY_ADD, ['Doe'])
+                )
+            )
+        hit, e = c.get_dn (self.dn ('a'))
+        self.assertEqual (e ['attributes']['mail'], 'y@a')
+        self.assertEqual (e ['attributes']['sn'], 'Doe')
+        self.assertEqual (c.get_uid (base, 1), (True, []))
+        self.assertEqual (len (c.get_uid (base, 7) [1]), 1)
+        c.modified (self.dn ('a'), dict (sn = (etl.MODIFY_DELETE, [])))
+        self.assertNotIn ('sn', c.get_dn (self.dn ('a')) [1]['attributes'])
+    # end def test_modified
+
+    def test_renamed (self) :
+        c = self.cache (10, [entry ('a', 1)])
+        c.load (base)
+        c.renamed (self.dn ('a'), self.dn ('b'))
+        self.assertEqual (c.get_dn (self.dn ('a')), (True, None))
+        hit, e = c.get_dn (self.dn ('b'))
+        self.assertEqual (e ['attributes']['cn'], 'b')
+        hit, es = c.get_uid (base, 1)
+        self.assertEqual ([e ['dn'] for e in es], [self.dn ('b')])
+    # end def test_renamed
+
+    def test_invalidate (self) :
+        c = self.cache (10, [entry ('a', 1)])
+        c.load (base)
+        c.store_absent (self.dn ('b'))
+        c.invalidate ([self.dn ('a'), self.dn ('b')])
+        self.assertEqual (c.get_dn (self.dn ('a')), (False, None))
+        self.assertEqual (c.get_dn (self.dn ('b')), (False, None))
+        self.assertEqual (c.get_uid (base, 1), (False, None))
+    # end def test_invalidate
+
+# end class Test_LDAP_Cache
+
+if __name__ == '__main__' :
+    unittest.main ()
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+import unittest
+
+from argparse import Namespace
+
+from tests.fakes import Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+class Fake_Async (object) :
+    """ Asynchronous connection: Operations return a message id, the
+        result is fetched with get_response. Operations on the DNs in
+        failing fail, in broken raise an exception.
+    """
+
+    def __init__ (self, failing = (), broken = ()) :
+        self.failing = set (failing)
+        self.broken  = set (broken)
+        self.msgid   = 0
+        self.ops     = {}
+        self.trace   = []
+        self.result  = None
+    # end def __init__
+
+    def add (self, dn, attributes = None) :
+        return self.send ('add', dn)
+    # end def add
+
+    def delete (self, dn) :
+        return self.send ('delete', dn)
+    # end def delete
+
+    def get_response (self, msgid) :
+        self.trace.append (('done', msgid))
+        name, dn = self.ops.pop (msgid)
+        if dn in self.broken :
+            raise etl.LDAPException ("Connection lost")
+        return [], self.status (dn)
+    # end def get_response
+
+    def modify (self, dn, changes) :
+        return self.send ('modify', dn)
+    # end def modify
+
+    def modify_dn (self, dn, rdn) :
+        return self.send ('modify_dn', dn)
+    # end def modify_dn
+
+    def send (self, name, dn) :
+        self.msgid += 1
+        self.ops [self.msgid] = (name, dn)
+        self.trace.append ((name, self.msgid))
+        return self.msgid
+    # end def send
+
+    def status (self, dn) :
+        if dn in self.failing :
+            return dict \
+                (description = 'noSuchObject', message = '', result = 32)
+        return dict (description = 'success', message = '', result = 0)
+    # end def status
+
+# end class Fake_Async
+
+class Fake_Sync (Fake_Async) :
+    """ Synchronous connection: Operations return success
+    """
+
+    def send (self, name, dn) :
+        self.trace.append ((name, dn))
+        self.result = self.status (dn)
+        return self.result ['result'] == 0
+    # end def send
+
+# end class Fake_Sync
+
+class Observer (object) :
+
+    def __init__ (self) :
+        self.events = []
+    # end def __init__
+
+    def __getattr__ (self, name) :
+        return lambda *args : self.events.append ((name, args [0]))
+    # end def __getattr__
+
+# end class Observer
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_LDAP_Writer (unittest.TestCase) :
+
+    def writer (self, window, con) :
+        ldap = Namespace \
+            ( args  = Namespace (ldap_write_window = window)
+            , log   = Fake_Log ()
+            , ldcon = con
+            )
+        writer = etl.LDAP_Writer (ldap)
+        writer.con = con
+        self.observer = Observer ()
+        writer.observers.append (self.observer)
+        return writer
+    # end def writer
+
+    def test_errors_by_key (self) :
+        con = Fake_Async (failing = ['cn=b', 'cn=c', 'cn=d'])
+        w   = self.writer (2, con)
+        for key, dn in ((1, 'cn=a'), (2, 'cn=b'), (None, 'cn=c')) :
+            w.key = key
+            self.assertIsNone (w.modify (dn, {}))
+        w.key = 3
+        w.delete ('cn=d', collect = False)
+        w.delete ('cn=a')
+        w.flush ()
+        self.assertEqual (w.pending, {})
+        self.assertEqual (w.dns, {})
+        self.assertEqual (list (w.errors), [2])
+        self.assertIsNone (w.pop_errors (1))
+        self.assertIn ('Error on LDAP modify: noSuchObject', w.pop_errors (2))
+        self.assertIsNone (w.pop_errors (2))
+        # Every failure is logged, collected or not
+        self.assertEqual (len (w.log.errors), 3)
+        self.assertEqual \
+            ( self.observer.events
+            , [ ('modified',   'cn=a')
+              , ('invalidate', 'cn=b')
+              , ('invalidate', 'cn=c')
+              , ('invalidate', 'cn=d')
+              , ('deleted',    'cn=a')
+              ]
+            )
+    # end def test_errors_by_key
+
+    def test_exception (self) :
+        con = Fake_Async (broken = ['cn=a'])
+        w   = self.writer (2, con)
+        w.key = 7
+        w.add ('cn=a', {})
+        w.flush ()
+        self.assertIn ('LDAPException: Connection lost', w.pop_errors (7))
+    # end def test_exception
+
+    def test_window (self) :
+        con = Fake_Async ()
+        w   = self.writer (2, con)
+        for dn in ('cn=a', 'cn=b', 'cn=c') :
+            w.add (dn, {})
+        self.assertEqual \
+            (con.trace, [('add', 1), ('add', 2), ('done', 1), ('add', 3)])
+        w.flush ()
+        self.assertEqual (con.ops, {})
+    # end def test_window
+
+    def test_same_dn (self) :
+        # Operations on the same DN are not in flight at the same time
+        con = Fake_Async ()
+        w   = self.writer (10, con)
+        w.add ('cn=a,o=x', {})
+        w.add ('cn=b,o=x', {})
+        w.modify_dn ('cn=A,o=x', 'cn=c')
+        w.modify ('cn=c,o=x', {})
+        w.flush ()
+        self.assertEqual \
+            ( con.trace
+            , [ ('add', 1), ('add', 2), ('done', 1), ('modify_dn', 3)
+              , ('done', 2), ('done', 3), ('modify', 4), ('done', 4)
+              ]
+            )
+        self.assertIn (('renamed', 'cn=A,o=x'), self.observer.events)
+    # end def test_same_dn
+
+    def test_synchronous (self) :
+        con = Fake_Sync (failing = ['cn=b'])
+        w   = self.writer (0, con)
+        w.key = 1
+        self.assertIsNone (w.add ('cn=a', {}))
+        msg = w.delete ('cn=b')
+        self.assertIn ('Error on LDAP delete: noSuchObject', msg)
+        self.assertEqual (w.errors, {})
+        self.assertEqual \
+            ( self.observer.events
+            , [('added', 'cn=a'), ('invalidate', 'cn=b')]
+            )
+    # end def test_synchronous
+
+# end class Test_LDAP_Writer
+
+if __name__ == '__main__' :
+    unittest.main ()
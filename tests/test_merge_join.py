@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+import unittest
+
+from tests.fakes import Fake_Connection, Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+class Fake_Access (object) :
+    """ LDAP_Access that records the searches of lookup_record
+    """
+
+    def __init__ (self, entries = ()) :
+        self.entries  = entries
+        self.searches = []
+    # end def __init__
+
+    def get_by_cn (self, cn) :
+        self.searches.append (('cn', cn))
+        for e in self.entries :
+            if e ['dn'].lower ().startswith ('cn=%s,' % cn.lower ()) :
+                return e
+    # end def get_by_cn
+
+    def get_entries (self, uid) :
+        self.searches.append (('uid', uid))
+        return \
+            [ e for e in self.entries
+              if e ['attributes']['phonlineUniqueId'] == uid
+            ]
+    # end def get_entries
+
+# end class Fake_Access
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_Merge_Join (unittest.TestCase) :
+    """ With the uidmap of a merge join lookup_record must find the
+        same entries as with LDAP searches but without searching.
+    """
+
+    base  = 'ou=ph08,o=BMUKK'
+    attrs = ('cn', 'phonlineUniqueId', 'sn', 'idnDeleted')
+
+    def entry (self, cn, uid, deleted = False) :
+        atr = dict (cn = [cn], phonlineUniqueId = str (uid), sn = [cn])
+        if deleted :
+            atr ['idnDeleted'] = True
+        return dict (dn = 'cn=%s,%s' % (cn, self.base), attributes = atr)
+    # end def entry
+
+    def setUp (self) :
+        self.entries = \
+            [ self.entry ('alice', 10)
+            , self.entry ('bob',   20)
+            , self.entry ('Carol', 30, deleted = True)
+            , self.entry ('dave',  40)
+            , self.entry ('dave2', 40)
+            , self.entry ('a+b',   50)
+            ]
+        self.odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        self.odbc.log  = Fake_Log ()
+        self.odbc.ldap = Fake_Access (self.entries)
+    # end def setUp
+
+    def uidmap (self, start = None, end = None) :
+        return etl.UID_Map \
+            ( Fake_Connection (self.entries), self.base, Fake_Log ()
+            , attributes = self.attrs, start = start, end = end
+            )
+    # end def uidmap
+
+    def lookup (self, cn, uid, uidmap = None, force = False) :
+        rw = etl.Namespace (benutzername = cn, pk_uniqueid = float (uid))
+        self.odbc.ldap.searches = []
+        ldrec, msg = self.odbc.lookup_record \
+            (rw, str (uid), True, force, uidmap)
+        dn = ldrec and ldrec ['dn']
+        return dn, bool (msg), self.odbc.ldap.searches
+    # end def lookup
+
+    cases = \
+        ( ('alice',  10) # found by cn
+        , ('ALICE',  10) # cn is case-insensitive
+        , ('bobby',  20) # renamed, found by uid
+        , ('carol',  31) # deleted entry with same cn, other uid
+        , ('carol',  30) # resurrect
+        , ('dave3',  40) # several entries with the uid
+        , ('eve',    60) # new
+        , ('a+b',    50) # escaped in the dn
+        , ('bob',    10) # cn of another uid
+        )
+
+    def test_same_as_search (self) :
+        uidmap = self.uidmap ()
+        for cn, uid in self.cases :
+            for force in (False, True) :
+                dn, err, searches = self.lookup (cn, uid, force = force)
+                self.assertEqual \
+                    ( self.lookup (cn, uid, uidmap, force) [:2]
+                    , (dn, err)
+                    , (cn, uid, force)
+                    )
+    # end def test_same_as_search
+
+    def test_no_search (self) :
+        uidmap = self.uidmap ()
+        for cn, uid in self.cases :
+            dn, err, searches = self.lookup (cn, uid, uidmap)
+            if cn == 'a+b' :
+                self.assertEqual (searches, [('cn', 'a+b')])
+            else :
+                self.assertEqual (searches, [], cn)
+    # end def test_no_search
+
+    def test_partition (self) :
+        # A cn not in the partition may belong to another uid
+        uidmap = self.uidmap (start = 15, end = 45)
+        for cn, uid in self.cases :
+            if not 15 <= uid < 45 :
+                continue
+            expect = self.lookup (cn, uid) [:2]
+            dn, err, searches = self.lookup (cn, uid, uidmap)
+            self.assertEqual ((dn, err), expect, cn)
+            self.assertNotIn ('uid', [k for k, v in searches])
+        dn, err, searches = self.lookup ('bob', 20, uidmap)
+        self.assertEqual (searches, [])
+        dn, err, searches = self.lookup ('alice', 20, uidmap)
+        self.assertEqual (dn, 'cn=alice,' + self.base)
+        self.assertEqual (searches, [('cn', 'alice')])
+    # end def test_partition
+
+    def test_find_rdn (self) :
+        uidmap = self.uidmap ()
+        for e in self.entries :
+            rdn = e ['dn'].split (',') [0]
+            idx = uidmap.find_rdn (rdn.upper ())
+            self.assertEqual (uidmap.dn (idx), e ['dn'])
+        self.assertIsNone (uidmap.find_rdn ('cn=zz'))
+        self.assertIsNone (uidmap.find_rdn ('cn=a'))
+    # end def test_find_rdn
+
+# end class Test_Merge_Join
+
+if __name__ == '__main__' :
+    unittest.main ()
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+import unittest
+
+from hashlib import sha256
+
+try :
+    from aes_pkcs7 import AES_Cipher, Password_Diff
+except ImportError :
+    Password_Diff = None
+
+@unittest.skipUnless (Password_Diff, "aes_pkcs7 needs pycryptodome")
+class Test_Password_Diff (unittest.TestCase) :
+
+    def setUp (self) :
+        self.pd = Password_Diff (AES_Cipher (b'01' * 16))
+    # end def setUp
+
+    def test_random_iv (self) :
+        c1 = self.pd.encrypt ('secret')
+        c2 = self.pd.encrypt ('secret')
+        self.assertNotEqual (c1, c2)
+        self.assertFalse (self.pd.changed ('secret', c1))
+        self.assertFalse (self.pd.changed ('secret', c2))
+        self.assertTrue  (self.pd.changed ('Secret', c1))
+    # end def test_random_iv
+
+    def test_fixed_iv (self) :
+        pd = Password_Diff (AES_Cipher (b'01' * 16), iv = '00' * 16)
+        c  = pd.encrypt ('secret')
+        self.assertEqual (c, pd.encrypt ('secret'))
+        self.assertTrue  (c.startswith ('00' * 16))
+        # The IV of the stored password is not needed for comparing
+        self.assertFalse (self.pd.changed ('secret', c))
+    # end def test_fixed_iv
+
+    def test_non_ascii (self) :
+        plain = 'Gr\u00fc\u00dfe \u20ac'
+        self.assertEqual (self.pd.plaintext (self.pd.encrypt (plain)), plain)
+        self.assertFalse (self.pd.changed (plain, self.pd.encrypt (plain)))
+    # end def test_non_ascii
+
+    def test_unusable_stored (self) :
+        c = self.pd.encrypt ('secret')
+        for stored in (None, '', [], [c, c], 'xyz', '0' * 64, c [:-1]) :
+            self.assertTrue (self.pd.changed ('secret', stored), stored)
+        other = Password_Diff (AES_Cipher (b'02' * 16))
+        self.assertTrue (other.changed ('secret', c))
+    # end def test_unusable_stored
+
+    def test_digest (self) :
+        d = self.pd.digest ('secret')
+        self.assertEqual (d, self.pd.digest ('secret'))
+        self.assertNotEqual (d, self.pd.digest ('secret '))
+        # Keyed: Differs from the plain hash and for another key
+        self.assertNotEqual (d, sha256 (b'secret').hexdigest ())
+        other = Password_Diff (AES_Cipher (b'02' * 16))
+        self.assertNotEqual (d, other.digest ('secret'))
+        self.assertNotIn ('secret', d)
+    # end def test_digest
+
+# end class Test_Password_Diff
+
+if __name__ == '__main__' :
+    unittest.main ()
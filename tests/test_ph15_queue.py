@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from argparse import Namespace
+
+from sync_state  import Sync_State
+from tests.fakes import Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+class Fake_Connector (object) :
+    """ Connector for ph15 with errors of write_ph15_batch given by
+        the test, the password "encryption" is visible.
+    """
+
+    def __init__ (self, state = None) :
+        self.log     = Fake_Log ()
+        self.state   = state
+        self.pwdiff  = Namespace \
+            ( encrypt   = lambda p : 'enc:' + p
+            , plaintext = lambda p : p [4:]
+            )
+        self.batches = []
+        self.errors  = {}
+    # end def __init__
+
+    def write_ph15_batch (self, batch) :
+        self.batches.append \
+            ([(e.cn, dict (e.values)) for e in batch])
+        if self.errors is None :
+            raise ValueError ("LDAP is gone")
+        return dict \
+            ((e.cn, self.errors [e.cn]) for e in batch if e.cn in self.errors)
+    # end def write_ph15_batch
+
+# end class Fake_Connector
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_PH15_Writethrough (unittest.TestCase) :
+
+    def setUp (self) :
+        self.dir   = tempfile.mkdtemp ()
+        self.fn    = os.path.join (self.dir, 'state.db')
+        self.con   = Fake_Connector (Sync_State (self.fn))
+        self.queue = etl.PH15_Writethrough (self.con, start = False)
+    # end def setUp
+
+    def tearDown (self) :
+        shutil.rmtree (self.dir)
+    # end def tearDown
+
+    def stored (self) :
+        """ Queue as committed in the sync state
+        """
+        return Sync_State (self.fn).ph15_queue ()
+    # end def stored
+
+    def test_merge (self) :
+        q = self.queue
+        q.put ('jdoe', dict (vorname = 'John', nachname = 'Doe'))
+        q.put ('other', dict (vorname = 'Jane'))
+        q.put ('JDoe', dict (nachname = 'Smith'))
+        batch = q.take ()
+        self.assertEqual \
+            ( [(e.cn, e.values) for e in batch]
+            , [ ('jdoe',  dict (vorname = 'John', nachname = 'Smith'))
+              , ('other', dict (vorname = 'Jane'))
+              ]
+            )
+        self.assertEqual (q.take (), [])
+    # end def test_merge
+
+    def test_batch_size (self) :
+        q = self.queue
+        for n in range (q.batch_size + 1) :
+            q.put ('cn%d' % n, dict (vorname = 'x'))
+        self.assertEqual (len (q.take ()), q.batch_size)
+        self.assertEqual ([e.cn for e in q.take ()], ['cn100'])
+    # end def test_batch_size
+
+    def test_retry (self) :
+        q = self.queue
+        q.put ('jdoe', dict (vorname = 'John'))
+        self.con.errors = dict (jdoe = 'busy')
+        q.process (q.take ())
+        e = q.pending ['jdoe']
+        self.assertEqual (e.attempts, 1)
+        self.assertGreater (e.due, 0)
+        # Backoff: not due yet
+        self.assertEqual (q.take (), [])
+        e.due = 0
+        self.con.errors = None
+        q.process (q.take ())
+        self.assertEqual (q.pending ['jdoe'].attempts, 2)
+        self.assertEqual (len (self.con.log.errors), 1)
+        q.pending ['jdoe'].due = 0
+        self.con.errors = {}
+        q.process (q.take ())
+        self.assertEqual (len (q.pending), 0)
+        self.assertEqual (self.stored (), [])
+    # end def test_retry
+
+    def test_newer_change_for_failed (self) :
+        q = self.queue
+        q.put ('jdoe', dict (vorname = 'John', nachname = 'Doe'))
+        batch = q.take ()
+        q.put ('jdoe', dict (nachname = 'Smith'))
+        self.con.errors = dict (jdoe = 'busy')
+        q.process (batch)
+        e = q.pending ['jdoe']
+        values = dict (vorname = 'John', nachname = 'Smith')
+        self.assertEqual (e.values, values)
+        self.assertEqual (e.attempts, 0)
+        self.assertEqual (self.stored (), [('jdoe', values, False)])
+    # end def test_newer_change_for_failed
+
+    def test_newer_change_kept (self) :
+        # A write in progress must not remove a newer change
+        q = self.queue
+        q.put ('jdoe', dict (vorname = 'John'))
+        batch = q.take ()
+        q.put ('jdoe', dict (vorname = 'Jack'))
+        q.process (batch)
+        self.assertEqual \
+            (self.stored (), [('jdoe', dict (vorname = 'Jack'), False)])
+        q.process (q.take ())
+        self.assertEqual (self.stored (), [])
+    # end def test_newer_change_kept
+
+    def test_persistent (self) :
+        q = self.queue
+        q.put ('jdoe', dict (vorname = 'John', passwort = 'secret'))
+        q.put ('other', dict (nachname = 'Doe'))
+        # The sync commits the state before writing the eventlog status
+        self.con.state.commit ()
+        self.assertEqual \
+            ( self.stored ()
+            , [ ('jdoe', dict (vorname = 'John', passwort = 'enc:secret'), 0)
+              , ('other', dict (nachname = 'Doe'), 0)
+              ]
+            )
+        # Restart
+        con = Fake_Connector (Sync_State (self.fn))
+        q   = etl.PH15_Writethrough (con, start = False)
+        batch = q.take ()
+        self.assertEqual \
+            ( [(e.cn, e.values) for e in batch]
+            , [ ('jdoe',  dict (vorname = 'John', passwort = 'secret'))
+              , ('other', dict (nachname = 'Doe'))
+              ]
+            )
+        con.errors = dict (other = 'busy')
+        q.process (batch)
+        self.assertEqual \
+            (self.stored (), [('other', dict (nachname = 'Doe'), False)])
+    # end def test_persistent
+
+    def test_give_up (self) :
+        q = self.queue
+        q.put ('jdoe', dict (vorname = 'John'))
+        self.con.errors = dict (jdoe = 'no such object')
+        for n in range (q.max_attempts) :
+            for e in q.pending.values () :
+                e.due = 0
+            q.process (q.take ())
+        self.assertEqual (len (q.pending), 0)
+        self.assertIn ('Giving up', self.con.log.errors [-1])
+        self.assertEqual \
+            (self.stored (), [('jdoe', dict (vorname = 'John'), True)])
+        # Failed changes are queued again with the next start
+        con = Fake_Connector (Sync_State (self.fn))
+        q   = etl.PH15_Writethrough (con, start = False)
+        self.assertEqual ([e.cn for e in q.take ()], ['jdoe'])
+        self.assertEqual (len (con.log.warnings), 1)
+    # end def test_give_up
+
+    def test_no_state (self) :
+        q = etl.PH15_Writethrough (Fake_Connector (), start = False)
+        q.put ('jdoe', dict (vorname = 'John'))
+        q.process (q.take ())
+        self.assertEqual (len (q.pending), 0)
+    # end def test_no_state
+
+# end class Test_PH15_Writethrough
+
+if __name__ == '__main__' :
+    unittest.main ()
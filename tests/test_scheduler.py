@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+import time
+import unittest
+
+from argparse import Namespace
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_ETL_Scheduler (unittest.TestCase) :
+
+    inst = ('ou=ph08,o=BMUKK', 'ph08')
+
+    def setUp (self) :
+        self.args = Namespace \
+            ( min_sleeptime = 2
+            , sleeptime     = 20
+            , time_budget   = 10
+            , max_records   = 5000
+            , verbose       = False
+            )
+        self.sched = etl.ETL_Scheduler (self.args, [self.inst])
+        self.state = self.sched.state [self.inst]
+    # end def setUp
+
+    def test_backlog_waits_min_sleeptime (self) :
+        # Records stuck in error state keep count at the limit
+        for i in range (3) :
+            before = time.time ()
+            self.sched.update (self.inst, 100, 100, 1.0, {})
+            self.assertEqual (self.state.interval, 2)
+            self.assertGreaterEqual (self.state.due, before + 2)
+        self.sched.update (self.inst, 100, 5, 1.0, {'N' : (7, 42)})
+        self.assertEqual (self.state.interval, 2)
+        self.assertEqual (self.state.backlog, 7)
+        self.assertEqual (self.sched.due (), [])
+    # end def test_backlog_waits_min_sleeptime
+
+    def test_idle_backoff (self) :
+        intervals = []
+        for i in range (6) :
+            self.sched.update (self.inst, 100, 0, 0.1, {})
+            intervals.append (self.state.interval)
+        self.assertEqual (intervals, [4, 8, 16, 20, 20, 20])
+        self.sched.update (self.inst, 100, 0, 0.1, {'N' : (1, 42)})
+        self.assertEqual (self.state.interval, 2)
+    # end def test_idle_backoff
+
+    def test_default_min_sleeptime (self) :
+        # Without --min-sleeptime we behave as before the scheduler
+        self.args.min_sleeptime = 0
+        sched = etl.ETL_Scheduler (self.args, [self.inst])
+        state = sched.state [self.inst]
+        self.assertEqual (sched.due (), [self.inst])
+        sched.update (self.inst, 100, 100, 1.0, {'N' : (7, 42)})
+        self.assertEqual (state.interval, 0)
+        self.assertEqual (sched.due (), [self.inst])
+        for i in range (3) :
+            sched.update (self.inst, 100, 0, 0.1, {})
+            self.assertEqual (state.interval, 20)
+        sched.update (self.inst, 100, 0, 0.1, {'N' : (1, 42)})
+        self.assertEqual (state.interval, 0)
+    # end def test_default_min_sleeptime
+
+    def test_rate_and_batch_size (self) :
+        self.assertEqual (self.sched.batch_size (self.inst), 100)
+        self.sched.update (self.inst, 100, 100, 2.0, {})
+        self.assertEqual (self.state.rate, 50)
+        self.assertEqual (self.sched.batch_size (self.inst), 500)
+        self.sched.update (self.inst, 500, 500, 1.0, {})
+        self.assertAlmostEqual (self.state.rate, 0.7 * 50 + 0.3 * 500)
+        self.sched.update (self.inst, 100, 0, 0.0, {})
+        self.assertAlmostEqual (self.state.rate, 185)
+        self.state.rate = 10000
+        self.assertEqual (self.sched.batch_size (self.inst), 5000)
+        self.state.rate = 0.01
+        self.assertEqual \
+            (self.sched.batch_size (self.inst), self.sched.min_records)
+    # end def test_rate_and_batch_size
+
+    def test_oldest (self) :
+        backlog = {'N' : (3, 200), 'E' : (2, 100)}
+        self.sched.update (self.inst, 100, 5, 1.0, backlog)
+        self.assertEqual (self.state.oldest, 100)
+        self.assertEqual (self.state.errors, 2)
+        self.sched.update (self.inst, 100, 5, 1.0, {'N' : (0, None)})
+        self.assertIsNone (self.state.oldest)
+    # end def test_oldest
+
+    def test_due_oldest_first (self) :
+        insts = [('ou=a', 'a'), ('ou=b', 'b'), ('ou=c', 'c')]
+        sched = etl.ETL_Scheduler (self.args, insts)
+        sched.state [insts [0]].oldest = None
+        sched.state [insts [1]].oldest = 300
+        sched.state [insts [2]].oldest = 100
+        self.assertEqual (sched.due (), [insts [2], insts [1], insts [0]])
+    # end def test_due_oldest_first
+
+# end class Test_ETL_Scheduler
+
+if __name__ == '__main__' :
+    unittest.main ()
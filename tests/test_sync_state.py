@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sync_state import Sync_State, Load_Checkpoint, fingerprint
+
+class Test_Sync_State (unittest.TestCase) :
+
+    def setUp (self) :
+        self.dir = tempfile.mkdtemp ()
+        self.fn  = os.path.join (self.dir, 'state.db')
+    # end def setUp
+
+    def tearDown (self) :
+        shutil.rmtree (self.dir)
+    # end def tearDown
+
+    def test_roundtrip (self) :
+        st = Sync_State (self.fn)
+        fp = fingerprint (dict (cn = 'x'))
+        st.set ('ou=PH08,o=BMUKK', 4711.0, fp, 'cn=x,ou=ph08,o=BMUKK')
+        st.set ('ou=ph08,o=BMUKK', 42, 'fp42', 'cn=y,ou=ph08,o=BMUKK')
+        st.set ('ou=ph10,o=BMUKK', 42, 'other', 'cn=y,ou=ph10,o=BMUKK')
+        st.set_password ('ou=ph08,o=BMUKK', 4711, 'digest', 'encrypted')
+        st.commit ()
+        st = Sync_State (self.fn)
+        self.assertEqual \
+            ( st.get ('ou=ph08,o=bmukk', '4711')
+            , (fp, 'cn=x,ou=ph08,o=BMUKK')
+            )
+        self.assertEqual \
+            ( st.get_password ('OU=ph08,o=BMUKK', 4711)
+            , ('digest', 'encrypted')
+            )
+        self.assertEqual \
+            ( st.iter ('ou=ph08,o=BMUKK')
+            , [ (42,   'fp42', 'cn=y,ou=ph08,o=BMUKK')
+              , (4711, fp,     'cn=x,ou=ph08,o=BMUKK')
+              ]
+            )
+        self.assertIsNone (st.get ('ou=ph08,o=BMUKK', 1))
+        self.assertIsNone (st.get_password ('ou=ph08,o=BMUKK', 42))
+    # end def test_roundtrip
+
+    def test_replace_and_delete (self) :
+        st = Sync_State (self.fn)
+        st.set ('ou=ph08', 1, 'old', 'cn=a,ou=ph08')
+        st.set ('ou=ph08', 1, 'new', 'cn=b,ou=ph08')
+        st.set_password ('ou=ph08', 1, 'digest', 'encrypted')
+        self.assertEqual (st.get ('ou=ph08', 1), ('new', 'cn=b,ou=ph08'))
+        st.delete ('ou=ph08', 1)
+        st.commit ()
+        st = Sync_State (self.fn)
+        self.assertIsNone (st.get ('ou=ph08', 1))
+        self.assertIsNone (st.get_password ('ou=ph08', 1))
+    # end def test_replace_and_delete
+
+    def test_uncommitted (self) :
+        st = Sync_State (self.fn)
+        st.set ('ou=ph08', 1, 'fp', 'cn=a,ou=ph08')
+        self.assertIsNone (Sync_State (self.fn).get ('ou=ph08', 1))
+    # end def test_uncommitted
+
+    def test_renames (self) :
+        st = Sync_State (self.fn)
+        st.set_renames (dict (old1 = 'new1', old2 = 'new2'))
+        st.set_renames (dict (old1 = 'newer1'))
+        st.commit ()
+        st = Sync_State (self.fn)
+        self.assertEqual \
+            (st.renames (), dict (old1 = 'newer1', old2 = 'new2'))
+        st.delete_renames (['old1'])
+        self.assertEqual \
+            (Sync_State (self.fn).renames (), dict (old2 = 'new2'))
+    # end def test_renames
+
+# end class Test_Sync_State
+
+class Test_Load_Checkpoint (unittest.TestCase) :
+
+    def setUp (self) :
+        self.dir = tempfile.mkdtemp ()
+        self.fn  = os.path.join (self.dir, 'checkpoint.db')
+    # end def setUp
+
+    def tearDown (self) :
+        shutil.rmtree (self.dir)
+    # end def tearDown
+
+    def test_roundtrip (self) :
+        cp = Load_Checkpoint (self.fn)
+        cp.begin ('ou=PH08', [200, 0, 100])
+        cp.begin ('ou=ph10', [0])
+        cp.save  ('ou=ph08', 100, 150)
+        cp.save  ('ou=ph08', 100, 170)
+        cp.save  ('ou=ph08', 0, 99)
+        cp = Load_Checkpoint (self.fn)
+        self.assertEqual \
+            (cp.partitions ('ou=ph08'), [(0, 99), (100, 170), (200, None)])
+        self.assertEqual (cp.partitions ('ou=PH10'), [(0, None)])
+        self.assertEqual (cp.partitions ('ou=ph15'), [])
+        self.assertFalse (cp.is_done ('ou=ph08'))
+    # end def test_roundtrip
+
+    def test_begin_keeps_progress (self) :
+        # A restarted initial_load records its partitions again
+        cp = Load_Checkpoint (self.fn)
+        cp.begin ('ou=ph08', [0, 100])
+        cp.save  ('ou=ph08', 0, 42)
+        Load_Checkpoint (self.fn).begin ('ou=ph08', [0, 100])
+        self.assertEqual \
+            (cp.partitions ('ou=ph08'), [(0, 42), (100, None)])
+    # end def test_begin_keeps_progress
+
+    def test_finish_and_clear (self) :
+        cp = Load_Checkpoint (self.fn)
+        cp.begin  ('ou=ph08', [0])
+        cp.finish ('ou=PH08')
+        cp.finish ('ou=ph08')
+        cp = Load_Checkpoint (self.fn)
+        self.assertTrue  (cp.is_done ('ou=ph08'))
+        self.assertFalse (cp.is_done ('ou=ph10'))
+        cp.clear ()
+        cp = Load_Checkpoint (self.fn)
+        self.assertFalse (cp.is_done ('ou=ph08'))
+        self.assertEqual (cp.partitions ('ou=ph08'), [])
+    # end def test_finish_and_clear
+
+    def test_shared_file (self) :
+        # The processes of a parallel initial_load share the file
+        cp1 = Load_Checkpoint (self.fn)
+        cp2 = Load_Checkpoint (self.fn)
+        cp1.begin ('ou=ph08', [0, 100])
+        cp1.save  ('ou=ph08', 0, 10)
+        cp2.save  ('ou=ph08', 100, 110)
+        self.assertEqual \
+            (cp1.partitions ('ou=ph08'), [(0, 10), (100, 110)])
+    # end def test_shared_file
+
+# end class Test_Load_Checkpoint
+
+if __name__ == '__main__' :
+    unittest.main ()
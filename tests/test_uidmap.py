@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+import unittest
+
+from tests.fakes import Fake_Connection, Fake_Log
+
+try :
+    import etl
+except ImportError :
+    etl = None
+
+@unittest.skipUnless (etl, "etl needs ldap3 and pytz")
+class Test_UID_Map (unittest.TestCase) :
+
+    base = 'ou=ph08,o=BMUKK'
+
+    def entry (self, cn, uid, deleted = False, **attributes) :
+        atr = dict (attributes, phonlineUniqueId = uid)
+        if deleted :
+            atr ['idnDeleted'] = True
+        return dict (dn = 'cn=%s,%s' % (cn, self.base), attributes = atr)
+    # end def entry
+
+    def setUp (self) :
+        self.log    = Fake_Log ()
+        self.ldcon  = Fake_Connection \
+            ( [ self.entry ('e', '50')
+              , self.entry ('a', ['7'], sn = ['A'])
+              , self.entry ('x', 'garbage')
+              , self.entry ('c', 20, deleted = True)
+              , self.entry ('b', 20, sn = [])
+              , self.entry ('d', '30', sn = 'D')
+              ]
+            )
+        self.uidmap = etl.UID_Map \
+            (self.ldcon, self.base, self.log, attributes = ('sn',))
+    # end def setUp
+
+    def test_build (self) :
+        m = self.uidmap
+        self.assertEqual (len (m), 5)
+        self.assertEqual (list (m.uids), [7, 20, 20, 30, 50])
+        self.assertEqual (len (self.log.errors), 1)
+        self.assertIn ('garbage', self.log.errors [0])
+        base, flt, kw = self.ldcon.searches [0]
+        self.assertEqual (flt, '(phonlineUniqueId=*)')
+        self.assertEqual \
+            (sorted (kw ['attributes']), ['phonlineUniqueId', 'sn'])
+        e = m.entry (0)
+        self.assertEqual (e ['dn'], 'cn=a,' + self.base)
+        self.assertEqual (e ['attributes']['SN'], ['A'])
+        e = [m.entry (i) for i in m.lookup (20)]
+        self.assertTrue (all ('sn' not in x ['attributes'] for x in e))
+    # end def test_build
+
+    def test_lookup_ascending (self) :
+        m = self.uidmap
+        self.assertEqual (list (m.lookup (1)),   [])
+        self.assertEqual (list (m.lookup (7)),   [0])
+        self.assertEqual (list (m.lookup (20)),  [1, 2])
+        self.assertEqual (list (m.lookup (25)),  [])
+        self.assertEqual (list (m.lookup ('30')), [3])
+        self.assertEqual (list (m.lookup (50.0)), [4])
+        self.assertEqual (list (m.lookup (99)),  [])
+    # end def test_lookup_ascending
+
+    def test_lookup_random_order (self) :
+        m = self.uidmap
+        for uid, idx in ((50, [4]), (7, [0]), (30, [3]), (20, [1, 2])) :
+            self.assertEqual (list (m.lookup (uid)), idx)
+        # Repeated lookup of the same uid
+        self.assertEqual (list (m.lookup (20)), [1, 2])
+        self.assertEqual (list (m.lookup (20)), [1, 2])
+        self.assertEqual (list (m.lookup (6)),  [])
+        self.assertEqual (list (m.lookup (7)),  [0])
+    # end def test_lookup_random_order
+
+    def test_mark_seen (self) :
+        m = self.uidmap
+        for uid in (7, 20, 99) :
+            m.mark_seen (uid)
+        self.assertEqual \
+            ( list (m.unseen ())
+            , [(30, 'cn=d,' + self.base), (50, 'cn=e,' + self.base)]
+            )
+        m.mark_seen (50)
+        m.mark_seen (30)
+        self.assertEqual (list (m.unseen ()), [])
+    # end def test_mark_seen
+
+    def test_unseen_deleted (self) :
+        # Entries marked deleted are not seen either, initial_load
+        # deletes them
+        m = self.uidmap
+        for uid in (7, 30, 50) :
+            m.mark_seen (uid)
+        self.assertEqual \
+            ( sorted (m.unseen ())
+            , [(20, 'cn=b,' + self.base), (20, 'cn=c,' + self.base)]
+            )
+    # end def test_unseen_deleted
+
+    def test_deleted_attribute (self) :
+        # idnDeleted is only fetched when asked for
+        m = etl.UID_Map \
+            ( self.ldcon, self.base, self.log
+            , attributes = ('sn', 'idnDeleted')
+            )
+        e = [m.entry (i) for i in m.lookup (20)]
+        self.assertEqual \
+            ( sorted (bool (x ['attributes'].get ('idnDeleted')) for x in e)
+            , [False, True]
+            )
+        self.assertNotIn ('idnDeleted', m.entry (0)['attributes'])
+    # end def test_deleted_attribute
+
+    def test_range (self) :
+        # The server may return entries outside the partition
+        m = etl.UID_Map (self.ldcon, self.base, self.log, start = 20, end = 50)
+        self.assertEqual (list (m.uids), [20, 20, 30])
+        base, flt, kw = self.ldcon.searches [-1]
+        self.assertEqual \
+            ( flt
+            , '(&(phonlineUniqueId=*)(phonlineUniqueId>=20)'
+              '(!(phonlineUniqueId>=50)))'
+            )
+        m = etl.UID_Map (self.ldcon, self.base, self.log, start = 0, end = 8)
+        self.assertEqual (list (m.uids), [7])
+        m = etl.UID_Map (self.ldcon, self.base, self.log, start = 30)
+        self.assertEqual (list (m.uids), [30, 50])
+        self.assertEqual \
+            ( self.ldcon.searches [-1][1]
+            , '(&(phonlineUniqueId=*)(phonlineUniqueId>=30))'
+            )
+    # end def test_range
+
+# end class Test_UID_Map
+
+if __name__ == '__main__' :
+    unittest.main ()
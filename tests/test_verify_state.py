@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from argparse import Namespace
+from datetime import datetime
+from decimal  import Decimal
+
+from tests.fakes import Fake_Log
+
+try :
+    import etl
+    from aes_pkcs7  import AES_Cipher, Password_Diff
+    from sync_state import Sync_State
+except ImportError :
+    etl = None
+
+class Fake_Directory (object) :
+    """ LDAP_Access returning entries by dn
+    """
+
+    def __init__ (self) :
+        self.entries = {}
+    # end def __init__
+
+    def get_by_dn (self, dn) :
+        return self.entries.get (dn.lower ())
+    # end def get_by_dn
+
+# end class Fake_Directory
+
+@unittest.skipUnless (etl, "etl needs ldap3, pytz and pycryptodome")
+class Test_Verify_State (unittest.TestCase) :
+
+    base = 'ou=ph08,o=BMUKK'
+
+    # Database row, numbers as returned by pyodbc
+    row = dict \
+        ( account_status_a      = 'OK'
+        , account_status_b      = None
+        , account_status_st     = 'GESPERRT'
+        , aktiv_a_person        = Decimal ('1')
+        , aktiv_b_person        = Decimal ('0')
+        , aktiv_st_person       = None
+        , benutzergruppen       = 'lehrer'
+        , benutzername          = ' jdoe '
+        , bpk                   = 'BF:abc=='
+        , chipid_a              = 12345.0
+        , chipid_b              = None
+        , chipid_st             = '0042'
+        , emailadresse_b        = 'jdoe@example.com  '
+        , emailadresse_st       = None
+        , funktionen            = 'c;a;b'
+        , geburtsdatum          = datetime (1990, 5, 17)
+        , ident_nr              = 815.0
+        , matrikelnummer        = '01234567'
+        , mirfareid_a           = None
+        , mirfareid_b           = None
+        , mirfareid_st          = None
+        , nachname              = 'Doe '
+        , org_einheiten         = 'x'
+        , passwort              = 'secret'
+        , person_nr             = Decimal ('17')
+        , person_nr_obf         = 'obf'
+        , pk_uniqueid           = 4711.0
+        , pm_sap_personalnummer = '99 '
+        , schulkennzahlen       = '908;907'
+        , st_person_nr          = None
+        , st_person_nr_obf      = None
+        , vorname               = 'John'
+        )
+
+    def setUp (self) :
+        self.dir  = tempfile.mkdtemp ()
+        odbc = self.odbc = etl.ODBC_Connector.__new__ (etl.ODBC_Connector)
+        odbc.args   = Namespace (base_dn = [self.base])
+        odbc.log    = Fake_Log ()
+        odbc.dn     = self.base
+        odbc.table  = 'benutzer_alle_dirxml_v'
+        odbc.fields = {odbc.table : sorted (self.row)}
+        odbc.pwdiff = Password_Diff (AES_Cipher (b'01' * 16))
+        odbc.data_conversion = dict (odbc.data_conversion)
+        odbc.data_conversion ['passwort'] = odbc.from_password
+        odbc.make_converters ()
+        odbc.state  = Sync_State (os.path.join (self.dir, 'state.db'))
+        odbc.ldap   = Fake_Directory ()
+    # end def setUp
+
+    def tearDown (self) :
+        shutil.rmtree (self.dir)
+    # end def tearDown
+
+    def sync (self) :
+        """ Record the row as synced and create its entry in the form
+            ldap3 returns it: Integers for numeric attributes, multiple
+            values in the order of the server, single values as lists.
+        """
+        odbc = self.odbc
+        rw   = odbc.converter.row ([self.row [k] for k in sorted (self.row)])
+        atr  = odbc.new_attributes (rw, '20240101000000Z')
+        for k, v in atr.items () :
+            if isinstance (v, list) :
+                atr [k] = list (reversed (v))
+            elif isinstance (v, (float, Decimal)) or k == 'phonlineIdentNr' :
+                atr [k] = int (v)
+            elif k in ('sn', 'givenName', 'phonlineEmailBediensteter') :
+                atr [k] = [v]
+        dn = 'cn=%s,%s' % (atr ['cn'], self.base)
+        odbc.ldap.entries [dn.lower ()] = dict (dn = dn, attributes = atr)
+        odbc.state.set (self.base, rw.pk_uniqueid, odbc.fingerprint (rw), dn)
+        odbc.state.commit ()
+        return dn, atr
+    # end def sync
+
+    def verify (self) :
+        self.odbc.verify_state ()
+        return self.odbc.log.warnings
+    # end def verify
+
+    def test_fresh_entry_clean (self) :
+        dn, atr = self.sync ()
+        self.assertEqual (self.verify (), [])
+        self.assertEqual (len (self.odbc.state.iter (self.base)), 1)
+    # end def test_fresh_entry_clean
+
+    def test_new_iv_clean (self) :
+        dn, atr = self.sync ()
+        atr ['idnDistributionPassword'] = self.odbc.pwdiff.encrypt ('secret')
+        self.assertEqual (self.verify (), [])
+    # end def test_new_iv_clean
+
+    def test_changed (self) :
+        for k, v in \
+            ( ('sn',                      ['Smith'])
+            , ('phonlineFunktionen',      ['a', 'b'])
+            , ('phonlineWeiterbildungAktiv', 0)
+            , ('idnDistributionPassword', self.odbc.pwdiff.encrypt ('x'))
+            , ('phonlineChipIDStudent',   42)
+            ) :
+            dn, atr = self.sync ()
+            atr [k] = v
+            self.odbc.log.warnings = []
+            self.assertEqual (len (self.verify ()), 1, k)
+            self.assertIn ('attributes differ', self.odbc.log.warnings [0])
+            self.assertEqual (self.odbc.state.iter (self.base), [])
+    # end def test_changed
+
+    def test_deleted_and_missing (self) :
+        dn, atr = self.sync ()
+        atr ['idnDeleted'] = True
+        self.assertIn ('deleted', self.verify () [0])
+        dn, atr = self.sync ()
+        self.odbc.ldap.entries.clear ()
+        self.assertIn ('not found', self.verify () [-1])
+    # end def test_deleted_and_missing
+
+# end class Test_Verify_State
+
+if __name__ == '__main__' :
+    unittest.main ()